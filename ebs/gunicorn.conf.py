@@ -0,0 +1,30 @@
+"""Gunicorn server hooks, loaded from the working directory of the container."""
+
+import os
+import shutil
+from typing import Any
+
+from prometheus_client import multiprocess
+
+
+def on_starting(server: Any) -> None:
+    """Remove metrics written by a previous run of the server.
+
+    :param server: gunicorn arbiter
+    """
+    del server
+    directory = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+
+
+def child_exit(server: Any, worker: Any) -> None:
+    """Stop reporting the live gauges of a worker that exited.
+
+    :param server: gunicorn arbiter
+    :param worker: worker that exited
+    """
+    del server
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(worker.pid)  # type: ignore
@@ -1,18 +1,20 @@
 """Initialize the app."""
 
-import logging
 import sys
 
 from flask import Flask
 from flask_cors import CORS
 
+from mulletwebhook.cache import layout_cache
 from mulletwebhook.config import Config
 from mulletwebhook.database import db
-
-logging.basicConfig(
-    stream=sys.stdout,
-    format="%(asctime)s %(levelname)s %(name)s %(threadName)s : %(message)s",
-)
+from mulletwebhook.delivery import delivery_pool
+from mulletwebhook.images import UploadRequest
+from mulletwebhook.logs import request_logging
+from mulletwebhook.metrics import instrumentation
+from mulletwebhook.profiling import profiler
+from mulletwebhook.storage import image_storage
+from mulletwebhook.twitch import refresh_dispatcher
 
 
 def create_app(config_class: type = Config) -> Flask:
@@ -22,10 +24,15 @@ def create_app(config_class: type = Config) -> Flask:
     :return: initialized flask app
     """
     app = Flask(__name__)
+    # stream uploaded images to temporary files instead of buffering them in memory
+    app.request_class = UploadRequest
     CORS(app)
 
     app.config.from_object(config_class)
 
+    # send log records through a queue and tag them with request ids
+    request_logging.init_app(app)
+
     # set log level
     try:
         app.logger.setLevel(app.config["LOG_LEVEL"])
@@ -37,6 +44,22 @@ def create_app(config_class: type = Config) -> Flask:
     # initialize database
     db.init_app(app)
 
+    # initialize metrics
+    instrumentation.init_app(app)
+
+    # initialize profiling of sampled requests
+    profiler.init_app(app)
+
+    # initialize image storage
+    image_storage.init_app(app)
+
+    # initialize caches
+    layout_cache.init_app(app)
+
+    # initialize background workers
+    delivery_pool.init_app(app)
+    refresh_dispatcher.init_app(app)
+
     # pylint: disable=import-outside-toplevel
     import mulletwebhook.main.routes as main_routes
 
@@ -0,0 +1,102 @@
+"""ASGI entrypoint, for serving the app with an ASGI server such as uvicorn.
+
+The views stay synchronous because Flask-SQLAlchemy sessions are blocking, so the adapter runs each
+request in a pool of threads, the same way gunicorn's gthread workers run it. The outbound calls
+made while handling a request ("Test Webhook") are async and are awaited on the event loop of the
+server, so a slow webhook host doesn't need a thread of its own for the whole request.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, MutableMapping
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+
+from mulletwebhook import create_app
+from mulletwebhook.config import Config
+
+Scope = MutableMapping[str, Any]
+Receive = Callable[[], Awaitable[MutableMapping[str, Any]]]
+Send = Callable[[MutableMapping[str, Any]], Awaitable[None]]
+
+
+class ThreadPoolWsgiToAsgiInstance(WsgiToAsgiInstance):
+    """Handles a single request by running the WSGI app in a thread of the pool."""
+
+    def __init__(self, wsgi_application: Any, executor: ThreadPoolExecutor) -> None:
+        """Create the instance.
+
+        :param wsgi_application: WSGI app to handle the request
+        :param executor: pool of threads to run the WSGI app in
+        """
+        super().__init__(wsgi_application)  # type: ignore
+        self.executor = executor
+
+    # run_wsgi_app is async in WsgiToAsgiInstance too, it is wrapped by sync_to_async
+    async def run_wsgi_app(self, body: Any) -> None:  # pylint: disable=invalid-overridden-method
+        """Run the WSGI app in the thread pool.
+
+        WsgiToAsgiInstance runs the app with thread_sensitive sync_to_async, which runs every
+        request of the process in the same thread, one at a time.
+
+        :param body: file containing the request body
+        """
+        run_wsgi_app = vars(WsgiToAsgiInstance)["run_wsgi_app"].func
+        await sync_to_async(run_wsgi_app, thread_sensitive=False, executor=self.executor)(
+            self, body
+        )
+
+
+class ThreadPoolWsgiToAsgi(WsgiToAsgi):
+    """WSGI to ASGI adapter that handles requests concurrently in a pool of threads."""
+
+    def __init__(self, wsgi_application: Any, threads: int) -> None:
+        """Create the adapter.
+
+        :param wsgi_application: WSGI app to serve
+        :param threads: number of requests that are handled at the same time
+        """
+        super().__init__(wsgi_application)  # type: ignore
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="asgi")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Handle a connection.
+
+        :param scope: details of the connection
+        :param receive: function that receives messages from the client
+        :param send: function that sends messages to the client
+        """
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+
+        await ThreadPoolWsgiToAsgiInstance(self.wsgi_application, self.executor)(
+            scope, receive, send
+        )
+
+    async def lifespan(self, receive: Receive, send: Send) -> None:
+        """Handle the startup and shutdown of the server, shutting down the thread pool on exit.
+
+        :param receive: function that receives lifespan events from the server
+        :param send: function that sends lifespan events to the server
+        """
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+def create_asgi_app(config_class: type = Config) -> ThreadPoolWsgiToAsgi:
+    """Creates the mulletwebhook app wrapped in an ASGI adapter.
+
+    e.g. uvicorn --factory mulletwebhook.asgi:create_asgi_app
+
+    :param config_class: class to use for app configuration
+    :return: ASGI application
+    """
+    app = create_app(config_class)
+    return ThreadPoolWsgiToAsgi(app, app.config["ASGI_THREADS"])
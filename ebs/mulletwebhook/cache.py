@@ -0,0 +1,134 @@
+"""In-process caches."""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, Optional, TypeVar
+
+from flask import Flask
+
+V = TypeVar("V")
+
+
+class TTLCache(Generic[V]):
+    """Thread safe LRU cache where entries also expire after a fixed time to live."""
+
+    def __init__(self, maxsize: int = 128, ttl: float = 60) -> None:
+        """Create an empty cache.
+
+        :param maxsize: maximum number of entries before the least recently used is evicted
+        :param ttl: number of seconds an entry is valid for after it is set
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Hashable, tuple[float, V]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[V]:
+        """Get an entry from the cache.
+
+        :param key: key of the entry
+        :return: the cached value, or None if it is missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: V, ttl: Optional[float] = None) -> None:
+        """Add or replace an entry in the cache.
+
+        :param key: key of the entry
+        :param value: value to cache
+        :param ttl: number of seconds the entry is valid for, defaults to the ttl of the cache
+        """
+        if ttl is None:
+            ttl = self.ttl
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def discard(self, predicate: Callable[[Hashable], bool]) -> None:
+        """Remove all entries with keys matching a predicate.
+
+        :param predicate: function that returns True for keys that should be removed
+        """
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        """Remove all entries from the cache."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class LayoutCache:
+    """Cache of rendered layout html.
+
+    Entries are keyed by layout id, edit mode and the layout version. The version is stored in the
+    database and is incremented whenever a layout is modified, so stale entries are never served by
+    any worker process. Entries are also removed explicitly from the local process when a layout is
+    invalidated.
+    """
+
+    def __init__(self) -> None:
+        self.cache: TTLCache[str] = TTLCache()
+
+    def init_app(self, app: Flask) -> None:
+        """Configure the cache for an app.
+
+        :param app: app to read the cache configuration from
+        """
+        self.cache = TTLCache(
+            maxsize=app.config["LAYOUT_CACHE_SIZE"], ttl=app.config["LAYOUT_CACHE_TTL"]
+        )
+
+    def get(self, layout_id: int, edit: bool, version: int) -> Optional[str]:
+        """Get the rendered html of a layout.
+
+        :param layout_id: id of the layout
+        :param edit: whether the html was rendered with editing controls
+        :param version: version of the layout that was rendered
+        :return: the rendered html, or None if it is not cached
+        """
+        return self.cache.get((layout_id, edit, version))
+
+    def set(self, layout_id: int, edit: bool, version: int, html: str) -> None:
+        """Store the rendered html of a layout.
+
+        :param layout_id: id of the layout
+        :param edit: whether the html was rendered with editing controls
+        :param version: version of the layout that was rendered
+        :param html: rendered html
+        """
+        self.cache.set((layout_id, edit, version), html)
+
+    def invalidate(self, layout_id: int) -> None:
+        """Remove all cached html for a layout.
+
+        :param layout_id: id of the layout
+        """
+        self.cache.discard(lambda key: isinstance(key, tuple) and key[0] == layout_id)
+
+
+layout_cache = LayoutCache()
@@ -13,7 +13,57 @@ class Config:
     CLIENT_ID = os.environ.get(f"{PREFIX}CLIENT_ID") or ""
     SQLALCHEMY_DATABASE_URI = os.environ.get(f"{PREFIX}SQLALCHEMY_DATABASE_URI") or ""
     EBS_URL = os.environ.get(f"{PREFIX}EBS_URL") or ""
+    METRICS_TOKEN = os.environ.get(f"{PREFIX}METRICS_TOKEN") or ""
+    PROFILE_SAMPLE_RATE: float = float((os.environ.get(f"{PREFIX}PROFILE_SAMPLE_RATE") or 0))
+    PROFILE_SECRET = os.environ.get(f"{PREFIX}PROFILE_SECRET") or ""
+    PROFILE_DIR = os.environ.get(f"{PREFIX}PROFILE_DIR") or "/tmp/mulletwebhook-profiles"
+    PROFILE_MAX_BYTES: int = int((os.environ.get(f"{PREFIX}PROFILE_MAX_BYTES") or 104857600))
     LOG_LEVEL = os.environ.get(f"{PREFIX}LOG_LEVEL") or "INFO"
+    LOG_FORMAT = os.environ.get(f"{PREFIX}LOG_FORMAT") or "json"
+    # fraction of the records below WARNING to log for each logger, e.g. "werkzeug=0.1"
+    LOG_SAMPLE_RATES: dict[str, float] = {
+        name: float(rate)
+        for name, rate in (
+            item.split("=")
+            for item in (os.environ.get(f"{PREFIX}LOG_SAMPLE_RATES") or "").split(",")
+            if item
+        )
+    }
     TESTING = (os.environ.get(f"{PREFIX}TESTING") == "True") or False
     REQUEST_TIMEOUT: int = int((os.environ.get(f"{PREFIX}REQUEST_TIMEOUT") or 5))
     WTF_CSRF_ENABLED = False
+    LAYOUT_CACHE_SIZE: int = int((os.environ.get(f"{PREFIX}LAYOUT_CACHE_SIZE") or 1024))
+    LAYOUT_CACHE_TTL: int = int((os.environ.get(f"{PREFIX}LAYOUT_CACHE_TTL") or 300))
+    HTTP_POOL_CONNECTIONS: int = int((os.environ.get(f"{PREFIX}HTTP_POOL_CONNECTIONS") or 10))
+    HTTP_POOL_MAXSIZE: int = int((os.environ.get(f"{PREFIX}HTTP_POOL_MAXSIZE") or 10))
+    HTTP_RETRIES: int = int((os.environ.get(f"{PREFIX}HTTP_RETRIES") or 2))
+    HTTP_RETRY_BACKOFF: float = float((os.environ.get(f"{PREFIX}HTTP_RETRY_BACKOFF") or 0.5))
+    HTTP_MAX_IN_FLIGHT_PER_HOST: int = int(
+        (os.environ.get(f"{PREFIX}HTTP_MAX_IN_FLIGHT_PER_HOST") or 5)
+    )
+    BREAKER_FAILURE_THRESHOLD: int = int(
+        (os.environ.get(f"{PREFIX}BREAKER_FAILURE_THRESHOLD") or 5)
+    )
+    BREAKER_RESET_TIMEOUT: float = float((os.environ.get(f"{PREFIX}BREAKER_RESET_TIMEOUT") or 30))
+    TWITCH_API_URL = os.environ.get(f"{PREFIX}TWITCH_API_URL") or "https://api.twitch.tv/helix"
+    ASGI_THREADS: int = int((os.environ.get(f"{PREFIX}ASGI_THREADS") or 8))
+    PUBSUB_REFRESH_WINDOW: float = float((os.environ.get(f"{PREFIX}PUBSUB_REFRESH_WINDOW") or 1.0))
+    IMAGE_STORAGE = os.environ.get(f"{PREFIX}IMAGE_STORAGE") or "database"
+    IMAGE_STORAGE_PATH = os.environ.get(f"{PREFIX}IMAGE_STORAGE_PATH") or "/var/lib/mulletwebhook"
+    IMAGE_SENDFILE_HEADER = os.environ.get(f"{PREFIX}IMAGE_SENDFILE_HEADER") or ""
+    IMAGE_SENDFILE_PREFIX = os.environ.get(f"{PREFIX}IMAGE_SENDFILE_PREFIX") or "/images/"
+    IMAGE_MAX_SIZE: int = int((os.environ.get(f"{PREFIX}IMAGE_MAX_SIZE") or 1048576))
+    IMAGE_SPOOL_SIZE: int = int((os.environ.get(f"{PREFIX}IMAGE_SPOOL_SIZE") or 262144))
+    # leave room for the multipart encoding and other form fields around the image
+    MAX_CONTENT_LENGTH: int = IMAGE_MAX_SIZE + 65536
+    IMAGE_WIDTHS: list[int] = [
+        int(width) for width in (os.environ.get(f"{PREFIX}IMAGE_WIDTHS") or "140,280").split(",")
+    ]
+    IMAGE_DISPLAY_WIDTH: int = int((os.environ.get(f"{PREFIX}IMAGE_DISPLAY_WIDTH") or 140))
+    IMAGE_WEBP_QUALITY: int = int((os.environ.get(f"{PREFIX}IMAGE_WEBP_QUALITY") or 85))
+    DELIVERY_WORKERS: int = int((os.environ.get(f"{PREFIX}DELIVERY_WORKERS") or 4))
+    DELIVERY_MAX_ATTEMPTS: int = int((os.environ.get(f"{PREFIX}DELIVERY_MAX_ATTEMPTS") or 5))
+    DELIVERY_RETRY_BACKOFF: int = int((os.environ.get(f"{PREFIX}DELIVERY_RETRY_BACKOFF") or 2))
+    DELIVERY_POLL_INTERVAL: int = int((os.environ.get(f"{PREFIX}DELIVERY_POLL_INTERVAL") or 5))
+    DELIVERY_CLAIM_TIMEOUT: int = int((os.environ.get(f"{PREFIX}DELIVERY_CLAIM_TIMEOUT") or 60))
+    DELIVERY_TTL: int = int((os.environ.get(f"{PREFIX}DELIVERY_TTL") or 604800))
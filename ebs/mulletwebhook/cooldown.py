@@ -0,0 +1,138 @@
+"""Rate limiting of webhook redemptions using the cooldown of each webhook."""
+
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import or_, select, update
+
+from mulletwebhook import utils
+from mulletwebhook.cache import TTLCache
+from mulletwebhook.database import db
+from mulletwebhook.models.element import Webhook
+
+# maximum number of webhooks to remember the cooldown of in each process
+COOLDOWN_CACHE_SIZE = 4096
+# maximum number of seconds a cooldown is remembered for without checking the database, so that
+# processes that didn't handle an edit of the cooldown only use the old cooldown briefly
+COOLDOWN_CACHE_TTL = 5.0
+
+# time each webhook is cooling down until, so that redemptions during a cooldown are rejected
+# without querying the database
+cooldowns: TTLCache[datetime] = TTLCache(maxsize=COOLDOWN_CACHE_SIZE, ttl=COOLDOWN_CACHE_TTL)
+
+
+class CooldownActive(Exception):
+    """Raised when a webhook is redeemed before its cooldown has finished."""
+
+    def __init__(self, webhook_id: int, retry_after: float) -> None:
+        """Create the exception.
+
+        :param webhook_id: id of the webhook that is cooling down
+        :param retry_after: number of seconds until the webhook can be redeemed again
+        """
+        super().__init__(f"webhook {webhook_id} can be redeemed again in {retry_after:.1f}s")
+        self.webhook_id = webhook_id
+        self.retry_after = retry_after
+
+
+def get_retry_after(webhook_id: int) -> Optional[float]:
+    """Check if a webhook is known to be cooling down, without querying the database.
+
+    :param webhook_id: id of the webhook
+    :return: number of seconds until the webhook can be redeemed again, or None if this process
+        doesn't know of a cooldown
+    """
+    available = cooldowns.get(webhook_id)
+    if available is None:
+        return None
+
+    retry_after = (available - utils.utcnow()).total_seconds()
+    return retry_after if retry_after > 0 else None
+
+
+def remember(webhook_id: int, available: datetime) -> None:
+    """Remember that a webhook is cooling down, so this process can reject redemptions early.
+
+    Only committed cooldowns should be remembered, so a redemption that is rolled back never causes
+    others to be rejected.
+
+    :param webhook_id: id of the webhook
+    :param available: time the webhook can be redeemed again
+    """
+    retry_after = (available - utils.utcnow()).total_seconds()
+    if retry_after > 0:
+        cooldowns.set(webhook_id, available, ttl=min(retry_after, COOLDOWN_CACHE_TTL))
+
+
+def check(webhook: Webhook) -> Optional[float]:
+    """Check if a webhook is cooling down, without triggering it.
+
+    :param webhook: webhook that is about to be redeemed
+    :return: number of seconds until the webhook can be redeemed again, or None if it can be
+        redeemed now
+    """
+    retry_after = get_retry_after(webhook.id)
+    if retry_after is not None:
+        return retry_after
+
+    if not webhook.cooldown or webhook.last_triggered is None:
+        return None
+
+    available = webhook.last_triggered + timedelta(seconds=webhook.cooldown)
+    retry_after = (available - utils.utcnow()).total_seconds()
+    if retry_after <= 0:
+        return None
+
+    remember(webhook.id, available)
+    return retry_after
+
+
+def trigger(webhook: Webhook) -> Optional[datetime]:
+    """Record that a webhook was triggered, if its cooldown has finished.
+
+    The check and update are done by a single conditional UPDATE as part of the current transaction,
+    so only one of any concurrent redemptions can trigger the webhook, even across processes. Times
+    come from the clock of the database, so processes with different clocks agree on the cooldown.
+
+    :param webhook: webhook being redeemed
+    :raises CooldownActive: if the webhook was triggered less than its cooldown ago
+    :return: time the webhook is cooling down until, which should be passed to remember() once the
+        transaction is committed, or None if the webhook has no cooldown
+    """
+    if not webhook.cooldown:
+        # always trigger, even if a concurrent redemption recorded a later time first
+        Webhook.query.filter(Webhook.id == webhook.id).update(
+            {"last_triggered": utils.database_utcnow()}, synchronize_session=False
+        )
+        return None
+
+    triggered = db.session.execute(
+        update(Webhook)
+        .where(
+            Webhook.id == webhook.id,  # type: ignore
+            or_(
+                Webhook.last_triggered.is_(None),  # type: ignore
+                Webhook.last_triggered <= utils.database_utcnow(-webhook.cooldown),
+            ),
+        )
+        .values(last_triggered=utils.database_utcnow())
+        .returning(Webhook.last_triggered)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+
+    cooldown = timedelta(seconds=webhook.cooldown)
+    if triggered is not None:
+        available: datetime = triggered + cooldown
+        return available
+
+    last_triggered, now = db.session.execute(
+        select(Webhook.last_triggered, utils.database_utcnow()).where(  # type: ignore
+            Webhook.id == webhook.id
+        )
+    ).one()
+    # wait at least a second in case the cooldown finishes while the response is sent
+    retry_after = max((last_triggered + cooldown - now).total_seconds(), 1.0)
+    # the cooldown was committed by the redemption that triggered the webhook
+    remember(webhook.id, utils.utcnow() + timedelta(seconds=retry_after))
+
+    raise CooldownActive(webhook.id, retry_after)
@@ -0,0 +1,222 @@
+"""Background delivery of webhooks from the delivery outbox."""
+
+import os
+import queue
+import threading
+import time
+from datetime import timedelta
+from typing import Optional
+
+import requests
+from flask import Flask, current_app
+
+from mulletwebhook import http_client, metrics, utils
+from mulletwebhook.database import db
+from mulletwebhook.models.delivery import Delivery
+from mulletwebhook.models.enums import DeliveryStatus
+
+# maximum number of characters of the webhook response to keep
+MAX_RESPONSE_TEXT = 2000
+# number of seconds between removing expired deliveries
+PRUNE_INTERVAL = 3600
+# minimum number of seconds to wait before retrying a delivery that the circuit breaker rejected
+DEFERRED_RETRY_MIN = 1.0
+
+
+class DeliveryWorkerPool:
+    """Pool of threads that send webhooks from the delivery outbox.
+
+    A delivery is claimed with a conditional update that moves its next_attempt time into the
+    future, so it is only sent by one worker at a time across all processes. Deliveries claimed by a
+    worker that dies are picked up again by the poller once the claim expires.
+    """
+
+    def __init__(self) -> None:
+        self.app: Optional[Flask] = None
+        self._queue: queue.Queue[int] = queue.Queue()
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+
+    def init_app(self, app: Flask) -> None:
+        """Configure the pool for an app.
+
+        The worker threads are started on the first request handled by each process, since threads
+        started before gunicorn forks its workers (when using --preload) do not survive the fork.
+
+        :param app: app to send deliveries for
+        """
+        self.app = app
+        if app.config["DELIVERY_WORKERS"] > 0:
+            app.before_request(self.ensure_started)
+
+    def ensure_started(self) -> None:
+        """Start the worker threads if they are not already running in the current process."""
+        if self._pid == os.getpid():
+            return
+
+        assert self.app is not None
+
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+
+            self._queue = queue.Queue()
+            for index in range(self.app.config["DELIVERY_WORKERS"]):
+                threading.Thread(
+                    target=self._work, name=f"delivery-worker-{index}", daemon=True
+                ).start()
+            threading.Thread(target=self._poll, name="delivery-poller", daemon=True).start()
+            self._pid = os.getpid()
+
+            self.app.logger.info("started %s delivery workers", self.app.config["DELIVERY_WORKERS"])
+
+    def enqueue(self, delivery_id: int) -> None:
+        """Queue a delivery to be sent as soon as a worker is free.
+
+        :param delivery_id: id of the delivery to send
+        """
+        assert self.app is not None
+
+        if self.app.config["DELIVERY_WORKERS"] > 0:
+            self.ensure_started()
+            self._queue.put(delivery_id)
+
+    def _work(self) -> None:
+        """Send deliveries from the queue until the process exits."""
+        assert self.app is not None
+
+        while True:
+            delivery_id = self._queue.get()
+            try:
+                with self.app.app_context():
+                    send_delivery(delivery_id)
+            except Exception:  # pylint: disable=broad-exception-caught
+                self.app.logger.exception("error sending delivery_id=%s", delivery_id)
+
+    def _poll(self) -> None:
+        """Periodically queue deliveries that are due to be retried, and remove expired ones."""
+        assert self.app is not None
+
+        last_pruned = 0.0
+        while True:
+            time.sleep(self.app.config["DELIVERY_POLL_INTERVAL"])
+            try:
+                with self.app.app_context():
+                    for delivery_id in get_due_deliveries():
+                        self._queue.put(delivery_id)
+
+                    if time.monotonic() - last_pruned >= PRUNE_INTERVAL:
+                        prune_deliveries()
+                        last_pruned = time.monotonic()
+            except Exception:  # pylint: disable=broad-exception-caught
+                self.app.logger.exception("error polling for deliveries")
+
+
+def get_due_deliveries(limit: int = 100) -> list[int]:
+    """Get deliveries that are waiting to be sent.
+
+    :param limit: maximum number of deliveries to return
+    :return: ids of deliveries that are due to be sent, oldest first
+    """
+    deliveries = (
+        Delivery.query.with_entities(Delivery.id)
+        .filter(
+            Delivery.status == DeliveryStatus.pending,
+            Delivery.next_attempt <= utils.utcnow(),
+        )
+        .order_by(Delivery.next_attempt)
+        .limit(limit)
+        .all()
+    )
+    return [delivery.id for delivery in deliveries]
+
+
+def prune_deliveries() -> int:
+    """Remove finished deliveries that are older than the configured time to live.
+
+    Once a delivery is removed, its transaction id can no longer be used to detect a retried
+    redemption.
+
+    :return: number of deliveries removed
+    """
+    expired = utils.utcnow() - timedelta(seconds=current_app.config["DELIVERY_TTL"])
+    pruned: int = Delivery.query.filter(
+        Delivery.status != DeliveryStatus.pending, Delivery.date_created < expired
+    ).delete(synchronize_session=False)
+    db.session.commit()
+
+    if pruned:
+        current_app.logger.info("removed %s expired deliveries", pruned)
+    return pruned
+
+
+def claim_delivery(delivery_id: int) -> Optional[Delivery]:
+    """Claim a delivery so that no other worker sends it at the same time.
+
+    :param delivery_id: id of the delivery to claim
+    :return: the claimed delivery, or None if it is not due or was claimed by another worker
+    """
+    now = utils.utcnow()
+    claim_timeout = timedelta(seconds=current_app.config["DELIVERY_CLAIM_TIMEOUT"])
+    claimed = Delivery.query.filter(
+        Delivery.id == delivery_id,
+        Delivery.status == DeliveryStatus.pending,
+        Delivery.next_attempt <= now,
+    ).update(
+        {"next_attempt": now + claim_timeout, "attempts": Delivery.attempts + 1},
+        synchronize_session=False,
+    )
+    db.session.commit()
+
+    if claimed != 1:
+        return None
+
+    delivery: Delivery = Delivery.query.filter(Delivery.id == delivery_id).one()
+    return delivery
+
+
+def send_delivery(delivery_id: int) -> None:
+    """Send a webhook from the delivery outbox, scheduling a retry if it fails.
+
+    :param delivery_id: id of the delivery to send
+    """
+    delivery = claim_delivery(delivery_id)
+    if delivery is None:
+        return
+
+    current_app.logger.debug("sending delivery_id=%s attempt=%s", delivery.id, delivery.attempts)
+
+    retry = True
+    try:
+        resp = http_client.post(
+            delivery.url, json=delivery.payload, timeout=current_app.config["REQUEST_TIMEOUT"]
+        )
+        delivery.response_status = resp.status_code
+        delivery.response_text = resp.text[:MAX_RESPONSE_TEXT]
+        # client errors other than rate limiting will not succeed if retried
+        retry = resp.status_code >= 500 or resp.status_code == 429
+        resp.raise_for_status()
+        delivery.status = DeliveryStatus.delivered
+    except http_client.CircuitOpenError as exp:
+        # the webhook wasn't sent, so it doesn't use up an attempt and is retried once the host's
+        # circuit breaker lets requests through again
+        current_app.logger.info("delivery_id=%s deferred: %s", delivery.id, exp)
+        delivery.attempts -= 1
+        retry_after = max(exp.retry_after, DEFERRED_RETRY_MIN)
+        delivery.next_attempt = utils.utcnow() + timedelta(seconds=retry_after)
+    except requests.RequestException as exp:
+        current_app.logger.warning(
+            "delivery_id=%s attempt=%s failed: %s", delivery.id, delivery.attempts, exp
+        )
+        if not retry or delivery.attempts >= current_app.config["DELIVERY_MAX_ATTEMPTS"]:
+            delivery.status = DeliveryStatus.failed
+        else:
+            backoff = current_app.config["DELIVERY_RETRY_BACKOFF"] * 2 ** (delivery.attempts - 1)
+            delivery.next_attempt = utils.utcnow() + timedelta(seconds=backoff)
+
+    result = "retrying" if delivery.status == DeliveryStatus.pending else delivery.status.name
+    db.session.commit()
+    metrics.DELIVERIES.labels(result).inc()
+
+
+delivery_pool = DeliveryWorkerPool()
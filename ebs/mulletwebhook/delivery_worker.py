@@ -0,0 +1,18 @@
+"""Run the webhook delivery workers as a standalone process."""
+
+import threading
+
+from mulletwebhook import create_app
+from mulletwebhook.delivery import delivery_pool
+
+
+def main() -> None:
+    """Run the delivery workers in the foreground."""
+    app = create_app()
+    delivery_pool.ensure_started()
+    app.logger.info("delivery workers running")
+    threading.Event().wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+"""Shared HTTP clients for outbound requests."""
+
+import os
+import threading
+import time
+from typing import Any, Optional
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from flask import current_app
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from mulletwebhook import metrics
+
+# host label used in metrics for requests to hosts other than the Twitch API, so the number of
+# label values doesn't grow with the number of webhook hosts
+WEBHOOK_HOST_LABEL = "webhook"
+
+_lock = threading.Lock()
+_session: Optional[requests.Session] = None  # pylint: disable=invalid-name
+_session_pid: Optional[int] = None  # pylint: disable=invalid-name
+
+
+def create_session() -> requests.Session:
+    """Create a HTTP session that keeps connections to each host alive.
+
+    Connection errors are retried for all requests. Requests that were sent are only retried for
+    idempotent methods, so webhooks are never sent twice by the retry adapter.
+
+    :return: new session configured from the app config
+    """
+    retry = Retry(
+        total=current_app.config["HTTP_RETRIES"],
+        backoff_factor=current_app.config["HTTP_RETRY_BACKOFF"],
+        status_forcelist=(502, 503, 504),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=current_app.config["HTTP_POOL_CONNECTIONS"],
+        pool_maxsize=current_app.config["HTTP_POOL_MAXSIZE"],
+        max_retries=retry,
+    )
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    return session
+
+
+def get_session() -> requests.Session:
+    """Get the HTTP session for the current process.
+
+    A new session is created after a fork (e.g. gunicorn workers started with --preload) so that
+    processes never share pooled connections.
+
+    :return: session shared by all threads in the current process
+    """
+    global _session, _session_pid  # pylint: disable=global-statement
+
+    if _session is not None and _session_pid == os.getpid():
+        return _session
+
+    with _lock:
+        if _session is None or _session_pid != os.getpid():
+            _session = create_session()
+            _session_pid = os.getpid()
+
+    return _session
+
+
+def create_async_client() -> httpx.AsyncClient:
+    """Create an async HTTP client that keeps connections to each host alive.
+
+    Connection errors are retried, the same as for the requests session. A client can only be used
+    in the event loop it was first used in.
+
+    :return: new client configured from the app config
+    """
+    transport = httpx.AsyncHTTPTransport(
+        retries=current_app.config["HTTP_RETRIES"],
+        limits=httpx.Limits(
+            max_connections=None,
+            max_keepalive_connections=current_app.config["HTTP_POOL_CONNECTIONS"]
+            * current_app.config["HTTP_POOL_MAXSIZE"],
+        ),
+    )
+    return httpx.AsyncClient(transport=transport)
+
+
+def get_metric_host(host: str) -> str:
+    """Get the label used for a host in metrics.
+
+    :param host: host (and port) a request is being sent to
+    :return: the host if it is the Twitch API, otherwise the label shared by all webhook hosts
+    """
+    if host == urlsplit(current_app.config["TWITCH_API_URL"]).netloc:
+        return host
+    return WEBHOOK_HOST_LABEL
+
+
+class CircuitOpenError(requests.RequestException):
+    """Raised instead of sending a request to a host that is failing or has too many requests."""
+
+    def __init__(self, message: str, retry_after: float) -> None:
+        """Create the exception.
+
+        :param message: reason the request was not sent
+        :param retry_after: number of seconds until the breaker can let a request through again
+        """
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Circuit breaker and bulkhead for requests to a single host.
+
+    The breaker opens after a number of consecutive failures, so requests fail fast instead of
+    waiting for a host that is down. Once the reset timeout has passed, a single probe request is
+    allowed through (half-open) and the breaker closes again if it succeeds. The number of requests
+    in flight to the host is also limited, so a slow host can't tie up every worker.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        host: str,
+        failure_threshold: int,
+        reset_timeout: float,
+        max_in_flight: int,
+        metric_host: Optional[str] = None,
+    ) -> None:
+        """Create the breaker.
+
+        :param host: host (and port) the breaker is for
+        :param failure_threshold: number of consecutive failures before the breaker opens
+        :param reset_timeout: number of seconds the breaker stays open before probing the host
+        :param max_in_flight: maximum number of concurrent requests to the host
+        :param metric_host: label used for the host in metrics, defaults to the host
+        """
+        self.host = host
+        self.metric_host = metric_host or host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_in_flight = max_in_flight
+        self.state = self.CLOSED
+        self.failures = 0
+        self.in_flight = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Reserve a request to the host.
+
+        :raises CircuitOpenError: if the breaker is open, a probe is already in flight or the
+            maximum number of requests are in flight
+        """
+        with self._lock:
+            if self.state == self.OPEN:
+                retry_after = self.opened_at + self.reset_timeout - time.monotonic()
+                if retry_after > 0:
+                    raise CircuitOpenError("circuit breaker is open", retry_after)
+                self.set_state(self.HALF_OPEN)
+            elif self.state == self.HALF_OPEN:
+                # the breaker opens again for the reset timeout if the probe fails
+                raise CircuitOpenError(
+                    "circuit breaker is waiting for a probe request", self.reset_timeout
+                )
+
+            if self.in_flight >= self.max_in_flight:
+                raise CircuitOpenError(f"{self.in_flight} requests are already in flight", 0.0)
+            self.in_flight += 1
+            metrics.HTTP_CLIENT_IN_FLIGHT.labels(self.metric_host).inc()
+
+    def release(self, success: bool) -> None:
+        """Record the result of a request reserved with acquire().
+
+        :param success: whether the host responded without a server error
+        """
+        with self._lock:
+            self.in_flight -= 1
+            metrics.HTTP_CLIENT_IN_FLIGHT.labels(self.metric_host).dec()
+            if success:
+                self.failures = 0
+                self.set_state(self.CLOSED)
+                return
+
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.set_state(self.OPEN)
+                self.opened_at = time.monotonic()
+
+    def set_state(self, state: str) -> None:
+        """Change the state of the breaker, while holding the lock of the breaker.
+
+        :param state: new state
+        """
+        if state == self.state:
+            return
+
+        if self.state != self.CLOSED:
+            metrics.CIRCUIT_BREAKERS.labels(self.metric_host, self.state).dec()
+        if state != self.CLOSED:
+            metrics.CIRCUIT_BREAKERS.labels(self.metric_host, state).inc()
+        self.state = state
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_breakers_pid: Optional[int] = None  # pylint: disable=invalid-name
+
+
+def get_breaker(host: str) -> CircuitBreaker:
+    """Get the circuit breaker for a host in the current process.
+
+    :param host: host (and port) the request is being sent to
+    :return: circuit breaker shared by all threads in the current process
+    """
+    global _breakers_pid  # pylint: disable=global-statement
+
+    with _lock:
+        if _breakers_pid != os.getpid():
+            _breakers.clear()
+            _breakers_pid = os.getpid()
+
+        breaker = _breakers.get(host)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                host,
+                current_app.config["BREAKER_FAILURE_THRESHOLD"],
+                current_app.config["BREAKER_RESET_TIMEOUT"],
+                current_app.config["HTTP_MAX_IN_FLIGHT_PER_HOST"],
+                get_metric_host(host),
+            )
+            _breakers[host] = breaker
+
+    return breaker
+
+
+def acquire_breaker(url: str) -> CircuitBreaker:
+    """Reserve a request through the circuit breaker of the destination host.
+
+    :param url: url the request is being sent to
+    :raises CircuitOpenError: if the request can't be sent because the host is failing or busy
+    :return: breaker the request must be released to once it completes
+    """
+    breaker = get_breaker(urlsplit(url).netloc)
+    try:
+        breaker.acquire()
+    except CircuitOpenError:
+        metrics.HTTP_CLIENT_REJECTED.labels(breaker.metric_host).inc()
+        raise
+
+    return breaker
+
+
+def post(url: str, **kwargs: Any) -> requests.Response:
+    """Send a POST request through the circuit breaker of the destination host.
+
+    Connection errors, timeouts and server errors count as failures. Client errors mean the host is
+    up, so they don't open the breaker.
+
+    :param url: url to send the request to
+    :param kwargs: arguments passed on to requests.Session.post
+    :raises CircuitOpenError: if the request was not sent because the host is failing or busy
+    :return: response from the host
+    """
+    breaker = acquire_breaker(url)
+    success = False
+    try:
+        resp = timed_post(url, **kwargs)
+        success = resp.status_code < 500
+    finally:
+        breaker.release(success)
+
+    return resp
+
+
+def timed_post(url: str, **kwargs: Any) -> requests.Response:
+    """Send a POST request using the shared session, recording its latency in metrics.
+
+    :param url: url to send the request to
+    :param kwargs: arguments passed on to requests.Session.post
+    :return: response from the host
+    """
+    host = get_metric_host(urlsplit(url).netloc)
+    start = time.perf_counter()
+    try:
+        resp = get_session().post(url, **kwargs)
+    except requests.RequestException as exp:
+        metrics.HTTP_CLIENT_DURATION.labels(host, exp.__class__.__name__).observe(
+            time.perf_counter() - start
+        )
+        raise
+
+    metrics.HTTP_CLIENT_DURATION.labels(host, resp.status_code).observe(time.perf_counter() - start)
+    return resp
+
+
+async def async_post(client: httpx.AsyncClient, url: str, **kwargs: Any) -> httpx.Response:
+    """Send a POST request with an async client through the circuit breaker of the destination host.
+
+    Failures are counted the same way as for post().
+
+    :param client: client to send the request with
+    :param url: url to send the request to
+    :param kwargs: arguments passed on to httpx.AsyncClient.post
+    :raises CircuitOpenError: if the request was not sent because the host is failing or busy
+    :return: response from the host
+    """
+    breaker = acquire_breaker(url)
+    success = False
+    try:
+        resp = await async_timed_post(client, url, **kwargs)
+        success = resp.status_code < 500
+    finally:
+        breaker.release(success)
+
+    return resp
+
+
+async def async_timed_post(client: httpx.AsyncClient, url: str, **kwargs: Any) -> httpx.Response:
+    """Send a POST request with an async client, recording its latency in metrics.
+
+    :param client: client to send the request with
+    :param url: url to send the request to
+    :param kwargs: arguments passed on to httpx.AsyncClient.post
+    :return: response from the host
+    """
+    host = get_metric_host(urlsplit(url).netloc)
+    start = time.perf_counter()
+    try:
+        resp = await client.post(url, **kwargs)
+    except httpx.HTTPError as exp:
+        metrics.HTTP_CLIENT_DURATION.labels(host, exp.__class__.__name__).observe(
+            time.perf_counter() - start
+        )
+        raise
+
+    metrics.HTTP_CLIENT_DURATION.labels(host, resp.status_code).observe(time.perf_counter() - start)
+    return resp
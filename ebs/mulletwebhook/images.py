@@ -0,0 +1,212 @@
+"""Processing of uploaded images."""
+
+import hashlib
+import io
+import tempfile
+from typing import IO, Any, Optional
+
+from flask import Request, current_app
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from mulletwebhook.models.element import Element, Image, ImageVariant
+from mulletwebhook.storage import image_storage
+
+try:
+    from PIL import Image as PILImage
+except ImportError:  # pragma: no cover
+    # Pillow is optional, images are stored as they were uploaded without it
+    PILImage = None  # type: ignore
+
+# size of the chunks files are read in when they are hashed
+CHUNK_SIZE = 65536
+
+
+class SpooledUpload(tempfile.SpooledTemporaryFile[bytes]):
+    """Temporary file that uploaded files are streamed into while the request body is parsed.
+
+    The data is hashed as it is written, and writing fails as soon as the upload is larger than the
+    size limit so the rest of the request body is never read.
+    """
+
+    def __init__(self, spool_size: int, max_size: int) -> None:
+        """Create an empty upload file.
+
+        :param spool_size: size the upload is kept in memory up to before it is written to disk
+        :param max_size: maximum size of the upload
+        """
+        super().__init__(max_size=spool_size)
+        self.max_size = max_size
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+
+    def write(self, s: bytes) -> int:  # type: ignore
+        """Write a chunk of the upload.
+
+        :param s: chunk of uploaded data
+        :raises RequestEntityTooLarge: if the upload is larger than the size limit
+        :return: number of bytes written
+        """
+        self.size += len(s)
+        if self.size > self.max_size:
+            raise RequestEntityTooLarge()
+        self.sha256.update(s)
+        return super().write(s)
+
+    @property
+    def digest(self) -> str:
+        """Get the sha256 digest of the data written so far.
+
+        :return: hex encoded sha256 digest
+        """
+        return self.sha256.hexdigest()
+
+
+class UploadRequest(Request):
+    """Request that streams uploaded files into spooled temporary files with a size limit."""
+
+    # pylint: disable=unused-argument
+    def _get_file_stream(
+        self,
+        total_content_length: Optional[int],
+        content_type: Optional[str],
+        filename: Optional[str] = None,
+        content_length: Optional[int] = None,
+    ) -> IO[bytes]:
+        return SpooledUpload(
+            current_app.config["IMAGE_SPOOL_SIZE"], current_app.config["IMAGE_MAX_SIZE"]
+        )
+
+
+def optimize_png(picture: "PILImage.Image", size: int) -> Optional[bytes]:
+    """Losslessly re-compress a PNG image.
+
+    :param picture: decoded image
+    :param size: size of the image as it was uploaded
+    :return: the re-compressed image data, or None if it isn't smaller than the uploaded image
+    """
+    output = io.BytesIO()
+    picture.save(output, format="PNG", optimize=True, icc_profile=picture.info.get("icc_profile"))
+    optimized = output.getvalue()
+
+    return optimized if len(optimized) < size else None
+
+
+def create_variants(picture: "PILImage.Image", size: int) -> list[tuple[int, str, bytes]]:
+    """Create copies of an image that are resized to fit the panel and encoded as WebP.
+
+    Variants are only kept if they are smaller than the original image.
+
+    :param picture: decoded image
+    :param size: size of the original image
+    :return: list of tuples with the width, mimetype and data of each variant
+    """
+    if picture.mode not in ("RGB", "RGBA"):
+        picture = picture.convert("RGBA")
+
+    variants = []
+    widths = sorted({min(width, picture.width) for width in current_app.config["IMAGE_WIDTHS"]})
+    for width in widths:
+        resized = picture
+        if width < picture.width:
+            height = max(1, round(picture.height * width / picture.width))
+            resized = picture.resize((width, height), PILImage.Resampling.LANCZOS)
+
+        encoded = {}
+        if width < picture.width:
+            output = io.BytesIO()
+            resized.save(output, format="PNG", optimize=True)
+            encoded["image/png"] = output.getvalue()
+
+        output = io.BytesIO()
+        resized.save(output, format="WEBP", quality=current_app.config["IMAGE_WEBP_QUALITY"])
+        encoded["image/webp"] = output.getvalue()
+
+        for mimetype, variant_data in encoded.items():
+            if len(variant_data) < size:
+                variants.append((width, mimetype, variant_data))
+
+    return variants
+
+
+def save_image(image: Image, upload: IO[bytes]) -> None:
+    """Store an uploaded image along with smaller variants of it to display in the panel.
+
+    :param image: image the data was uploaded for
+    :param upload: file containing the uploaded image data
+    """
+    if isinstance(upload, SpooledUpload):
+        digest, size = upload.digest, upload.size
+    else:
+        digest, size = hash_file(upload)
+
+    optimized = None
+    variants = []
+    if PILImage is None:
+        current_app.logger.debug("Pillow is not installed, storing image as uploaded")
+    else:
+        try:
+            with PILImage.open(upload) as picture:
+                picture.load()
+                image.width = picture.width
+                if getattr(picture, "is_animated", False):
+                    # re-encoding would only keep the first frame of an animated GIF, APNG or WebP
+                    current_app.logger.debug("image is animated, storing image as uploaded")
+                else:
+                    variants = create_variants(picture, size)
+                    optimized = optimize_png(picture, size)
+        except (OSError, ValueError) as exp:
+            current_app.logger.warning("could not optimize image, storing as uploaded: %s", exp)
+
+    for variant in image.variants:  # type: ignore
+        # variants that haven't been migrated don't hold a reference to a blob yet
+        if variant.data is None:
+            image_storage.release(variant.digest)
+    if optimized is None:
+        upload.seek(0)
+        image_storage.save_file(image, upload, digest)
+    else:
+        image_storage.save(image, optimized)
+
+    image.variants = []  # type: ignore
+    for width, mimetype, variant_data in variants:
+        variant = ImageVariant(width=width, mimetype=mimetype)
+        image_storage.save(variant, variant_data)
+        image.variants.append(variant)
+
+
+def hash_file(file: IO[bytes]) -> tuple[str, int]:
+    """Hash a file without reading the whole file into memory.
+
+    :param file: file to hash, the position of the file is reset to the start afterwards
+    :return: tuple of the sha256 digest and size of the file
+    """
+    sha256 = hashlib.sha256()
+    size = 0
+    while chunk := file.read(CHUNK_SIZE):
+        sha256.update(chunk)
+        size += len(chunk)
+    file.seek(0)
+
+    return sha256.hexdigest(), size
+
+
+def release_images(*criteria: Any) -> None:
+    """Release the stored data of the images of elements that are about to be deleted.
+
+    :param criteria: criteria that select the elements being deleted
+    """
+    # images that haven't been migrated still have their data in their own row and don't hold a
+    # reference to a blob yet
+    digests = (
+        Image.query.with_entities(Image.digest)
+        .join(Element)
+        .filter(Image.data.is_(None), *criteria)  # type: ignore
+        .all()
+        + ImageVariant.query.with_entities(ImageVariant.digest)
+        .join(Image)
+        .join(Element)
+        .filter(ImageVariant.data.is_(None), *criteria)  # type: ignore
+        .all()
+    )
+    for (digest,) in digests:
+        image_storage.release(digest)
@@ -0,0 +1,217 @@
+"""Logging configuration that keeps writing log messages off the request path.
+
+Log records are put on a queue by the thread that logs them and written to stdout by a listener
+thread, so requests never wait for the log stream. Records are tagged with the id of the request
+they were logged for, and high-volume loggers can be sampled.
+"""
+
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Optional
+
+from flask import Flask, Response, g, has_request_context, request
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s %(threadName)s : %(message)s"
+REQUEST_ID_HEADER = "X-Request-ID"
+# request ids sent by a proxy are only used if they are short and can't break the log format
+VALID_REQUEST_ID = re.compile(r"[\w.-]{1,64}")
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats log records as a single line of json."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        """Format a log record.
+
+        :param record: record to format
+        :return: json object containing the record
+        """
+        entry: dict[str, Any] = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id is not None:
+            entry["request_id"] = request_id
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack_info"] = self.formatStack(record.stack_info)
+
+        return json.dumps(entry, default=str)
+
+
+# pylint: disable=too-few-public-methods
+class RequestIdFilter(logging.Filter):
+    """Tags log records with the id of the request they were logged while handling."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """Add the request id to a record.
+
+        :param record: record being logged
+        :return: always True, so the record is logged
+        """
+        record.request_id = g.get("request_id") if has_request_context() else None
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Only logs a fraction of the records below WARNING from high-volume loggers."""
+
+    def __init__(self, rates: dict[str, float]) -> None:
+        """Create the filter.
+
+        :param rates: fraction of the records to log, keyed by logger name. Child loggers use the
+            rate of their parent.
+        """
+        super().__init__()
+        self.rates = rates
+
+    def get_rate(self, name: str) -> Optional[float]:
+        """Get the sample rate of a logger.
+
+        :param name: name of the logger
+        :return: fraction of records to log, or None if the logger isn't sampled
+        """
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition(".")[0]
+        return None
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """Check if a record should be logged.
+
+        :param record: record being logged
+        :return: True if the record should be logged
+        """
+        if record.levelno >= logging.WARNING:
+            return True
+
+        rate = self.get_rate(record.name)
+        return rate is None or random.random() < rate
+
+
+class ProcessQueueHandler(QueueHandler):
+    """Queue handler that starts a listener thread in each process that logs through it.
+
+    The queue and listener thread of the parent process don't survive a fork (e.g. gunicorn workers
+    started with --preload), so they are created again by the first record logged in each process.
+    """
+
+    def __init__(self, handler: logging.Handler) -> None:
+        """Create the handler.
+
+        :param handler: handler the listener thread writes records to
+        """
+        super().__init__(queue.SimpleQueue())
+        self.handler = handler
+        self.listener: Optional[QueueListener] = None
+        self._pid: Optional[int] = None
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Resolve the message of a record before it is queued.
+
+        The arguments of the message could be changed by the time the listener formats the record,
+        so the message is merged with them here. The rest of the formatting is left to the listener.
+
+        :param record: record being logged
+        :return: copy of the record with the arguments merged into the message
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        """Queue a record, starting the listener first if needed.
+
+        This is called while holding the lock of the handler, so the listener is only started once.
+
+        :param record: record to queue
+        """
+        if self._pid != os.getpid():
+            self.queue = queue.SimpleQueue()
+            self.listener = QueueListener(self.queue, self.handler, respect_handler_level=True)
+            self.listener.start()
+            self._pid = os.getpid()
+
+        super().enqueue(record)
+
+    def close(self) -> None:
+        """Write the queued records and stop the listener."""
+        if self.listener is not None and self._pid == os.getpid():
+            self.listener.stop()
+            self.listener = None
+        super().close()
+
+
+def configure_logging(app: Flask) -> None:
+    """Send the log records of the process through a queue to stdout.
+
+    Logging is only configured once per process, even if many apps are created.
+
+    :param app: app the configuration is read from
+    """
+    root = logging.getLogger()
+    if any(isinstance(handler, ProcessQueueHandler) for handler in root.handlers):
+        return
+
+    stream = logging.StreamHandler(sys.stdout)
+    if app.config["LOG_FORMAT"] == "json":
+        stream.setFormatter(JsonFormatter())
+    else:
+        stream.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    handler = ProcessQueueHandler(stream)
+    handler.addFilter(SamplingFilter(app.config["LOG_SAMPLE_RATES"]))
+    handler.addFilter(RequestIdFilter())
+    root.addHandler(handler)
+
+
+class RequestLogging:
+    """Configures logging and assigns an id to each request so its log records can be found."""
+
+    def init_app(self, app: Flask) -> None:
+        """Configure logging for an app.
+
+        :param app: app to configure logging for
+        """
+        configure_logging(app)
+        app.before_request(assign_request_id)
+        app.after_request(add_request_id_header)
+
+
+def assign_request_id() -> None:
+    """Use the request id set by a proxy, or create a new one."""
+    request_id = request.headers.get(REQUEST_ID_HEADER, "")
+    if not VALID_REQUEST_ID.fullmatch(request_id):
+        request_id = uuid.uuid4().hex
+    g.request_id = request_id
+
+
+def add_request_id_header(response: Response) -> Response:
+    """Return the request id so a client can report it.
+
+    :param response: response to the request
+    :return: response with the request id header
+    """
+    request_id = g.get("request_id")
+    if request_id is not None:
+        response.headers[REQUEST_ID_HEADER] = request_id
+    return response
+
+
+request_logging = RequestLogging()
@@ -1,31 +1,55 @@
 """Main routes."""
 
 # pylint: disable=too-many-lines
-import base64
 import json
+import math
 import re
 import textwrap
+from datetime import datetime
 from uuid import uuid4
 from typing import Optional
 
+import httpx
 import jwt
-import requests
-from flask import Blueprint, Response, current_app, make_response, render_template, request
+from flask import (
+    Blueprint,
+    Response,
+    abort,
+    current_app,
+    make_response,
+    render_template,
+    request,
+)
 from flask_wtf import FlaskForm
-from flask_wtf.file import FileAllowed, FileRequired, FileSize
-from sqlalchemy.exc import NoResultFound
-from wtforms import BooleanField, FileField, SelectField, StringField, SubmitField, ValidationError
+from flask_wtf.file import FileAllowed, FileRequired
+from sqlalchemy.exc import IntegrityError, NoResultFound
+from sqlalchemy.orm import joinedload
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.http import is_resource_modified
+from wtforms import (
+    BooleanField,
+    FileField,
+    IntegerField,
+    SelectField,
+    StringField,
+    SubmitField,
+    ValidationError,
+)
 from wtforms.fields import Field
 from wtforms.form import BaseForm
-from wtforms.validators import URL, DataRequired, Length
+from wtforms.validators import URL, DataRequired, Length, NumberRange
 from wtforms.widgets import TextArea
 
-from mulletwebhook import twitch, utils, verify
+from mulletwebhook import cooldown, http_client, images, twitch, utils, verify
+from mulletwebhook.cache import layout_cache
+from mulletwebhook.delivery import delivery_pool
 from mulletwebhook.database import db
 from mulletwebhook.models.broadcaster import Broadcaster
-from mulletwebhook.models.element import Element, Image, Text, Webhook
+from mulletwebhook.models.delivery import Delivery
+from mulletwebhook.models.element import Element, Image, ImageVariant, Text, Webhook
 from mulletwebhook.models.enums import BitsProduct, ElementType
 from mulletwebhook.models.layout import Layout
+from mulletwebhook.storage import StoredImage, image_storage
 
 bp = Blueprint("main", __name__)
 
@@ -43,7 +67,6 @@ class ImageForm(FlaskForm):  # type: ignore
         validators=[
             FileRequired(),
             FileAllowed(["png"]),
-            FileSize(max_size=1048576, message="Images must be less than 1MiB in size"),
         ]
     )
 
@@ -97,6 +120,7 @@ class WebhookForm(FlaskForm):  # type: ignore
     )
     name = StringField(validators=[DataRequired(), Length(min=1, max=100)])
     include_transaction_data = BooleanField("include transaction data")
+    cooldown = IntegerField("cooldown (seconds)", default=0, validators=[NumberRange(0, 86400)])
     extra_data = StringField(
         "data",
         validators=[DataRequired(), Length(min=1, max=2000), validate_is_json],
@@ -122,6 +146,21 @@ class LayoutSelectForm(FlaskForm):  # type: ignore
     delete = SubmitField("Delete Layout")
 
 
+@bp.errorhandler(RequestEntityTooLarge)
+def upload_too_large(exp: RequestEntityTooLarge) -> Response:
+    """Show an error message in the form when an uploaded image is too large.
+
+    :param exp: exception raised while the upload was being read
+    :return: 413 response containing the error message
+    """
+    current_app.logger.info("upload rejected: %s", exp)
+    max_size = current_app.config["IMAGE_MAX_SIZE"] / 1048576
+    return make_response(
+        f"<p class='error-message'>image: Images must be less than {max_size:g}MiB in size</p>",
+        413,
+    )
+
+
 @bp.route("/webhook/<int:webhook_id>", methods=["POST"])
 @verify.token_required
 @verify.owned_by_broadcaster
@@ -143,36 +182,230 @@ def redeem(channel_id: int, role: str, webhook_id: int) -> Response:
     transaction_receipt = transaction["transactionReceipt"]
     receipt_decode = jwt.decode(
         transaction_receipt,
-        key=base64.b64decode(current_app.config["EXTENSION_SECRET"]),
+        key=utils.get_extension_secret(),
         algorithms=["HS256"],
     )
     current_app.logger.debug("decoded jwt: %s", receipt_decode)
-    webhook = Webhook.query.filter(Webhook.id == webhook_id).one()
 
-    webhook_data = webhook.data
+    # return the existing delivery if the panel retries a redemption
+    transaction_id = receipt_decode.get("data", {}).get("transactionId")
+    existing = find_delivery(transaction_id)
+    if existing is not None:
+        return redeemed_response(existing, channel_id, webhook_id)
+
+    available: Optional[datetime] = None
+    retry_after = cooldown.get_retry_after(webhook_id)
+    if retry_after is None:
+        webhook = db.get_or_404(Webhook, webhook_id)
+        try:
+            available = cooldown.trigger(webhook)
+        except cooldown.CooldownActive as exp:
+            db.session.rollback()
+            retry_after = exp.retry_after
+
+    if retry_after is not None:
+        # a retry that overlapped the original redemption is rejected by the cooldown the original
+        # started, which has committed its delivery by then
+        existing = find_delivery(transaction_id)
+        if existing is not None:
+            return redeemed_response(existing, channel_id, webhook_id)
+        return cooldown_response(webhook_id, retry_after)
+
+    webhook_data = dict(webhook.data)
     if webhook.include_transaction_data:
         webhook_data["transaction"] = transaction
 
-    req = requests.post(
-        webhook.url, json=webhook_data, timeout=current_app.config["REQUEST_TIMEOUT"]
+    # the webhook is sent by the delivery workers so the viewer doesn't wait on the webhook host
+    delivery = Delivery(
+        broadcaster_id=channel_id,
+        webhook_id=webhook.id,
+        transaction_id=transaction_id,
+        url=webhook.url,
+        payload=webhook_data,
+        next_attempt=utils.utcnow(),
     )
-    req.raise_for_status()
-    resp = make_response(req.text)
+    db.session.add(delivery)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # a retry of the same redemption was committed first
+        db.session.rollback()
+        existing = Delivery.query.filter(Delivery.transaction_id == transaction_id).one()
+        return redeemed_response(existing, channel_id, webhook_id)
+
+    if available is not None:
+        cooldown.remember(webhook.id, available)
+    delivery_pool.enqueue(delivery.id)
+
+    return redeemed_response(delivery, channel_id, webhook_id)
+
+
+@bp.route("/webhook/<int:webhook_id>/cooldown", methods=["GET"])
+@verify.token_required
+@verify.owned_by_broadcaster
+def webhook_cooldown(channel_id: int, role: str, webhook_id: int) -> Response:
+    """Check if a webhook is cooling down, so the panel can wait before the viewer uses bits.
+
+    :param channel_id: id of the channel the request was sent from
+    :param role: role of the user making the request
+    :param webhook_id: id of the webhook that is about to be redeemed
+    :return: response with the number of seconds until the webhook can be redeemed, 0 if it can be
+        redeemed now
+    """
+    del channel_id, role
+
+    retry_after = cooldown.check(db.get_or_404(Webhook, webhook_id))
+
+    return make_response({"webhook_id": webhook_id, "retry_after": math.ceil(retry_after or 0)})
+
+
+def find_delivery(transaction_id: Optional[str]) -> Optional[Delivery]:
+    """Find the delivery created by an earlier attempt of a redemption.
+
+    :param transaction_id: id of the bits transaction of the redemption
+    :return: the delivery, or None if the redemption hasn't been recorded yet
+    """
+    if transaction_id is None:
+        return None
+
+    delivery: Optional[Delivery] = Delivery.query.filter(
+        Delivery.transaction_id == transaction_id
+    ).one_or_none()
+    return delivery
 
+
+def cooldown_response(webhook_id: int, retry_after: float) -> Response:
+    """Create the response for a webhook that was redeemed during its cooldown.
+
+    :param webhook_id: id of the webhook that is cooling down
+    :param retry_after: number of seconds until the webhook can be redeemed again
+    :return: 429 response with the number of seconds to wait before retrying
+    """
+    current_app.logger.info("webhook_id=%s is cooling down for %.1fs", webhook_id, retry_after)
+    resp = make_response(
+        {
+            "error": "webhook is cooling down",
+            "webhook_id": webhook_id,
+            "retry_after": math.ceil(retry_after),
+        },
+        429,
+    )
+    resp.headers["Retry-After"] = str(math.ceil(retry_after))
+    resp.headers["Access-Control-Expose-Headers"] = "*"
     return resp
 
 
+def redeemed_response(delivery: Delivery, channel_id: int, webhook_id: int) -> Response:
+    """Create the response for a redeemed webhook.
+
+    :param delivery: delivery created when the webhook was redeemed
+    :param channel_id: id of the channel the request was sent from
+    :param webhook_id: id of the webhook that is being redeemed
+    :return: 202 response with the id and status of the delivery, or a 409 response if the
+        transaction was used to redeem a different webhook
+    """
+    if delivery.broadcaster_id != channel_id or delivery.webhook_id != webhook_id:
+        current_app.logger.warning(
+            "transaction_id=%s was already redeemed for webhook_id=%s",
+            delivery.transaction_id,
+            delivery.webhook_id,
+        )
+        return abort(409, "transaction has already been redeemed")
+
+    return make_response({"delivery_id": delivery.id, "status": delivery.status.name}, 202)
+
+
+@bp.route("/webhook/delivery/<int:delivery_id>", methods=["GET"])
+@verify.token_required
+@verify.owned_by_broadcaster
+def delivery_status(channel_id: int, role: str, delivery_id: int) -> Response:
+    """Get the status of a webhook delivery.
+
+    :param channel_id: id of the channel the request was sent from
+    :param role: role of the user making the request
+    :param delivery_id: id of the delivery returned when the webhook was redeemed
+    :return: response with the status of the delivery
+    """
+    del channel_id, role
+
+    delivery = db.get_or_404(Delivery, delivery_id)
+
+    return make_response(
+        {
+            "delivery_id": delivery.id,
+            "status": delivery.status.name,
+            "attempts": delivery.attempts,
+            "response_status": delivery.response_status,
+        }
+    )
+
+
 @bp.route("/element/image/<int:image_id>", methods=["GET"])
 def image_get(image_id: int) -> Response:
     """Serve static images.
 
     :params image_id: id of the image to serve
-    :return: http response containing the image.
+    :return: http response containing the image, or a 304 response if the client's cached copy is
+        still valid
     """
-    image = Image.query.filter(Image.id == image_id).one()
-    resp = make_response(image.data)
-    resp.headers["Content-type"] = "image/png"
+    # check if the image was modified without loading the image data
+    image_info = (
+        Image.query.with_entities(Image.digest, Image.date_modified)
+        .filter(Image.id == image_id)
+        .one_or_none()
+    )
+    if image_info is None:
+        return abort(404, f"image with id={image_id} does not exist")
+
+    return send_image(Image, image_id, "image/png", image_info.digest, image_info.date_modified)
+
+
+@bp.route("/element/image/variant/<int:variant_id>", methods=["GET"])
+def image_variant_get(variant_id: int) -> Response:
+    """Serve resized or re-encoded copies of images.
+
+    :params variant_id: id of the image variant to serve
+    :return: http response containing the image variant, or a 304 response if the client's cached
+        copy is still valid
+    """
+    variant_info = (
+        ImageVariant.query.with_entities(ImageVariant.digest, ImageVariant.mimetype)
+        .filter(ImageVariant.id == variant_id)
+        .one_or_none()
+    )
+    if variant_info is None:
+        return abort(404, f"image variant with id={variant_id} does not exist")
+
+    return send_image(ImageVariant, variant_id, variant_info.mimetype, variant_info.digest, None)
+
+
+def send_image(
+    model: type[StoredImage],
+    image_id: int,
+    mimetype: str,
+    digest: Optional[str],
+    last_modified: Optional[datetime],
+) -> Response:
+    """Create a response for an image, only loading the image data if the client needs it.
+
+    :param model: model of the image, either Image or ImageVariant
+    :param image_id: id of the image to send
+    :param mimetype: mimetype of the image
+    :param digest: sha256 digest of the image data, used as the ETag
+    :param last_modified: time the image was last modified
+    :return: response with the image data, or a 304 response if the client's copy is still valid
+    """
+    if is_resource_modified(request.environ, etag=digest, last_modified=last_modified):
+        resp = image_storage.send(model, image_id, digest)
+    else:
+        resp = make_response("", 304)
+
+    resp.headers["Content-type"] = mimetype
     resp.headers["Cache-Control"] = "public, max-age=86400"
+    if last_modified:
+        resp.last_modified = last_modified
+    if digest:
+        resp.set_etag(digest)
 
     return resp
 
@@ -192,19 +425,21 @@ def text_edit(channel_id: int, role: str, element_id: int, text_id: int) -> Resp
     """
     del role
 
-    current_app.logger.info("text_id=%s element_id=%s", text_id, element_id)
+    current_app.logger.debug("text_id=%s element_id=%s", text_id, element_id)
 
     form = TextForm()
 
-    text = Text.query.filter(Text.id == text_id).one()
+    text = db.get_or_404(Text, text_id)
 
     if request.method == "PUT":
         if form.validate():
-            current_app.logger.info("form valid")
-            current_app.logger.info(form.data)
+            current_app.logger.debug("form valid")
+            current_app.logger.debug("form data=%s", form.data)
+            assert isinstance(form.text.data, str)
             text.text = form.text.data
+            utils.invalidate_layout(text.element.layout_id)
             db.session.commit()
-            twitch.send_refresh_pubsub(channel_id)
+            twitch.refresh_dispatcher.request_refresh(channel_id)
 
             resp = make_response("<p class='success-message'>Text updated</p>", 201)
             resp.headers["HX-Trigger-After-Swap"] = "layoutUpdate"
@@ -212,8 +447,8 @@ def text_edit(channel_id: int, role: str, element_id: int, text_id: int) -> Resp
 
             return resp
 
-        current_app.logger.info("form invalid")
-        current_app.logger.info(form.errors)
+        current_app.logger.debug("form invalid")
+        current_app.logger.debug("form errors=%s", form.errors)
         errors_html = ""
         for field, error in form.errors.items():
             errors_html += f"{field}: {', '.join(error)}<br>"
@@ -246,37 +481,29 @@ def text_create(channel_id: int, role: str, layout_id: int) -> Response:
     :return: text create form or status message
     """
     del role
-    current_app.logger.info("layout_id=%s", layout_id)
+    current_app.logger.debug("layout_id=%s", layout_id)
 
     form = TextForm()
 
     if request.method == "POST":
         if form.validate():
-            current_app.logger.info("form valid")
-            current_app.logger.info(form.data)
-            element = Element(
-                layout_id=layout_id,
-                element_type=ElementType.text,
-                position=utils.get_next_layout_position(layout_id),
-            )
-            db.session.add(element)
-            db.session.commit()
+            current_app.logger.debug("form valid")
+            current_app.logger.debug("form data=%s", form.data)
+            element = utils.create_element(layout_id, ElementType.text)
             assert isinstance(form.text.data, str)
             text = Text(text=form.text.data, element_id=element.id)
             db.session.add(text)
             db.session.commit()
-            # re-order elements
-            utils.ensure_layout_order(layout_id)
 
-            twitch.send_refresh_pubsub(channel_id)
+            twitch.refresh_dispatcher.request_refresh(channel_id)
 
             resp = make_response("<p class='success-message'>Text created</p>", 200)
             resp.headers["HX-Trigger-After-Swap"] = "layoutUpdate"
             resp.headers["Access-Control-Expose-Headers"] = "*"
             return resp
 
-        current_app.logger.info("form invalid")
-        current_app.logger.info(form.errors)
+        current_app.logger.debug("form invalid")
+        current_app.logger.debug("form errors=%s", form.errors)
         errors_html = ""
         for field, error in form.errors.items():
             errors_html += f"{field}: {', '.join(error)}<br>"
@@ -308,28 +535,29 @@ def image_edit(channel_id: int, role: str, element_id: int, image_id: int) -> Re
     """
     del role
 
-    current_app.logger.info("image_id=%s element_id=%s", image_id, element_id)
+    current_app.logger.debug("image_id=%s element_id=%s", image_id, element_id)
 
     form = ImageForm()
 
-    image = Image.query.filter(Image.id == image_id).one()
+    image = db.get_or_404(Image, image_id)
 
     if request.method == "PUT":
         if form.validate():
-            current_app.logger.info("form valid")
-            current_app.logger.info(form.data)
-            image.data = form.image.data.read()
+            current_app.logger.debug("form valid")
+            current_app.logger.debug("form data=%s", form.data)
+            images.save_image(image, form.image.data.stream)
             image.filename = form.image.data.filename
+            utils.invalidate_layout(image.element.layout_id)
             db.session.commit()
-            twitch.send_refresh_pubsub(channel_id)
+            twitch.refresh_dispatcher.request_refresh(channel_id)
 
             resp = make_response("<p class='success-message'>Image updated</p>", 201)
             resp.headers["HX-Trigger-After-Swap"] = "layoutUpdate"
             resp.headers["Access-Control-Expose-Headers"] = "*"
             return resp
 
-        current_app.logger.info("form invalid")
-        current_app.logger.info(form.errors)
+        current_app.logger.debug("form invalid")
+        current_app.logger.debug("form errors=%s", form.errors)
         errors_html = ""
         for field, error in form.errors.items():
             errors_html += f"{field}: {', '.join(error)}<br>"
@@ -365,26 +593,17 @@ def image_create(channel_id: int, role: str, layout_id: int) -> Response:
 
     if request.method == "POST":
         if form.validate():
-            current_app.logger.info("form valid")
-            current_app.logger.info(form.data)
-            element = Element(
-                layout_id=layout_id,
-                element_type=ElementType.image,
-                position=utils.get_next_layout_position(layout_id),
-            )
-            db.session.add(element)
-            db.session.commit()
-            image = Image(
-                filename=form.image.data.filename,
-                data=form.image.data.read(),
-                element_id=element.id,
-            )
+            current_app.logger.debug("form valid")
+            current_app.logger.debug("form data=%s", form.data)
+            # process the image before the layout is locked to add the element
+            image = Image(filename=form.image.data.filename)
+            images.save_image(image, form.image.data.stream)
+            element = utils.create_element(layout_id, ElementType.image)
+            image.element_id = element.id
             db.session.add(image)
             db.session.commit()
-            # re-order elements
-            utils.ensure_layout_order(layout_id)
 
-            twitch.send_refresh_pubsub(channel_id)
+            twitch.refresh_dispatcher.request_refresh(channel_id)
 
             resp = make_response("<p class='success-message'>Image created</p>", 200)
             resp.headers["HX-Trigger-After-Swap"] = "layoutUpdate"
@@ -392,8 +611,8 @@ def image_create(channel_id: int, role: str, layout_id: int) -> Response:
 
             return resp
 
-        current_app.logger.info("form invalid")
-        current_app.logger.info(form.errors)
+        current_app.logger.debug("form invalid")
+        current_app.logger.debug("form errors=%s", form.errors)
         errors_html = ""
         for field, error in form.errors.items():
             errors_html += f"{field}: {', '.join(error)}<br>"
@@ -435,11 +654,12 @@ def element_create(channel_id: int, role: str, layout_id: int) -> Response:
     )
 
 
-def test_webhook(form: WebhookForm) -> None:
+async def test_webhook(form: WebhookForm) -> None:
     """Test a webhook based on data provided from a form.
 
     :param form: WebhookForm with data to test a new or modified webhook
-    :raises: HTTPError if there was an error with the webhook
+    :raises: HTTPError if there was an error with the webhook, or CircuitOpenError if the webhook
+        host is failing or busy
     """
     bits_product = form.bits_product.data
     bits_cost = BitsProduct[bits_product].value
@@ -465,10 +685,11 @@ def test_webhook(form: WebhookForm) -> None:
         webhook_data["transaction"] = transaction_example
 
     assert isinstance(form.url.data, str)
-    req = requests.post(
-        form.url.data, json=webhook_data, timeout=current_app.config["REQUEST_TIMEOUT"]
-    )
-    req.raise_for_status()
+    async with http_client.create_async_client() as client:
+        resp = await http_client.async_post(
+            client, form.url.data, json=webhook_data, timeout=current_app.config["REQUEST_TIMEOUT"]
+        )
+    resp.raise_for_status()
 
 
 @bp.route("/element/<int:element_id>/webhook/<int:webhook_id>/edit", methods=["GET", "PUT"])
@@ -487,38 +708,49 @@ def webhook_edit(channel_id: int, role: str, element_id: int, webhook_id: int) -
 
     del role
 
-    current_app.logger.info("webhook_id=%s element_id=%s", webhook_id, element_id)
+    current_app.logger.debug("webhook_id=%s element_id=%s", webhook_id, element_id)
 
     form = WebhookForm()
 
-    webhook = Webhook.query.filter(Webhook.id == webhook_id).one()
+    webhook = db.get_or_404(Webhook, webhook_id)
 
     if request.method == "PUT":
         if form.validate():
-            current_app.logger.info("form valid")
-            current_app.logger.info(form.data)
+            current_app.logger.debug("form valid")
+            current_app.logger.debug("form data=%s", form.data)
             if form.test_webhook.data:
                 try:
-                    test_webhook(form)
-                except requests.RequestException:
+                    current_app.ensure_sync(test_webhook)(form)
+                except http_client.CircuitOpenError:
+                    return make_response(
+                        "<p class='error-message'>Webhook host is unavailable, try again later</p>",
+                        503,
+                    )
+                except httpx.HTTPError:
                     return make_response("<p class='error-message'>Webhook failed</p>", 500)
                 return make_response("<p class='success-message'>Webhook OK</p>")
 
+            assert isinstance(form.url.data, str)
+            assert isinstance(form.name.data, str)
             webhook.url = form.url.data
             webhook.name = form.name.data
             webhook.bits_product = form.bits_product.data
             assert isinstance(form.extra_data.data, str)
             webhook.data = json.loads(form.extra_data.data)
             webhook.include_transaction_data = form.include_transaction_data.data
+            assert isinstance(form.cooldown.data, int)
+            webhook.cooldown = form.cooldown.data
+            cooldown.cooldowns.discard(lambda key: key == webhook_id)
+            utils.invalidate_layout(webhook.element.layout_id)
             db.session.commit()
-            twitch.send_refresh_pubsub(channel_id)
+            twitch.refresh_dispatcher.request_refresh(channel_id)
             resp = make_response("<p class='success-message'>Webhook updated</p>", 201)
             resp.headers["HX-Trigger-After-Swap"] = "layoutUpdate"
             resp.headers["Access-Control-Expose-Headers"] = "*"
             return resp
 
-        current_app.logger.info("form invalid")
-        current_app.logger.info(form.errors)
+        current_app.logger.debug("form invalid")
+        current_app.logger.debug("form errors=%s", form.errors)
         errors_html = ""
         for field, error in form.errors.items():
             errors_html += f"{field}: {', '.join(error)}<br>"
@@ -530,6 +762,7 @@ def webhook_edit(channel_id: int, role: str, element_id: int, webhook_id: int) -
         form.url.data = webhook.url
         form.bits_product.data = webhook.bits_product.name
         form.include_transaction_data.data = webhook.include_transaction_data
+        form.cooldown.data = webhook.cooldown
         form.extra_data.data = json.dumps(webhook.data, indent=2)
 
     return make_response(
@@ -558,52 +791,51 @@ def webhook_create(channel_id: int, role: str, layout_id: int) -> Response:
     """
 
     del role
-    current_app.logger.info("layout_id=%s", layout_id)
+    current_app.logger.debug("layout_id=%s", layout_id)
 
     form = WebhookForm()
 
     if request.method == "POST":
         if form.validate():
-            current_app.logger.info("form valid")
-            current_app.logger.info(form.data)
+            current_app.logger.debug("form valid")
+            current_app.logger.debug("form data=%s", form.data)
             if form.test_webhook.data:
                 try:
-                    test_webhook(form)
-                except requests.RequestException:
+                    current_app.ensure_sync(test_webhook)(form)
+                except http_client.CircuitOpenError:
+                    return make_response(
+                        "<p class='error-message'>Webhook host is unavailable, try again later</p>",
+                        503,
+                    )
+                except httpx.HTTPError:
                     return make_response("<p class='error-message'>Webhook failed</p>", 500)
                 return make_response("<p class='success-message'>Webhook OK</p>")
 
-            element = Element(
-                layout_id=layout_id,
-                element_type=ElementType.webhook,
-                position=utils.get_next_layout_position(layout_id),
-            )
-            db.session.add(element)
-            db.session.commit()
+            element = utils.create_element(layout_id, ElementType.webhook)
             assert isinstance(form.url.data, str)
             assert isinstance(form.name.data, str)
             assert isinstance(form.extra_data.data, str)
+            assert isinstance(form.cooldown.data, int)
             webhook = Webhook(
                 url=form.url.data,
                 name=form.name.data,
                 bits_product=form.bits_product.data,
                 data=json.loads(form.extra_data.data),
                 include_transaction_data=form.include_transaction_data.data,
+                cooldown=form.cooldown.data,
                 element_id=element.id,
             )
             db.session.add(webhook)
             db.session.commit()
-            # re-order elements
-            utils.ensure_layout_order(layout_id)
-            twitch.send_refresh_pubsub(channel_id)
+            twitch.refresh_dispatcher.request_refresh(channel_id)
 
             resp = make_response("<p class='success-message'>Webhook created</p>", 200)
             resp.headers["HX-Trigger-After-Swap"] = "layoutUpdate"
             resp.headers["Access-Control-Expose-Headers"] = "*"
             return resp
 
-        current_app.logger.info("form invalid")
-        current_app.logger.info(form.errors)
+        current_app.logger.debug("form invalid")
+        current_app.logger.debug("form errors=%s", form.errors)
         errors_html = ""
         for field, error in form.errors.items():
             errors_html += f"{field}: {', '.join(error)}<br>"
@@ -613,7 +845,7 @@ def webhook_create(channel_id: int, role: str, layout_id: int) -> Response:
     if request.method == "GET":
         form.extra_data.data = "{}"
         form.bits_product.data = BitsProduct.reward_100bits.name
-        current_app.logger.info(form.bits_product.data)
+        current_app.logger.debug("bits_product=%s", form.bits_product.data)
 
     return make_response(
         render_template(
@@ -638,17 +870,16 @@ def element_delete(channel_id: int, role: str, element_id: int) -> Response:
     :return: 200 response if the element was successfully deleted
     """
     del role
-    current_app.logger.info("element_id=%s", element_id)
+    current_app.logger.debug("element_id=%s", element_id)
 
-    element = Element.query.filter(Element.id == element_id).one()
+    element = db.get_or_404(Element, element_id)
     layout_id = element.layout_id
+    images.release_images(Element.id == element_id)
+    utils.invalidate_layout(layout_id)
     db.session.delete(element)
     db.session.commit()
 
-    # ensure element positions are sequential
-    utils.ensure_layout_order(layout_id)
-
-    twitch.send_refresh_pubsub(channel_id)
+    twitch.refresh_dispatcher.request_refresh(channel_id)
 
     resp = make_response("<p>Element deleted</p>")
     resp.headers["HX-Trigger-After-Swap"] = "layoutUpdate"
@@ -669,13 +900,15 @@ def layout_delete(channel_id: int, role: str, layout_id: int) -> Response:
     :return: 200 response if the layout was successfully deleted
     """
     del role
-    current_app.logger.info("layout_id=%s", layout_id)
+    current_app.logger.debug("layout_id=%s", layout_id)
 
-    layout_obj = Layout.query.filter(Layout.id == layout_id).one()
+    layout_obj = db.get_or_404(Layout, layout_id)
+    images.release_images(Element.layout_id == layout_id)
+    utils.invalidate_layout(layout_id)
     db.session.delete(layout_obj)
     db.session.commit()
 
-    twitch.send_refresh_pubsub(channel_id)
+    twitch.refresh_dispatcher.request_refresh(channel_id)
     resp = make_response("<p>Layout deleted</p>")
     resp.headers["HX-Trigger-After-Swap"] = "layoutUpdate, selectRefresh"
     resp.headers["Access-Control-Expose-Headers"] = "*"
@@ -696,9 +929,9 @@ def element_confirm_delete(channel_id: int, role: str, element_id: int) -> Respo
     """
     del channel_id, role
 
-    current_app.logger.info("element_id=%s", element_id)
+    current_app.logger.debug("element_id=%s", element_id)
 
-    element = Element.query.filter(Element.id == element_id).one()
+    element = db.get_or_404(Element, element_id)
 
     element_name = ""
     if element.element_type == ElementType.image:
@@ -734,9 +967,9 @@ def layout_confirm_delete(channel_id: int, role: str, layout_id: int) -> Respons
     """
     del channel_id, role
 
-    current_app.logger.info("layout_id=%s", layout_id)
+    current_app.logger.debug("layout_id=%s", layout_id)
 
-    layout_obj = Layout.query.filter(Layout.id == layout_id).one()
+    layout_obj = db.get_or_404(Layout, layout_id)
 
     delete_url = f"{current_app.config['EBS_URL']}/layout/{layout_obj.id}"
     delete_prompt = f"Are you sure you want to delete this layout?<br>({layout_obj.name})"
@@ -754,6 +987,10 @@ def layout_confirm_delete(channel_id: int, role: str, layout_id: int) -> Respons
 def layout_update_order(channel_id: int, role: str, layout_id: int) -> Response:
     """Update the order that the elements of a layout are displayed.
 
+    The form contains the id of the element that was moved, and the id of the element it was
+    moved in front of, or no id if it was moved to the end of the layout. If no element was moved
+    the layout is only rendered.
+
     :param channel_id: id of the channel the request was sent from
     :param role: role of the user making the request
     :param layout_id: id of layout to modify the order for
@@ -763,23 +1000,17 @@ def layout_update_order(channel_id: int, role: str, layout_id: int) -> Response:
 
     current_app.logger.debug(request.form)
 
-    layout_obj = Layout.query.filter(Layout.id == layout_id).one()
-
-    elements = Element.query.filter(Element.layout_id == layout_id).order_by(Element.position).all()
-
-    try:
-        for new_pos, old_pos in enumerate(request.form.getlist("element")):
-            current_app.logger.debug("%s %s", new_pos, old_pos)
-            if new_pos != int(old_pos):
-                current_app.logger.debug("switching element %s with %s", old_pos, new_pos)
-                element_to_update = elements[int(old_pos)]
-                element_to_update.position = new_pos
+    layout_obj = db.get_or_404(Layout, layout_id)
 
-        db.session.commit()
-    except IndexError as exp:
-        current_app.logger.warning("could not re-order elements: %s", exp)
-
-    twitch.send_refresh_pubsub(channel_id)
+    moved_id = request.form.get("moved", type=int)
+    if moved_id is not None:
+        try:
+            utils.move_element(layout_id, moved_id, request.form.get("before", type=int))
+            db.session.commit()
+            twitch.refresh_dispatcher.request_refresh(channel_id)
+        except ValueError as exp:
+            db.session.rollback()
+            current_app.logger.warning("could not move element: %s", exp)
 
     resp = make_response(get_layout_html(layout_obj, True))
 
@@ -823,8 +1054,8 @@ def layout_create(channel_id: int, role: str) -> Response:
     if request.method == "POST":
         if form.validate():
             ensure_broadcaster_exists(channel_id)
-            current_app.logger.info("form valid")
-            current_app.logger.info(form.data)
+            current_app.logger.debug("form valid")
+            current_app.logger.debug("form data=%s", form.data)
 
             assert isinstance(form.name.data, str)
             assert isinstance(form.title.data, str)
@@ -849,8 +1080,8 @@ def layout_create(channel_id: int, role: str) -> Response:
 
             return resp
 
-        current_app.logger.info("form invalid")
-        current_app.logger.info(form.errors)
+        current_app.logger.debug("form invalid")
+        current_app.logger.debug("form errors=%s", form.errors)
         errors_html = ""
         for field, error in form.errors.items():
             errors_html += f"{field}: {', '.join(error)}<br>"
@@ -890,13 +1121,15 @@ def layout_edit(channel_id: int, role: str, layout_id: int) -> Response:
 
     form = LayoutForm()
 
-    layout_obj = Layout.query.filter(Layout.id == layout_id).one()
+    layout_obj = db.get_or_404(Layout, layout_id)
 
     if request.method == "PUT":
         if form.validate():
 
+            assert isinstance(form.title.data, str)
             layout_obj.title = form.title.data
             layout_obj.show_title = form.show_title.data
+            utils.invalidate_layout(layout_id)
 
             db.session.commit()
 
@@ -906,8 +1139,8 @@ def layout_edit(channel_id: int, role: str, layout_id: int) -> Response:
 
             return resp
 
-        current_app.logger.info("form invalid")
-        current_app.logger.info(form.errors)
+        current_app.logger.debug("form invalid")
+        current_app.logger.debug("form errors=%s", form.errors)
         errors_html = ""
         for field, error in form.errors.items():
             errors_html += f"{field}: {', '.join(error)}<br>"
@@ -1009,15 +1242,15 @@ def layouts(channel_id: int, role: str) -> Response:
 
     if request.method == "POST":
         if form.validate():
-            current_app.logger.info("form valid")
-            current_app.logger.info(form.data)
+            current_app.logger.debug("form valid")
+            current_app.logger.debug("form data=%s", form.data)
 
             layout_obj = Layout.query.filter(Layout.id == form.layouts.data).one()
 
             broadcaster.editing_layout = layout_obj.id
 
             if form.delete.data:
-                current_app.logger.info("delete")
+                current_app.logger.debug("delete")
                 resp = make_response(
                     f"""
                     <div
@@ -1032,7 +1265,7 @@ def layouts(channel_id: int, role: str) -> Response:
                 return resp
 
             if form.edit.data:
-                current_app.logger.info("edit")
+                current_app.logger.debug("edit")
                 resp = make_response(
                     f"""
                     <div
@@ -1050,22 +1283,23 @@ def layouts(channel_id: int, role: str) -> Response:
 
             if form.make_active.data:
                 broadcaster.current_layout = layout_obj.id
-                current_app.logger.info(layout_obj.id)
+                current_app.logger.debug("layout_id=%s", layout_obj.id)
+                utils.invalidate_layout(layout_obj.id)
                 db.session.commit()
-                twitch.send_refresh_pubsub(channel_id)
+                twitch.refresh_dispatcher.request_refresh(channel_id)
                 resp.headers["HX-Trigger"] = "selectRefresh"
 
             return resp
 
-        current_app.logger.info("form invalid")
-        current_app.logger.info(form.data)
-        current_app.logger.info(form.layouts.choices)
-        current_app.logger.info(form.errors)
+        current_app.logger.debug("form invalid")
+        current_app.logger.debug("form data=%s", form.data)
+        current_app.logger.debug("layout choices=%s", form.layouts.choices)
+        current_app.logger.debug("form errors=%s", form.errors)
         resp = make_response("<p class='centered'>Please select or create a layout to edit</p>")
         return resp
 
     if request.method == "GET":
-        current_app.logger.info("EDITING LAYOUT %s", broadcaster.editing_layout)
+        current_app.logger.debug("editing layout_id=%s", broadcaster.editing_layout)
         form.layouts.data = str(broadcaster.editing_layout)
 
     return make_response(
@@ -1078,6 +1312,58 @@ def layouts(channel_id: int, role: str) -> Response:
 
 
 def get_layout_html(layout_obj: Layout, edit: bool) -> str:
+    """Get the html for a given layout, rendering it if it is not already cached.
+
+    :param layout_obj: layout object to render as html
+    :param edit: render the layout with editing controls
+    :return: rendered html of the layout
+    """
+    html = layout_cache.get(layout_obj.id, edit, layout_obj.version)
+    if html is not None:
+        current_app.logger.debug("layout cache hit for layout_id=%s", layout_obj.id)
+        return html
+
+    html = render_layout_html(layout_obj, edit)
+    layout_cache.set(layout_obj.id, edit, layout_obj.version, html)
+
+    return html
+
+
+def get_image_html(image: Image, image_url: str) -> str:
+    """Render the html for an image, letting the browser choose the best variant of the image.
+
+    :param image: image to render as html
+    :param image_url: url of the original image
+    :return: rendered html of the image
+    """
+    srcsets: dict[str, list[str]] = {"image/png": [], "image/webp": []}
+    for variant in image.variants:  # type: ignore
+        srcsets[variant.mimetype].append(
+            f"{current_app.config['EBS_URL']}/element/image/variant/{variant.id} {variant.width}w"
+        )
+
+    if not srcsets["image/webp"] and not srcsets["image/png"]:
+        return f"<img id='image-{image.id}' src='{image_url}'>"
+
+    sizes = f"{current_app.config['IMAGE_DISPLAY_WIDTH']}px"
+    png_srcset = ""
+    if image.width:
+        srcsets["image/png"].append(f"{image_url} {image.width}w")
+        png_srcset = f"srcset='{', '.join(srcsets['image/png'])}' sizes='{sizes}'"
+    webp_source = ""
+    if srcsets["image/webp"]:
+        webp_source = (
+            f"<source type='image/webp' srcset='{', '.join(srcsets['image/webp'])}' "
+            f"sizes='{sizes}'>"
+        )
+
+    return f"""<picture>
+                    {webp_source}
+                    <img id='image-{image.id}' src='{image_url}' {png_srcset}>
+                </picture>"""
+
+
+def render_layout_html(layout_obj: Layout, edit: bool) -> str:
     """Render the html for a given layout.
 
     :param layout_obj: layout object to render as html
@@ -1086,8 +1372,20 @@ def get_layout_html(layout_obj: Layout, edit: bool) -> str:
     """
 
     current_app.logger.debug(layout_obj)
+    # load all child elements in the same query to avoid a round trip per element
     elements = (
-        Element.query.filter(Element.layout_id == layout_obj.id).order_by(Element.position).all()
+        Element.query.options(
+            joinedload(Element.image)  # type: ignore
+            .selectinload(Image.variants)  # type: ignore
+            .load_only(ImageVariant.width, ImageVariant.mimetype),  # type: ignore
+            joinedload(Element.text),  # type: ignore
+            joinedload(Element.webhook),  # type: ignore
+        )
+        .filter(Element.layout_id == layout_obj.id)
+        # elements moved at the same time can briefly share a position, so the id keeps their order
+        # stable until the layout is rebalanced
+        .order_by(Element.position, Element.id)
+        .all()
     )
     current_app.logger.debug(elements)
     elements_list = []
@@ -1118,7 +1416,7 @@ def get_layout_html(layout_obj: Layout, edit: bool) -> str:
 
         if element.element_type == ElementType.image:
             current_app.logger.debug("image")
-            image = Image.query.filter(Image.element_id == element.id).one()
+            image = element.image
             image_url = (
                 f"{current_app.config['EBS_URL']}/element/image/{image.id}"
                 f"?version={image.date_modified.strftime('%s')}"
@@ -1129,24 +1427,22 @@ def get_layout_html(layout_obj: Layout, edit: bool) -> str:
                 )
                 edit_button = edit_button_template.format(element_id=element.id, edit_url=edit_url)
             entry = f"""
-                <input type='hidden' name='element' value='{element.position}'/>
-                <img id='image-{image.id}' src='{image_url}'>
+                {get_image_html(image, image_url)}
             """
         if element.element_type == ElementType.text:
             current_app.logger.debug("text")
-            text = Text.query.filter(Text.element_id == element.id).one()
+            text = element.text
             if edit:
                 edit_url = (
                     f"{current_app.config['EBS_URL']}/element/{element.id}/text/{text.id}/edit"
                 )
                 edit_button = edit_button_template.format(element_id=element.id, edit_url=edit_url)
             entry = f"""
-                <input type='hidden' name='element' value='{element.position}'/>
                 <p id='text-{text.id}'>{text.text}</p>
                 """
         if element.element_type == ElementType.webhook:
             current_app.logger.debug("webhook")
-            webhook = Webhook.query.filter(Webhook.element_id == element.id).one()
+            webhook = element.webhook
 
             if edit:
                 edit_url = (
@@ -1156,13 +1452,13 @@ def get_layout_html(layout_obj: Layout, edit: bool) -> str:
                 edit_button = edit_button_template.format(element_id=element.id, edit_url=edit_url)
 
             entry = f"""
-                <input type='hidden' name='element' value='{element.position}'/>
                 <button
                     type="button"
                     class="webhook-button"
                     id="webhook-{webhook.id}"
                     data-id="{webhook.id}"
                     data-product="{webhook.bits_product.name}"
+                    data-cooldown="{webhook.cooldown or 0}"
                 >
                     <p style="display:inline;">
                         {webhook.name}<br><br>
@@ -1181,7 +1477,7 @@ def get_layout_html(layout_obj: Layout, edit: bool) -> str:
                 """
             elements_list.append(
                 f"""
-            <div class='element' id='element-{element.id}'>
+            <div class='element' id='element-{element.id}' data-element-id='{element.id}'>
                 {entry}
             </div>
             """
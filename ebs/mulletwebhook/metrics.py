@@ -0,0 +1,226 @@
+"""Prometheus metrics for requests, SQL statements, template rendering and outbound requests.
+
+/metrics is only served when METRICS_TOKEN is set, and requires the token as a bearer token. When
+gunicorn runs several worker processes, set PROMETHEUS_MULTIPROC_DIR to an empty directory so that
+each process writes its metrics there and /metrics reports the metrics of all processes.
+
+Outbound requests to the Twitch API are labelled with its host, while requests to webhook hosts all
+share the "webhook" host label so that viewers' webhook urls can't create unbounded label values.
+"""
+
+import hmac
+import os
+import time
+from typing import Any
+
+from flask import Flask, Response, abort, before_render_template, current_app, g
+from flask import has_request_context, request, template_rendered
+from jinja2 import Template
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Connection, Engine, ExceptionContext
+
+REQUEST_DURATION = Histogram(
+    "mulletwebhook_request_duration_seconds",
+    "Time taken to handle requests",
+    ["endpoint", "method", "status"],
+)
+SQL_STATEMENTS = Counter(
+    "mulletwebhook_sql_statements_total",
+    "Number of SQL statements executed",
+    ["endpoint"],
+)
+SQL_DURATION = Counter(
+    "mulletwebhook_sql_duration_seconds_total",
+    "Time spent executing SQL statements",
+    ["endpoint"],
+)
+TEMPLATE_DURATION = Histogram(
+    "mulletwebhook_template_render_duration_seconds",
+    "Time taken to render templates",
+    ["template"],
+)
+HTTP_CLIENT_DURATION = Histogram(
+    "mulletwebhook_http_client_duration_seconds",
+    "Time taken by outbound requests, by destination host and status code or exception",
+    ["host", "status"],
+)
+HTTP_CLIENT_REJECTED = Counter(
+    "mulletwebhook_http_client_rejected_total",
+    "Number of outbound requests rejected by the circuit breaker of the destination host",
+    ["host"],
+)
+HTTP_CLIENT_IN_FLIGHT = Gauge(
+    "mulletwebhook_http_client_in_flight",
+    "Number of outbound requests in flight to each host",
+    ["host"],
+    multiprocess_mode="livesum",
+)
+CIRCUIT_BREAKERS = Gauge(
+    "mulletwebhook_circuit_breakers",
+    "Number of circuit breakers that are open or half open, by destination host",
+    ["host", "state"],
+    multiprocess_mode="livesum",
+)
+PUBSUB_REFRESHES = Counter(
+    "mulletwebhook_pubsub_refreshes_total",
+    "Number of refresh pubsub messages sent, coalesced into another refresh, or failed",
+    ["result"],
+)
+DELIVERIES = Counter(
+    "mulletwebhook_deliveries_total",
+    "Number of webhook delivery attempts that were delivered, are retrying, or failed",
+    ["result"],
+)
+
+
+# pylint: disable=too-few-public-methods
+class Instrumentation:
+    """Records request, SQL and template metrics for an app and serves them at /metrics."""
+
+    def init_app(self, app: Flask) -> None:
+        """Instrument an app and add the /metrics endpoint if a metrics token is configured.
+
+        :param app: app to instrument
+        """
+        app.before_request(start_request)
+        app.after_request(record_request)
+        before_render_template.connect(start_template, app)
+        template_rendered.connect(record_template, app)
+
+        # engine events are registered once for all engines, since apps can be created many times
+        for name, listener in (
+            ("before_cursor_execute", start_statement),
+            ("after_cursor_execute", record_statement),
+            ("handle_error", discard_statement),
+        ):
+            if not event.contains(Engine, name, listener):
+                event.listen(Engine, name, listener)
+
+        if app.config["METRICS_TOKEN"]:
+            app.add_url_rule("/metrics", "metrics", export)
+        else:
+            app.logger.info("METRICS_TOKEN is not set, not serving /metrics")
+
+
+def get_endpoint() -> str:
+    """Get the endpoint the current request was routed to.
+
+    :return: name of the endpoint, "none" if the request didn't match a route, or "background" if
+        there is no request
+    """
+    if not has_request_context():
+        return "background"
+    return request.endpoint or "none"
+
+
+def start_request() -> None:
+    """Record the time a request started."""
+    g.metrics_request_start = time.perf_counter()
+
+
+def record_request(response: Response) -> Response:
+    """Record the time taken by a request.
+
+    :param response: response to the request
+    :return: the unmodified response
+    """
+    start = g.pop("metrics_request_start", None)
+    if start is not None:
+        REQUEST_DURATION.labels(get_endpoint(), request.method, response.status_code).observe(
+            time.perf_counter() - start
+        )
+    return response
+
+
+def start_template(sender: Flask, template: Template, context: dict[str, Any]) -> None:
+    """Record the time a template started rendering.
+
+    :param sender: app rendering the template
+    :param template: template being rendered
+    :param context: variables passed to the template
+    """
+    del sender, template, context
+    g.setdefault("metrics_template_starts", []).append(time.perf_counter())
+
+
+def record_template(sender: Flask, template: Template, context: dict[str, Any]) -> None:
+    """Record the time taken to render a template.
+
+    :param sender: app that rendered the template
+    :param template: template that was rendered
+    :param context: variables passed to the template
+    """
+    del sender, context
+    starts = g.get("metrics_template_starts")
+    if starts:
+        TEMPLATE_DURATION.labels(template.name).observe(time.perf_counter() - starts.pop())
+
+
+def start_statement(conn: Connection, *args: Any) -> None:
+    """Record the time a SQL statement started executing.
+
+    :param conn: connection executing the statement
+    :param args: other arguments of the event, which are not used
+    """
+    del args
+    conn.info.setdefault("metrics_statement_starts", []).append(time.perf_counter())
+
+
+def record_statement(conn: Connection, *args: Any) -> None:
+    """Record the time taken to execute a SQL statement.
+
+    :param conn: connection that executed the statement
+    :param args: other arguments of the event, which are not used
+    """
+    del args
+    starts = conn.info.get("metrics_statement_starts")
+    if not starts:
+        return
+
+    endpoint = get_endpoint()
+    SQL_STATEMENTS.labels(endpoint).inc()
+    SQL_DURATION.labels(endpoint).inc(time.perf_counter() - starts.pop())
+
+
+def discard_statement(context: ExceptionContext) -> None:
+    """Forget the start time of a SQL statement that failed.
+
+    :param context: details of the error
+    """
+    if context.connection is not None:
+        starts = context.connection.info.get("metrics_statement_starts")
+        if starts:
+            starts.pop()
+
+
+def export() -> Response:
+    """Serve the metrics of all processes in the Prometheus text format.
+
+    :return: response containing the metrics
+    """
+    token = current_app.config["METRICS_TOKEN"]
+    if not token or not hmac.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {token}"
+    ):
+        abort(401)
+
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)  # type: ignore
+    else:
+        registry = REGISTRY
+
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+instrumentation = Instrumentation()
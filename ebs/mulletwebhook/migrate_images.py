@@ -0,0 +1,127 @@
+"""Move image data into the configured image storage backend."""
+
+import io
+import os
+from collections import Counter
+
+from flask import current_app
+from sqlalchemy import func
+from sqlalchemy.orm import undefer
+
+from mulletwebhook import create_app
+from mulletwebhook.database import db
+from mulletwebhook.models.element import Image, ImageBlob, ImageVariant
+from mulletwebhook.storage import FilesystemBackend, StoredImage, image_storage
+
+
+def migrate(model: type[StoredImage]) -> None:
+    """Migrates the data stored in the rows of a model to the configured storage backend.
+
+    :param model: model of the images to migrate, either Image or ImageVariant
+    """
+    image_ids = [
+        image.id
+        for image in model.query.with_entities(model.id)
+        .filter(model.data.is_not(None))  # type: ignore
+        .all()
+    ]
+    current_app.logger.info("migrating %s %s rows", len(image_ids), model.__tablename__)
+
+    # migrate one image at a time so that only one image is held in memory
+    for image_id in image_ids:
+        image = (
+            model.query.options(undefer(model.data))  # type: ignore
+            .filter(model.id == image_id)
+            .one()
+        )
+        assert image.data is not None
+        image_storage.save(image, image.data)
+        current_app.logger.info(
+            "migrated %s id=%s digest=%s", model.__tablename__, image_id, image.digest
+        )
+        db.session.commit()
+        db.session.expunge_all()
+
+
+def migrate_blobs() -> None:
+    """Moves the data of image blobs stored by the other backend into the configured backend.
+
+    Blobs keep their data in the database unless the storage directory is used, so switching the
+    backend in either direction moves the data of the existing blobs over.
+    """
+    filesystem = FilesystemBackend(current_app.config["IMAGE_STORAGE_PATH"])
+    to_filesystem = isinstance(image_storage.backend, FilesystemBackend)
+    # blobs stored in the other backend
+    criteria = (
+        ImageBlob.data.is_not(None) if to_filesystem else ImageBlob.data.is_(None)  # type: ignore
+    )
+    digests = [
+        digest
+        for (digest,) in ImageBlob.query.with_entities(ImageBlob.digest).filter(criteria).all()
+    ]
+    current_app.logger.info("migrating %s image_blob rows", len(digests))
+
+    # migrate one blob at a time so that only one image is held in memory
+    for digest in digests:
+        blob = (
+            ImageBlob.query.options(undefer(ImageBlob.data))  # type: ignore
+            .filter(ImageBlob.digest == digest)
+            .one()
+        )
+        if to_filesystem:
+            assert blob.data is not None
+            image_storage.backend.store(blob, io.BytesIO(blob.data))
+            blob.data = None
+        elif os.path.exists(filesystem.path(digest)):
+            with open(filesystem.path(digest), "rb") as file:
+                image_storage.backend.store(blob, file)
+        else:
+            current_app.logger.warning("image file is missing for image_blob digest=%s", digest)
+            continue
+        current_app.logger.info("migrated image_blob digest=%s", digest)
+        db.session.commit()
+        db.session.expunge_all()
+
+
+def count_references() -> None:
+    """Recounts the references to each image blob and deletes blobs that aren't referenced."""
+    refcounts: Counter[str] = Counter()
+    for model in (Image, ImageVariant):
+        for digest, count in (
+            model.query.with_entities(model.digest, func.count())
+            .filter(model.data.is_(None), model.digest.is_not(None))  # type: ignore
+            .group_by(model.digest)
+        ):
+            refcounts[digest] += count
+
+    blobs = {blob.digest: blob for blob in ImageBlob.query.all()}
+    for digest, count in refcounts.items():
+        blob = blobs.pop(digest, None)
+        if blob is None:
+            # images stored on the filesystem before blobs were reference counted
+            blob = ImageBlob(digest=digest)
+            db.session.add(blob)
+        blob.refcount = count
+
+    for blob in blobs.values():
+        db.session.delete(blob)
+    db.session.commit()
+
+    for digest in blobs:
+        image_storage.backend.remove(digest)
+    current_app.logger.info(
+        "counted references to %s blobs, removed %s unreferenced blobs", len(refcounts), len(blobs)
+    )
+
+
+def main() -> None:
+    """Migrates images to the configured storage backend."""
+    with create_app().app_context():
+        migrate(Image)
+        migrate(ImageVariant)
+        count_references()
+        migrate_blobs()
+
+
+if __name__ == "__main__":
+    main()
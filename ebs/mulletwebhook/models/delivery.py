@@ -0,0 +1,44 @@
+"""delivery.py."""
+
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Optional
+
+from sqlalchemy.sql import func
+
+from mulletwebhook.database import db
+from mulletwebhook.models.enums import DeliveryStatus
+
+
+# pylint: disable=invalid-name,too-many-instance-attributes
+@dataclass
+class Delivery(db.Model):  # type: ignore
+    """Database model to store webhook deliveries waiting to be sent (the delivery outbox).
+
+    Deliveries also act as a ledger of redemptions, so a redemption that is retried with the same
+    Twitch transaction id returns the existing delivery instead of sending the webhook again.
+    """
+
+    id: int = db.Column(db.Integer, primary_key=True)
+    broadcaster_id: int = db.Column(
+        db.Integer, db.ForeignKey("broadcaster.id", ondelete="CASCADE"), nullable=False
+    )
+    webhook_id: Optional[int] = db.Column(
+        db.Integer, db.ForeignKey("webhook.id", ondelete="SET NULL")
+    )
+    transaction_id: Optional[str] = db.Column(db.String, unique=True)
+    url: str = db.Column(db.String, nullable=False)
+    payload: dict[str, Any] = db.Column(db.JSON, nullable=False)
+    status: DeliveryStatus = db.Column(
+        db.Enum(DeliveryStatus), nullable=False, default=DeliveryStatus.pending, index=True
+    )
+    attempts: int = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt: datetime = db.Column(db.DateTime, nullable=False, index=True)
+    response_status: Optional[int] = db.Column(db.Integer)
+    response_text: Optional[str] = db.Column(db.String)
+    date_created: datetime = db.Column(
+        db.DateTime,
+        nullable=False,
+        server_default=func.now(),  # pylint: disable=not-callable
+        index=True,
+    )
@@ -1,10 +1,11 @@
 """element.py."""
 
+import hashlib
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Any
+from typing import Any, Optional
 
-from sqlalchemy.orm import backref
+from sqlalchemy.orm import backref, deferred, validates
 from sqlalchemy.sql import func
 
 from mulletwebhook.database import db
@@ -33,9 +34,15 @@ class Element(db.Model):  # type: ignore
 class Image(db.Model):  # type: ignore
     """Database model to store images."""
 
+    # allow the deferred data column to keep its plain type annotation
+    __allow_unmapped__ = True
+
     id: int = db.Column(db.Integer, primary_key=True)
     filename: str = db.Column(db.String(), nullable=False)
-    data: bytes = db.Column(db.LargeBinary(), nullable=False)
+    # only loaded when accessed so that loading image metadata doesn't load the whole image
+    data: Optional[bytes] = deferred(db.Column(db.LargeBinary()))  # type: ignore
+    digest: Optional[str] = db.Column(db.String(64))
+    width: Optional[int] = db.Column(db.Integer)
     date_modified: datetime = db.Column(
         db.DateTime,
         onupdate=func.now(),  # pylint: disable=not-callable
@@ -43,6 +50,70 @@ class Image(db.Model):  # type: ignore
         nullable=False,
     )
     element_id: int = db.Column(db.Integer, db.ForeignKey("element.id", ondelete="CASCADE"))
+    variants = db.relationship(
+        "ImageVariant",
+        cascade="all, delete-orphan",
+        backref=backref("image", passive_deletes=True),
+        order_by="ImageVariant.width",
+    )
+
+    @validates("data")
+    def validate_data(self, key: str, data: Optional[bytes]) -> Optional[bytes]:
+        """Update the digest of the image whenever the image data is set.
+
+        :param key: name of the attribute being set
+        :param data: image data, or None if the data is stored outside the database
+        :return: the unmodified image data
+        """
+        del key
+        if data is not None:
+            self.digest = hashlib.sha256(data).hexdigest()
+        return data
+
+
+@dataclass
+class ImageVariant(db.Model):  # type: ignore
+    """Database model to store resized or re-encoded copies of images."""
+
+    __allow_unmapped__ = True
+
+    id: int = db.Column(db.Integer, primary_key=True)
+    mimetype: str = db.Column(db.String, nullable=False)
+    width: int = db.Column(db.Integer, nullable=False)
+    data: Optional[bytes] = deferred(db.Column(db.LargeBinary()))  # type: ignore
+    digest: Optional[str] = db.Column(db.String(64))
+    image_id: int = db.Column(
+        db.Integer, db.ForeignKey("image.id", ondelete="CASCADE"), nullable=False
+    )
+
+    @validates("data")
+    def validate_data(self, key: str, data: Optional[bytes]) -> Optional[bytes]:
+        """Update the digest of the variant whenever the variant data is set.
+
+        :param key: name of the attribute being set
+        :param data: variant data, or None if the data is stored outside the database
+        :return: the unmodified variant data
+        """
+        del key
+        if data is not None:
+            self.digest = hashlib.sha256(data).hexdigest()
+        return data
+
+
+@dataclass
+class ImageBlob(db.Model):  # type: ignore
+    """Database model to store the data of images once for each distinct image.
+
+    Images and image variants reference blobs by the sha256 digest of their data. The number of
+    references is counted so the blob can be removed once nothing references it.
+    """
+
+    __allow_unmapped__ = True
+
+    digest: str = db.Column(db.String(64), primary_key=True)
+    # None if the data is stored outside the database
+    data: Optional[bytes] = deferred(db.Column(db.LargeBinary()))  # type: ignore
+    refcount: int = db.Column(db.Integer, nullable=False, default=0)
 
 
 @dataclass
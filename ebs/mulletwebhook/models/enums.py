@@ -121,3 +121,11 @@ class BitsProduct(Enum):
     reward_9800bits = 9800
     reward_9900bits = 9900
     reward_10000bits = 10000
+
+
+class DeliveryStatus(Enum):
+    """Enum for the state of a webhook delivery."""
+
+    pending = 1
+    delivered = 2
+    failed = 3
@@ -16,6 +16,7 @@ class Layout(db.Model):  # type: ignore
     name: str = db.Column(db.String, nullable=False)
     title: str = db.Column(db.String)
     show_title: bool = db.Column(db.Boolean, default=True)
+    version: int = db.Column(db.Integer, nullable=False, default=0, server_default="0")
     broadcaster_id: int = db.Column(
         db.Integer, db.ForeignKey("broadcaster.id", ondelete="CASCADE"), nullable=False
     )
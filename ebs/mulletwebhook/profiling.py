@@ -0,0 +1,133 @@
+"""Opt-in profiling of a sample of requests, for finding out why a channel's panel is slow.
+
+A request is profiled with cProfile if it is picked by PROFILE_SAMPLE_RATE, or if it has a
+X-Mulletwebhook-Profile header containing PROFILE_SECRET. Each profile is written to PROFILE_DIR as
+a .prof file that can be opened with pstats or snakeviz, along with a .txt file of the slowest
+calls. The oldest profiles are removed once the directory is larger than PROFILE_MAX_BYTES.
+"""
+
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import random
+import re
+import time
+from typing import Optional
+
+from flask import Flask, current_app, g, request
+
+PROFILE_HEADER = "X-Mulletwebhook-Profile"
+# number of functions listed in the call stats written with each profile
+CALL_STATS_LIMIT = 50
+
+
+# pylint: disable=too-few-public-methods
+class Profiler:
+    """Profiles a sample of the requests handled by an app."""
+
+    def init_app(self, app: Flask) -> None:
+        """Add the profiling hooks to an app, if profiling is enabled.
+
+        :param app: app to profile requests for
+        """
+        if app.config["PROFILE_SAMPLE_RATE"] <= 0 and not app.config["PROFILE_SECRET"]:
+            return
+
+        os.makedirs(app.config["PROFILE_DIR"], exist_ok=True)
+        app.before_request(start_profile)
+        app.teardown_request(finish_profile)
+
+
+def should_profile() -> bool:
+    """Check if the current request should be profiled.
+
+    :return: True if the request was sampled or asked to be profiled with the secret
+    """
+    secret = current_app.config["PROFILE_SECRET"]
+    header = request.headers.get(PROFILE_HEADER)
+    if secret and header is not None and hmac.compare_digest(header, secret):
+        return True
+
+    sample_rate: float = current_app.config["PROFILE_SAMPLE_RATE"]
+    return random.random() < sample_rate
+
+
+def start_profile() -> None:
+    """Start profiling the current request if it should be profiled."""
+    if not should_profile():
+        return
+
+    profile = cProfile.Profile()
+    g.profile = profile
+    g.profile_start = time.perf_counter()
+    profile.enable()
+
+
+def finish_profile(exc: Optional[BaseException]) -> None:
+    """Stop profiling the current request and write the profile.
+
+    :param exc: exception raised while handling the request, if any
+    """
+    del exc
+    profile: Optional[cProfile.Profile] = g.pop("profile", None)
+    if profile is None:
+        return
+
+    profile.disable()
+    duration_ms = (time.perf_counter() - g.pop("profile_start")) * 1000
+
+    endpoint = re.sub(r"[^\w.]", "_", request.endpoint or "none")
+    channel_id = g.get("channel_id", "none")
+    name = (
+        f"{time.strftime('%Y%m%dT%H%M%S')}-{endpoint}-channel_{channel_id}-"
+        f"{duration_ms:.0f}ms-{os.getpid()}-{random.randrange(16**6):06x}"
+    )
+    path = os.path.join(current_app.config["PROFILE_DIR"], name)
+
+    try:
+        profile.dump_stats(f"{path}.prof")
+        call_stats = io.StringIO()
+        stats = pstats.Stats(profile, stream=call_stats)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(CALL_STATS_LIMIT)
+        with open(f"{path}.txt", "w", encoding="utf-8") as call_stats_file:
+            call_stats_file.write(f"{request.method} {request.full_path} {duration_ms:.1f}ms\n")
+            call_stats_file.write(call_stats.getvalue())
+
+        remove_old_profiles(
+            current_app.config["PROFILE_DIR"], current_app.config["PROFILE_MAX_BYTES"]
+        )
+    except OSError as exp:
+        current_app.logger.error("error writing profile %s: %s", path, exp)
+        return
+
+    current_app.logger.info("wrote profile %s", path)
+
+
+def remove_old_profiles(directory: str, max_bytes: int) -> None:
+    """Remove the oldest files from the profile directory until it is no larger than the limit.
+
+    :param directory: directory the profiles are written to
+    :param max_bytes: maximum total size of the profiles
+    """
+    files = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file():
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # removed by another process at the same time
+            pass
+        total -= size
+
+
+profiler = Profiler()
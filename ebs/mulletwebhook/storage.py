@@ -0,0 +1,287 @@
+"""Storage backends for image data."""
+
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+from abc import ABC, abstractmethod
+from typing import IO, Optional, Union
+
+from flask import Flask, Response, abort, make_response, send_file
+from sqlalchemy import delete, event, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from mulletwebhook.database import db
+from mulletwebhook.models.element import Image, ImageBlob, ImageVariant
+
+# models that image data can be stored for
+StoredImage = Union[Image, ImageVariant]
+
+# key of the set of digests in the session info whose blobs were deleted in the transaction
+RELEASED_DIGESTS = "released_image_digests"
+
+
+class ImageBackend(ABC):
+    """Base class for places image data can be stored."""
+
+    @abstractmethod
+    def store(self, blob: ImageBlob, file: IO[bytes]) -> None:
+        """Store the data of a new blob, once the blob has been added to the database.
+
+        :param blob: blob the data belongs to
+        :param file: file containing the image data
+        """
+
+    @abstractmethod
+    def send(self, model: type[StoredImage], image_id: int, digest: Optional[str]) -> Response:
+        """Create a response containing the data for an image.
+
+        :param model: model of the image, either Image or ImageVariant
+        :param image_id: id of the image to send
+        :param digest: sha256 digest of the image data
+        :return: response with the image data as the body
+        """
+
+    @abstractmethod
+    def remove(self, digest: str) -> None:
+        """Remove the data of a blob that has been deleted.
+
+        :param digest: sha256 digest of the image data
+        """
+
+
+class DatabaseBackend(ImageBackend):
+    """Stores image data in the image blob table."""
+
+    def store(self, blob: ImageBlob, file: IO[bytes]) -> None:
+        blob.data = file.read()
+
+    def send(self, model: type[StoredImage], image_id: int, digest: Optional[str]) -> Response:
+        data = None
+        if digest is not None:
+            data = (
+                ImageBlob.query.with_entities(ImageBlob.data)
+                .filter(ImageBlob.digest == digest)
+                .scalar()
+            )
+        if data is None:
+            # images that haven't been migrated keep their data in their own row
+            data = model.query.with_entities(model.data).filter(model.id == image_id).scalar()
+        if data is None:
+            abort(404)
+        return make_response(data)
+
+    def remove(self, digest: str) -> None:
+        # the data is deleted along with the blob
+        pass
+
+
+class FilesystemBackend(ImageBackend):
+    """Stores image data in a directory, using the sha256 digest of the data as the file name.
+
+    Images are sent with send_file so the WSGI server can use sendfile, or with a header such as
+    X-Accel-Redirect so that a reverse proxy sends the file instead. Images that have not been
+    migrated out of the database yet are still sent from the database.
+    """
+
+    def __init__(
+        self, root: str, sendfile_header: Optional[str] = None, sendfile_prefix: str = "/"
+    ) -> None:
+        """Create a filesystem backend.
+
+        :param root: directory to store images in
+        :param sendfile_header: header used to ask a reverse proxy to send the file, such as
+            X-Accel-Redirect for nginx or X-Sendfile for apache
+        :param sendfile_prefix: prefix of the path sent in the sendfile header
+        """
+        self.root = root
+        self.sendfile_header = sendfile_header
+        self.sendfile_prefix = sendfile_prefix
+
+    @staticmethod
+    def relative_path(digest: str) -> str:
+        """Get the path of an image relative to the storage directory.
+
+        :param digest: sha256 digest of the image data
+        :return: relative path to the image file
+        """
+        return os.path.join(digest[0:2], digest[2:4], digest)
+
+    def path(self, digest: str) -> str:
+        """Get the full path of an image file.
+
+        :param digest: sha256 digest of the image data
+        :return: path to the image file
+        """
+        return os.path.join(self.root, self.relative_path(digest))
+
+    def write(self, digest: str, file: IO[bytes]) -> None:
+        """Write image data to the storage directory, replacing any file left by a deleted blob.
+
+        :param digest: sha256 digest of the image data
+        :param file: file containing the image data
+        """
+        path = self.path(digest)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # write to a temporary file first so a partially written file is never served
+        with tempfile.NamedTemporaryFile(dir=directory, delete=False) as tmp_file:
+            shutil.copyfileobj(file, tmp_file)
+        os.replace(tmp_file.name, path)
+
+    def store(self, blob: ImageBlob, file: IO[bytes]) -> None:
+        self.write(blob.digest, file)
+
+    def send(self, model: type[StoredImage], image_id: int, digest: Optional[str]) -> Response:
+        if digest is None or not os.path.exists(self.path(digest)):
+            return DatabaseBackend().send(model, image_id, digest)
+
+        if self.sendfile_header:
+            resp = make_response()
+            resp.headers[self.sendfile_header] = self.sendfile_prefix + self.relative_path(digest)
+            return resp
+
+        return send_file(self.path(digest), conditional=False, etag=False)
+
+    def remove(self, digest: str) -> None:
+        # a placeholder blob is added while the file is removed, so a request storing the same image
+        # again waits to add its blob until the file is gone before writing the file again
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(insert(ImageBlob).values(digest=digest, refcount=0))
+                try:
+                    os.remove(self.path(digest))
+                except FileNotFoundError:
+                    pass
+                conn.execute(delete(ImageBlob).where(ImageBlob.digest == digest))  # type: ignore
+        except IntegrityError:
+            # the image was stored again after its blob was deleted
+            pass
+
+
+class ImageStorage:
+    """Stores image data using the backend selected by the app config.
+
+    Image data is stored once for each distinct image as an ImageBlob that counts how many images
+    and image variants reference it. When the last reference is released the blob is deleted, and
+    its data is removed from the backend once the deletion is committed.
+    """
+
+    def __init__(self) -> None:
+        self.backend: ImageBackend = DatabaseBackend()
+        event.listen(Session, "after_commit", self.remove_released)
+        event.listen(Session, "after_rollback", self.forget_released)
+
+    def init_app(self, app: Flask) -> None:
+        """Configure the storage backend for an app.
+
+        :param app: app to read the storage configuration from
+        :raises ValueError: if the configured backend doesn't exist
+        """
+        if app.config["IMAGE_STORAGE"] == "database":
+            self.backend = DatabaseBackend()
+        elif app.config["IMAGE_STORAGE"] == "filesystem":
+            self.backend = FilesystemBackend(
+                app.config["IMAGE_STORAGE_PATH"],
+                sendfile_header=app.config["IMAGE_SENDFILE_HEADER"],
+                sendfile_prefix=app.config["IMAGE_SENDFILE_PREFIX"],
+            )
+        else:
+            raise ValueError(f"unknown image storage backend: {app.config['IMAGE_STORAGE']}")
+
+    def save(self, image: StoredImage, data: bytes) -> None:
+        """Store the data for an image, releasing the data it previously referenced.
+
+        :param image: image or image variant the data belongs to
+        :param data: image data
+        """
+        self.save_file(image, io.BytesIO(data), hashlib.sha256(data).hexdigest())
+
+    def save_file(self, image: StoredImage, file: IO[bytes], digest: str) -> None:
+        """Store the data for an image from a file, releasing the data it previously referenced.
+
+        The file is only read if no other image has the same data.
+
+        :param image: image or image variant the data belongs to
+        :param file: file containing the image data
+        :param digest: sha256 digest of the image data
+        """
+        self.acquire(digest, file)
+        # images that haven't been migrated don't reference a blob
+        if image.digest is not None and image.data is None:
+            self.release(image.digest)
+        image.data = None
+        image.digest = digest
+
+    def acquire(self, digest: str, file: IO[bytes]) -> None:
+        """Add a reference to a blob, storing the data if no other image references it.
+
+        :param digest: sha256 digest of the image data
+        :param file: file containing the image data
+        """
+        referenced = ImageBlob.query.filter(ImageBlob.digest == digest).update(
+            {"refcount": ImageBlob.refcount + 1}, synchronize_session=False
+        )
+        if referenced:
+            return
+
+        blob = ImageBlob(digest=digest, refcount=1)
+        try:
+            with db.session.begin_nested():
+                db.session.add(blob)
+        except IntegrityError:
+            # another request stored the same image first
+            ImageBlob.query.filter(ImageBlob.digest == digest).update(
+                {"refcount": ImageBlob.refcount + 1}, synchronize_session=False
+            )
+            return
+
+        self.backend.store(blob, file)
+
+    def release(self, digest: Optional[str]) -> None:
+        """Remove a reference to a blob, deleting the blob if nothing else references it.
+
+        :param digest: sha256 digest of the image data, or None if the image has no data stored
+        """
+        if digest is None:
+            return
+
+        ImageBlob.query.filter(ImageBlob.digest == digest).update(
+            {"refcount": ImageBlob.refcount - 1}, synchronize_session=False
+        )
+        deleted = ImageBlob.query.filter(
+            ImageBlob.digest == digest, ImageBlob.refcount <= 0
+        ).delete(synchronize_session=False)
+        if deleted:
+            db.session.info.setdefault(RELEASED_DIGESTS, set()).add(digest)
+
+    def remove_released(self, session: Session) -> None:
+        """Remove the data of blobs that were deleted by a committed transaction.
+
+        :param session: session that was committed
+        """
+        for digest in session.info.pop(RELEASED_DIGESTS, set()):
+            self.backend.remove(digest)
+
+    @staticmethod
+    def forget_released(session: Session) -> None:
+        """Keep the data of blobs that were deleted by a rolled back transaction.
+
+        :param session: session that was rolled back
+        """
+        session.info.pop(RELEASED_DIGESTS, None)
+
+    def send(self, model: type[StoredImage], image_id: int, digest: Optional[str]) -> Response:
+        """Create a response containing the data for an image.
+
+        :param model: model of the image, either Image or ImageVariant
+        :param image_id: id of the image to send
+        :param digest: sha256 digest of the image data
+        :return: response with the image data as the body
+        """
+        return self.backend.send(model, image_id, digest)
+
+
+image_storage = ImageStorage()
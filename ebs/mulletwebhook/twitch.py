@@ -1,12 +1,26 @@
 """Twitch related functions."""
 
-import base64
+import asyncio
+import os
+import threading
 import time
-from typing import Any
+from typing import Any, Optional
 
+import httpx
 import jwt
-import requests
-from flask import current_app
+from flask import Flask, current_app
+
+from mulletwebhook import http_client, metrics, utils
+from mulletwebhook.cache import TTLCache
+
+# number of seconds a pubsub JWT is valid for
+PUBSUB_JWT_LIFETIME = 10
+# number of seconds before a pubsub JWT expires that a new one is created
+PUBSUB_JWT_REFRESH_MARGIN = 2
+
+pubsub_jwt_headers_cache: TTLCache[dict[str, Any]] = TTLCache(
+    maxsize=1024, ttl=PUBSUB_JWT_LIFETIME - PUBSUB_JWT_REFRESH_MARGIN
+)
 
 
 def create_pubsub_jwt_headers(broadcaster_id: int) -> dict[str, Any]:
@@ -16,7 +30,7 @@ def create_pubsub_jwt_headers(broadcaster_id: int) -> dict[str, Any]:
     :return: dictionary of JWT headers that can be used for pubsub messages
     """
     jwt_payload = {
-        "exp": int(time.time() + 10),
+        "exp": int(time.time() + PUBSUB_JWT_LIFETIME),
         "user_id": str(broadcaster_id),
         "role": "external",
         "channel_id": str(broadcaster_id),
@@ -25,7 +39,7 @@ def create_pubsub_jwt_headers(broadcaster_id: int) -> dict[str, Any]:
 
     jwt_token = jwt.encode(
         payload=jwt_payload,
-        key=base64.b64decode(current_app.config["EXTENSION_SECRET"]),
+        key=utils.get_extension_secret(),
     )
 
     headers = {
@@ -35,15 +49,31 @@ def create_pubsub_jwt_headers(broadcaster_id: int) -> dict[str, Any]:
     return headers
 
 
-def send_refresh_pubsub(broadcaster_id: int) -> None:
+def get_pubsub_jwt_headers(broadcaster_id: int) -> dict[str, Any]:
+    """Get JWT headers that can be used to send pubsub messages, reusing them until shortly before
+    the JWT expires.
+
+    :param broadcaster_id: id of the broadcaster to get the headers for
+    :return: dictionary of JWT headers that can be used for pubsub messages
+    """
+    headers = pubsub_jwt_headers_cache.get(broadcaster_id)
+    if headers is None:
+        headers = create_pubsub_jwt_headers(broadcaster_id)
+        pubsub_jwt_headers_cache.set(broadcaster_id, headers)
+
+    return headers
+
+
+async def send_refresh_pubsub(client: httpx.AsyncClient, broadcaster_id: int) -> None:
     """Send a refresh message to the extension owned by a specific broadcaster.
 
+    :param client: client to send the message with
     :param broadcaster_id: id of the broadcaster to send pubsub message for
     """
 
     current_app.logger.debug("sending refresh pubsub message")
 
-    jwt_headers = create_pubsub_jwt_headers(broadcaster_id)
+    jwt_headers = get_pubsub_jwt_headers(broadcaster_id)
 
     body = {
         "target": ["broadcast"],
@@ -51,11 +81,113 @@ def send_refresh_pubsub(broadcaster_id: int) -> None:
         "message": "refresh",
     }
 
-    resp = requests.post(
-        "https://api.twitch.tv/helix/extensions/pubsub",
+    resp = await http_client.async_timed_post(
+        client,
+        f"{current_app.config['TWITCH_API_URL']}/extensions/pubsub",
         timeout=current_app.config["REQUEST_TIMEOUT"],
         json=body,
         headers=jwt_headers,
     )
     current_app.logger.debug("response_status=%s response_text=%s", resp.status_code, resp.text)
     resp.raise_for_status()
+
+
+class RefreshDispatcher:
+    """Sends refresh pubsub messages from an event loop running in a background thread.
+
+    The first refresh requested for a broadcaster is sent once the refresh window has passed. Any
+    further refreshes requested for the same broadcaster before it is sent are coalesced into it, so
+    a burst of edits only results in a single call to the Twitch API. Refreshes for different
+    broadcasters are sent concurrently, so a slow response doesn't hold up the others.
+    """
+
+    def __init__(self) -> None:
+        self.app: Optional[Flask] = None
+        self._pending: set[int] = set()
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._tasks: set[asyncio.Task[None]] = set()
+        self._pid: Optional[int] = None
+
+    def init_app(self, app: Flask) -> None:
+        """Configure the dispatcher for an app.
+
+        :param app: app to send refresh messages for
+        """
+        self.app = app
+
+    def ensure_started(self) -> asyncio.AbstractEventLoop:
+        """Start the dispatcher thread if it is not already running in the current process.
+
+        :return: event loop the refresh messages are sent from
+        """
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                self._pending = set()
+                self._client = None
+                self._tasks = set()
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._loop.run_forever, name="refresh-dispatcher", daemon=True
+                ).start()
+                self._pid = os.getpid()
+
+            return self._loop
+
+    def request_refresh(self, broadcaster_id: int) -> None:
+        """Queue a refresh message for the extension owned by a specific broadcaster.
+
+        :param broadcaster_id: id of the broadcaster to send pubsub message for
+        """
+        assert self.app is not None
+
+        loop = self.ensure_started()
+
+        with self._lock:
+            if broadcaster_id in self._pending:
+                metrics.PUBSUB_REFRESHES.labels("coalesced").inc()
+                return
+            self._pending.add(broadcaster_id)
+
+        loop.call_soon_threadsafe(
+            loop.call_later,
+            self.app.config["PUBSUB_REFRESH_WINDOW"],
+            self._start_refresh,
+            broadcaster_id,
+        )
+
+    def _start_refresh(self, broadcaster_id: int) -> None:
+        """Start sending a refresh message that is due, called from the event loop.
+
+        :param broadcaster_id: id of the broadcaster to send pubsub message for
+        """
+        with self._lock:
+            self._pending.discard(broadcaster_id)
+
+        # the loop only keeps weak references to tasks
+        task = asyncio.create_task(self._refresh(broadcaster_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _refresh(self, broadcaster_id: int) -> None:
+        """Send a refresh message, logging any errors.
+
+        :param broadcaster_id: id of the broadcaster to send pubsub message for
+        """
+        assert self.app is not None
+
+        try:
+            with self.app.app_context():
+                if self._client is None:
+                    self._client = http_client.create_async_client()
+                await send_refresh_pubsub(self._client, broadcaster_id)
+            metrics.PUBSUB_REFRESHES.labels("sent").inc()
+        except Exception:  # pylint: disable=broad-exception-caught
+            metrics.PUBSUB_REFRESHES.labels("failed").inc()
+            self.app.logger.exception(
+                "error sending refresh pubsub for broadcaster_id=%s", broadcaster_id
+            )
+
+
+refresh_dispatcher = RefreshDispatcher()
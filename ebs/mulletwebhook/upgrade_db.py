@@ -0,0 +1,63 @@
+"""Upgrade the schema of an existing database without losing its data."""
+
+from flask import current_app
+from sqlalchemy import inspect, text
+
+from mulletwebhook import create_app, utils
+from mulletwebhook.database import db
+from mulletwebhook.models.layout import Layout
+
+# columns added to tables created by earlier versions, with the statement that adds each one
+ADDED_COLUMNS = {
+    ("layout", "version"): "ALTER TABLE layout ADD COLUMN version INTEGER NOT NULL DEFAULT 0",
+    ("image", "digest"): "ALTER TABLE image ADD COLUMN digest VARCHAR(64)",
+    ("image", "width"): "ALTER TABLE image ADD COLUMN width INTEGER",
+}
+# image data is kept in the image blob table or on disk once it has been migrated
+IMAGE_DATA_NULLABLE = "ALTER TABLE image ALTER COLUMN data DROP NOT NULL"
+
+
+def upgrade() -> None:
+    """Add the columns and tables that are missing from the database.
+
+    Each change is only made if it is missing, so the upgrade can be run more than once. Tables that
+    don't exist yet are created by create_all, which leaves existing tables alone.
+    """
+    inspector = inspect(db.engine)
+    tables = set(inspector.get_table_names())
+    columns = {
+        table: {column["name"]: column for column in inspector.get_columns(table)}
+        for table in ("layout", "image")
+        if table in tables
+    }
+
+    statements = [
+        statement
+        for (table, column), statement in ADDED_COLUMNS.items()
+        if table in columns and column not in columns[table]
+    ]
+    if "image" in columns and not columns["image"]["data"]["nullable"]:
+        statements.append(IMAGE_DATA_NULLABLE)
+
+    for statement in statements:
+        current_app.logger.info("upgrading schema: %s", statement)
+        db.session.execute(text(statement))
+    db.session.commit()
+
+    db.create_all()
+
+    # elements created by earlier versions have consecutive positions, leave gaps between them so
+    # they can be moved without renumbering the layout
+    for (layout_id,) in Layout.query.with_entities(Layout.id).all():
+        utils.rebalance_layout(layout_id)
+    db.session.commit()
+
+
+def main() -> None:
+    """Upgrades the database."""
+    with create_app().app_context():
+        upgrade()
+
+
+if __name__ == "__main__":
+    main()
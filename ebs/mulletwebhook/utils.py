@@ -1,36 +1,167 @@
 """Utility functions."""
 
+import base64
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Any, Optional
+
 from flask import current_app
-from sqlalchemy import desc
+from sqlalchemy import DateTime, desc, func, literal, select, update
 from sqlalchemy.exc import NoResultFound
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
 
+from mulletwebhook.cache import layout_cache
 from mulletwebhook.database import db
 from mulletwebhook.models.element import Element
+from mulletwebhook.models.enums import ElementType
+from mulletwebhook.models.layout import Layout
+
+# gap left between the positions of elements, so an element can be moved by only updating its own
+# position
+POSITION_STEP = 1024
+
+
+@lru_cache(maxsize=4)
+def decode_secret(secret: str) -> bytes:
+    """Decode a base64 encoded secret.
+
+    :param secret: base64 encoded secret
+    :return: decoded secret
+    """
+    return base64.b64decode(secret)
+
+
+def get_extension_secret() -> bytes:
+    """Get the decoded extension secret used to sign and verify JWTs.
+
+    :return: decoded extension secret, only decoded once per process
+    """
+    return decode_secret(current_app.config["EXTENSION_SECRET"])
+
+
+def rebalance_layout(layout_id: int) -> None:
+    """Spread the positions of the elements of a layout evenly, restoring the gaps between them.
+
+    All elements are renumbered with a single UPDATE as part of the current transaction, regardless
+    of the layout size.
+
+    :param layout_id: id of the layout to rebalance
+    """
+    current_app.logger.debug("rebalancing positions of layout %s", layout_id)
+    row_number = func.row_number().over(order_by=(Element.position, Element.id))  # type: ignore
+    new_positions = (
+        select(Element.id, (row_number * POSITION_STEP).label("position"))  # type: ignore
+        .where(Element.layout_id == layout_id)
+        .subquery()
+    )
+    db.session.execute(
+        update(Element)
+        .where(
+            Element.id == new_positions.c.id,
+            Element.position.is_distinct_from(new_positions.c.position),  # type: ignore
+        )
+        .values(position=new_positions.c.position)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def get_position_before(layout_id: int, element_id: int, before_id: int) -> Optional[int]:
+    """Get a free position between an element and the element displayed before it.
+
+    :param layout_id: id of the layout the elements are in
+    :param element_id: id of the element being moved, which is ignored when finding the gap
+    :param before_id: id of the element to find a position before
+    :raises ValueError: if the element to find a position before isn't in the layout
+    :return: the free position, or None if there is no gap left between the elements
+    """
+    next_position = (
+        Element.query.with_entities(Element.position)
+        .filter(Element.id == before_id, Element.layout_id == layout_id)
+        .scalar()
+    )
+    if next_position is None:
+        raise ValueError(f"element {before_id} is not in layout {layout_id}")
+
+    previous_position = (
+        Element.query.with_entities(func.max(Element.position))
+        .filter(
+            Element.layout_id == layout_id,
+            Element.position < next_position,
+            Element.id != element_id,
+        )
+        .scalar()
+    )
+    if previous_position is None:
+        return int(next_position) - POSITION_STEP
+    if next_position - previous_position < 2:
+        return None
+
+    return int(previous_position + next_position) // 2
+
+
+def move_element(layout_id: int, element_id: int, before_id: Optional[int]) -> None:
+    """Move an element of a layout as part of the current transaction.
+
+    Only the moved element is updated, unless there is no gap left where it was moved to. The
+    layout is then rebalanced first, which happens rarely since gaps start at POSITION_STEP.
+
+    As in create_element, the layout version is incremented before the new position is found, so
+    concurrent moves in the same layout wait for each other instead of picking the same gap.
+
+    :param layout_id: id of the layout the element is in
+    :param element_id: id of the element to move
+    :param before_id: id of the element to display the moved element before, or None to move the
+        element to the end of the layout
+    :raises ValueError: if the elements aren't in the layout
+    """
+    if before_id == element_id:
+        return
+
+    invalidate_layout(layout_id)
+    if before_id is None:
+        position: Optional[int] = get_next_layout_position(layout_id)
+    else:
+        position = get_position_before(layout_id, element_id, before_id)
+        if position is None:
+            rebalance_layout(layout_id)
+            position = get_position_before(layout_id, element_id, before_id)
+
+    moved = Element.query.filter(Element.id == element_id, Element.layout_id == layout_id).update(
+        {"position": position}, synchronize_session=False
+    )
+    if not moved:
+        raise ValueError(f"element {element_id} is not in layout {layout_id}")
+
 
+def create_element(layout_id: int, element_type: ElementType) -> Element:
+    """Add an element to the end of a layout as part of the current transaction.
 
-def ensure_layout_order(layout_id: int) -> None:
-    """Make sure elements are in consecutive order in the database.
+    The layout version is incremented before the position is allocated, which locks the layout row
+    until the transaction ends. Concurrent requests adding elements to the same layout wait for the
+    lock, so each one sees the positions allocated by the others. The element is flushed but not
+    committed so its child can be added in the same transaction.
 
-    :param layout_id: id of the layout to re-order
+    :param layout_id: id of the layout to add the element to
+    :param element_type: type of the element
+    :return: the new element
     """
-    elements = Element.query.filter(Element.layout_id == layout_id).order_by(Element.position).all()
+    invalidate_layout(layout_id)
+    element = Element(
+        layout_id=layout_id,
+        element_type=element_type,
+        position=get_next_layout_position(layout_id),
+    )
+    db.session.add(element)
+    db.session.flush()
 
-    for index, element in enumerate(elements):
-        if element.position != index:
-            current_app.logger.debug(
-                "updating position of element %s from %s to %s",
-                element.id,
-                element.position,
-                index,
-            )
-            element.position = index
-    db.session.commit()
+    return element
 
 
 def get_next_layout_position(layout_id: int) -> int:
-    """Get the next available index in a layout.
+    """Get the next available position at the end of a layout.
 
-    :param layout_id: id of the layout to find a free index for
+    :param layout_id: id of the layout to find a free position for
     """
     try:
         element = (
@@ -40,6 +171,74 @@ def get_next_layout_position(layout_id: int) -> int:
             .one()
         )
     except NoResultFound:
-        return 0
+        return POSITION_STEP
+
+    return int(element.position) + POSITION_STEP
+
+
+def invalidate_layout(layout_id: int) -> None:
+    """Mark the rendered html of a layout as stale.
+
+    The layout version is incremented as part of the current transaction so that cached html is not
+    served by any worker once the change is committed.
+
+    :param layout_id: id of the layout that was modified
+    """
+    db.session.execute(
+        update(Layout)
+        .where(Layout.id == layout_id)  # type: ignore
+        .values(version=Layout.version + 1)
+    )
+    layout_cache.invalidate(layout_id)
+
+
+def utcnow() -> datetime:
+    """Get the current time in UTC.
+
+    :return: naive datetime in UTC, matching how times are stored in the database
+    """
+    return datetime.now(timezone.utc).replace(tzinfo=None)
 
-    return int(element.position) + 1
+
+# pylint: disable=too-few-public-methods
+class DatabaseUtcNow(FunctionElement[datetime]):
+    """Current time in UTC according to the database, offset by a number of seconds."""
+
+    type = DateTime()
+    inherit_cache = True
+
+
+@compiles(DatabaseUtcNow)
+def compile_database_utcnow(element: DatabaseUtcNow, compiler: Any, **kwargs: Any) -> str:
+    """Compile the current time for PostgreSQL.
+
+    :param element: expression being compiled
+    :param compiler: SQL compiler of the dialect
+    :param kwargs: options passed on to the compiler
+    :return: SQL for the expression
+    """
+    offset = compiler.process(element.clauses, **kwargs)
+    return f"(TIMEZONE('utc', CURRENT_TIMESTAMP) + {offset} * INTERVAL '1 second')"
+
+
+@compiles(DatabaseUtcNow, "sqlite")
+def compile_database_utcnow_sqlite(element: DatabaseUtcNow, compiler: Any, **kwargs: Any) -> str:
+    """Compile the current time for SQLite, formatted the same way SQLAlchemy stores datetimes.
+
+    :param element: expression being compiled
+    :param compiler: SQL compiler of the dialect
+    :param kwargs: options passed on to the compiler
+    :return: SQL for the expression
+    """
+    offset = compiler.process(element.clauses, **kwargs)
+    return f"STRFTIME('%Y-%m-%d %H:%M:%f000', 'now', {offset} || ' seconds')"
+
+
+def database_utcnow(offset: float = 0) -> DatabaseUtcNow:
+    """Get the current time in UTC from the database, so times compared in SQL don't depend on the
+    clocks of the processes that wrote them.
+
+    :param offset: number of seconds to add to the current time
+    :return: SQL expression for the current time
+    """
+    return DatabaseUtcNow(literal(offset))
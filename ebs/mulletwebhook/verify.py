@@ -1,18 +1,38 @@
 """Functions related to verification of auth tokens."""
 
-import base64
+import hashlib
+import time
 from functools import wraps
-from typing import Callable, Tuple, TypeVar, cast, Any
+from typing import Callable, Optional, Tuple, TypeVar, cast, Any
 
 import jwt
-from flask import Request, abort, current_app
+from flask import Request, abort, current_app, g
 from flask import request as flask_request
 
+from mulletwebhook import utils
+from mulletwebhook.cache import TTLCache
+from mulletwebhook.database import db
+from mulletwebhook.models.delivery import Delivery
 from mulletwebhook.models.element import Element, Image, Text, Webhook
 from mulletwebhook.models.layout import Layout
 
 R = TypeVar("R", bound=Callable[..., Any])
 
+# maximum number of verified tokens to remember per process
+VERIFIED_TOKEN_CACHE_SIZE = 4096
+
+verified_tokens: TTLCache[Tuple[int, str]] = TTLCache(maxsize=VERIFIED_TOKEN_CACHE_SIZE)
+
+# models of the objects that views can be passed ids for, keyed by the name of the view argument
+OWNED_MODELS = {
+    "layout_id": Layout,
+    "element_id": Element,
+    "image_id": Image,
+    "text_id": Text,
+    "webhook_id": Webhook,
+    "delivery_id": Delivery,
+}
+
 
 def token_required(func: R) -> R:
     """Decorator to validate JWT and get the associated channel_id and role.
@@ -38,11 +58,44 @@ def token_required(func: R) -> R:
         current_app.logger.debug(
             "authenticated request for channel_id=%s role=%s", channel_id, role
         )
+        # tag profiles of the request with the channel
+        g.channel_id = channel_id
         return cast(R, func(*args, **kwargs, channel_id=channel_id, role=role))
 
     return cast(R, decorated_function)
 
 
+def get_owned_object(model: Any, object_id: int) -> Optional[Tuple[Any, int]]:
+    """Load an object along with the id of the broadcaster that owns it in a single query.
+
+    The object is added to the session, so views can get it again with db.session.get() without
+    another query.
+
+    :param model: model of the object to load
+    :param object_id: id of the object to load
+    :return: the object and the id of the broadcaster that owns it, or None if it doesn't exist
+    """
+    if model in (Layout, Delivery):
+        query = db.session.query(model, model.broadcaster_id)
+    elif model is Element:
+        query = db.session.query(Element, Layout.broadcaster_id).join(  # type: ignore
+            Layout, Element.layout_id == Layout.id
+        )
+    else:
+        query = (
+            db.session.query(model, Layout.broadcaster_id)  # type: ignore
+            .join(Element, model.element_id == Element.id)
+            .join(Layout, Element.layout_id == Layout.id)
+        )
+
+    result = query.filter(model.id == object_id).one_or_none()
+    if result is None:
+        return None
+
+    owned_object, broadcaster_id = result
+    return owned_object, broadcaster_id
+
+
 def owned_by_broadcaster(func: R) -> R:
     """Decorator that ensures that the broadcaster has permission to the elements being accessed.
 
@@ -53,58 +106,28 @@ def owned_by_broadcaster(func: R) -> R:
     @wraps(func)
     def decorated_function(*args: Any, **kwargs: Any) -> R:
 
-        current_app.logger.info(kwargs)
+        current_app.logger.debug("kwargs=%s", kwargs)
 
         channel_id = kwargs["channel_id"]
 
-        if "layout_id" in kwargs:
-            layout_id = kwargs["layout_id"]
-            layout = Layout.query.filter(Layout.id == layout_id).one()
-            if layout.broadcaster.id != channel_id:
-                return abort(
-                    401,
-                    f"layout with id={layout_id} is not owned by "
-                    f"broadcaster={layout.broadcaster.name}",
-                )
-
-        if "element_id" in kwargs:
-            element_id = kwargs["element_id"]
-            element = Element.query.filter(Element.id == element_id).one()
-            if element.layout.broadcaster.id != channel_id:
-                return abort(
-                    401,
-                    f"element with id={element_id} is not owned by "
-                    f"broadcaster={element.layout.broadcaster.name}",
-                )
-
-        if "image_id" in kwargs:
-            image_id = kwargs["image_id"]
-            image = Image.query.filter(Image.id == image_id).one()
-            if image.element.layout.broadcaster.id != channel_id:
-                return abort(
-                    401,
-                    f"image with id={image_id} is not owned by "
-                    f"broadcaster={image.element.layout.broadcaster.name}",
-                )
+        for kwarg, model in OWNED_MODELS.items():
+            if kwarg not in kwargs:
+                continue
 
-        if "text_id" in kwargs:
-            text_id = kwargs["text_id"]
-            text = Text.query.filter(Text.id == text_id).one()
-            if text.element.layout.broadcaster.id != channel_id:
-                return abort(
-                    401,
-                    f"text with id={text_id} is not owned by "
-                    f"broadcaster={text.element.layout.broadcaster.name}",
-                )
+            object_id = kwargs[kwarg]
+            object_name = kwarg.removesuffix("_id")
+            result = get_owned_object(model, object_id)
+            if result is None:
+                return abort(404, f"{object_name} with id={object_id} does not exist")
 
-        if "webhook_id" in kwargs:
-            webhook_id = kwargs["webhook_id"]
-            webhook = Webhook.query.filter(Webhook.id == webhook_id).one()
-            if webhook.element.layout.broadcaster.id != channel_id:
+            owned_object, broadcaster_id = result
+            # the session only holds weak references, so keep the object loaded for the view
+            g.setdefault("owned_objects", []).append(owned_object)
+            if broadcaster_id != channel_id:
                 return abort(
                     401,
-                    f"webhook with id={webhook_id} is not owned by "
-                    f"broadcaster={webhook.element.layout.broadcaster.name}",
+                    f"{object_name} with id={object_id} is not owned by "
+                    f"broadcaster={channel_id}",
                 )
 
         return cast(R, func(*args, **kwargs))
@@ -121,7 +144,7 @@ def is_broadcaster(func: R) -> R:
 
     @wraps(func)
     def decorated_function(*args: Any, **kwargs: Any) -> R:
-        current_app.logger.info("role=%s", kwargs["role"])
+        current_app.logger.debug("role=%s", kwargs["role"])
         if kwargs["role"] != "broadcaster":
             abort(403, "user role is not broadcaster")
 
@@ -149,11 +172,17 @@ def verify_jwt(request: Request) -> Tuple[int, str]:
         current_app.logger.debug(error_msg)
         raise PermissionError(error_msg) from exp
 
+    # tokens are resent for many requests, so skip verifying tokens that were already verified
+    token_hash = hashlib.sha256(token.encode()).digest()
+    verified = verified_tokens.get(token_hash)
+    if verified is not None:
+        return verified
+
     payload = None
     try:
         payload = jwt.decode(
             token,
-            key=base64.b64decode(current_app.config["EXTENSION_SECRET"]),
+            key=utils.get_extension_secret(),
             algorithms=["HS256"],
         )
         current_app.logger.debug("payload: %s", payload)
@@ -166,4 +195,8 @@ def verify_jwt(request: Request) -> Tuple[int, str]:
         current_app.logger.debug(error_message)
         raise PermissionError(error_message) from exp
 
+    # only cache the token until it expires
+    if "exp" in payload:
+        verified_tokens.set(token_hash, (channel_id, role), ttl=payload["exp"] - time.time())
+
     return channel_id, role
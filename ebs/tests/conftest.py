@@ -0,0 +1,147 @@
+"""Fixtures shared by the tests."""
+
+import base64
+import io
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+import jwt
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+from sqlalchemy import event
+from werkzeug.test import TestResponse
+
+from mulletwebhook import create_app, twitch
+from mulletwebhook.config import Config
+from mulletwebhook.database import db
+
+
+# secret the extension JWTs are signed with
+SECRET = b"0123456789abcdef0123456789abcdef"
+
+
+@pytest.fixture(autouse=True)
+def no_pubsub(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Stop refresh messages from being queued to be sent to Twitch."""
+    monkeypatch.setattr(twitch.refresh_dispatcher, "request_refresh", lambda broadcaster_id: None)
+
+
+@pytest.fixture
+def app(tmp_path: Path) -> Iterator[Flask]:
+    """Create an app using a new SQLite database.
+
+    The database is a file so that it can be shared by the threads of concurrent requests.
+    Authentication is skipped in testing mode, so every request is made by the broadcaster of
+    channel 12345678.
+    """
+
+    class TestConfig(Config):
+        """Configuration for the tests."""
+
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'mulletwebhook.db'}"
+        EBS_URL = "https://ebs.example.com"
+        EXTENSION_SECRET = base64.b64encode(SECRET).decode()
+        DELIVERY_WORKERS = 0
+        IMAGE_STORAGE = "database"
+
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+
+    yield app
+
+    with app.app_context():
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app: Flask) -> FlaskClient:
+    """Create a test client for the app."""
+    return app.test_client()
+
+
+@pytest.fixture
+def layout_id(client: FlaskClient) -> int:
+    """Create a layout and make it the active layout of the broadcaster."""
+    resp = client.post("/layout/create", data={"name": "layout", "title": "title"})
+    assert resp.status_code == 200
+    resp = client.post("/layouts", data={"layouts": "1", "make_active": "Activate"})
+    assert resp.status_code == 200
+    return 1
+
+
+@pytest.fixture
+def statements(app: Flask) -> Iterator[list[str]]:
+    """Record the SQL statements executed by the app.
+
+    Clear the list before the part of a test that is being measured.
+    """
+    executed: list[str] = []
+
+    def record(conn: Any, cursor: Any, statement: str, *args: Any) -> None:
+        del conn, cursor, args
+        executed.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", record)
+    yield executed
+    event.remove(engine, "before_cursor_execute", record)
+
+
+# smallest valid png, a single transparent pixel
+PNG = (
+    b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x06\x00\x00\x00"
+    b"\x1f\x15\xc4\x89\x00\x00\x00\rIDATx\x9cc\xf8\x0f\x00\x00\x01\x01\x00\x05\x18\xd8N\x00\x00"
+    b"\x00\x00IEND\xaeB`\x82"
+)
+
+
+@pytest.fixture
+def add_element(client: FlaskClient, layout_id: int) -> Callable[[str], None]:
+    """Get a function that adds an element to the layout through the create route for its type."""
+
+    def add(element_type: str) -> None:
+        if element_type == "text":
+            resp = client.post(f"/layout/{layout_id}/text/create", data={"text": "hello"})
+        elif element_type == "image":
+            resp = client.post(
+                f"/layout/{layout_id}/image/create",
+                data={"image": (io.BytesIO(PNG), "pixel.png")},
+                content_type="multipart/form-data",
+            )
+        else:
+            resp = client.post(
+                f"/layout/{layout_id}/webhook/create",
+                data={
+                    "name": "webhook",
+                    "url": "https://hooks.example.com/hook",
+                    "bits_product": "reward_1bits",
+                    "extra_data": "{}",
+                },
+            )
+        assert resp.status_code == 200, resp.data
+
+    return add
+
+
+@pytest.fixture
+def webhook_id(add_element: Callable[[str], None]) -> int:
+    """Add a webhook element to the layout."""
+    add_element("webhook")
+    return 1
+
+
+@pytest.fixture
+def redeem(client: FlaskClient) -> Callable[[int, str], TestResponse]:
+    """Get a function that redeems a webhook with a receipt for a bits transaction."""
+
+    def send(webhook_id: int, transaction_id: str) -> TestResponse:
+        receipt = jwt.encode({"data": {"transactionId": transaction_id}}, key=SECRET)
+        return client.post(
+            f"/webhook/{webhook_id}", json={"transaction": {"transactionReceipt": receipt}}
+        )
+
+    return send
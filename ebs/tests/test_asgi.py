@@ -0,0 +1,35 @@
+"""Tests for serving the app with an ASGI server."""
+
+import asyncio
+import threading
+
+import httpx
+from flask import Flask
+
+from mulletwebhook.asgi import ThreadPoolWsgiToAsgi
+
+REQUESTS = 4
+
+
+def test_concurrent_requests(app: Flask) -> None:
+    """Requests are handled at the same time by the threads of the pool."""
+    # every request waits until all of them have started, which fails if they run one at a time
+    barrier = threading.Barrier(REQUESTS, timeout=5)
+    threads: set[str] = set()
+
+    @app.before_request
+    def wait_for_other_requests() -> None:
+        threads.add(threading.current_thread().name)
+        barrier.wait()
+
+    async def send_requests() -> list[int]:
+        transport = httpx.ASGITransport(app=ThreadPoolWsgiToAsgi(app, REQUESTS))
+        async with httpx.AsyncClient(transport=transport, base_url="http://ebs") as client:
+            responses = await asyncio.gather(
+                *(client.get("/webhook/1/cooldown") for _ in range(REQUESTS))
+            )
+        return [resp.status_code for resp in responses]
+
+    assert asyncio.run(send_requests()) == [404] * REQUESTS
+    assert len(threads) == REQUESTS
+    assert all(name.startswith("asgi") for name in threads)
@@ -0,0 +1,118 @@
+"""Tests for rejecting redemptions of webhooks that are cooling down."""
+
+from datetime import timedelta
+from typing import Callable, Iterator
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+from werkzeug.test import TestResponse
+
+from mulletwebhook import cooldown
+from mulletwebhook.database import db
+from mulletwebhook.main import routes
+from mulletwebhook.models.element import Webhook
+
+Redeem = Callable[[int, str], TestResponse]
+
+COOLDOWN = 60
+
+
+@pytest.fixture(autouse=True)
+def clear_cooldowns() -> Iterator[None]:
+    """Forget the cooldowns remembered by other tests."""
+    cooldown.cooldowns.clear()
+    yield
+    cooldown.cooldowns.clear()
+
+
+@pytest.fixture
+def cooldown_webhook_id(app: Flask, webhook_id: int) -> int:
+    """Give the webhook a cooldown."""
+    with app.app_context():
+        db.session.get_one(Webhook, webhook_id).cooldown = COOLDOWN
+        db.session.commit()
+    return webhook_id
+
+
+def assert_cooling_down(resp: TestResponse) -> None:
+    """Check that a redemption was rejected because the webhook is cooling down.
+
+    :param resp: response to the redemption
+    """
+    assert resp.status_code == 429, resp.data
+    retry_after = int(resp.headers["Retry-After"])
+    assert 0 < retry_after <= COOLDOWN
+    assert resp.json is not None and resp.json["retry_after"] == retry_after
+
+
+def test_cooldown(redeem: Redeem, cooldown_webhook_id: int) -> None:
+    """Redemptions during the cooldown are rejected with the time to wait."""
+    assert redeem(cooldown_webhook_id, "transaction-1").status_code == 202
+
+    assert_cooling_down(redeem(cooldown_webhook_id, "transaction-2"))
+
+
+def test_cooldown_without_cache(redeem: Redeem, cooldown_webhook_id: int) -> None:
+    """Processes that haven't remembered the cooldown check it in the database."""
+    assert redeem(cooldown_webhook_id, "transaction-1").status_code == 202
+    cooldown.cooldowns.clear()
+
+    assert_cooling_down(redeem(cooldown_webhook_id, "transaction-2"))
+
+
+def test_cooldown_finished(app: Flask, redeem: Redeem, cooldown_webhook_id: int) -> None:
+    """Webhooks can be redeemed again once the cooldown has finished."""
+    assert redeem(cooldown_webhook_id, "transaction-1").status_code == 202
+    cooldown.cooldowns.clear()
+    with app.app_context():
+        webhook = db.session.get_one(Webhook, cooldown_webhook_id)
+        webhook.last_triggered -= timedelta(seconds=COOLDOWN)
+        db.session.commit()
+
+    assert redeem(cooldown_webhook_id, "transaction-2").status_code == 202
+
+
+def test_fast_reject(statements: list[str], redeem: Redeem, cooldown_webhook_id: int) -> None:
+    """Remembered cooldowns are rejected without trying to trigger the webhook."""
+    assert redeem(cooldown_webhook_id, "transaction-1").status_code == 202
+
+    statements.clear()
+    assert_cooling_down(redeem(cooldown_webhook_id, "transaction-2"))
+
+    assert not [statement for statement in statements if statement.startswith("UPDATE")]
+
+
+def test_overlapping_retry(
+    redeem: Redeem, cooldown_webhook_id: int, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """A retry that is rejected by the cooldown its original started returns the original."""
+    first = redeem(cooldown_webhook_id, "transaction-1")
+
+    # the retry looked for the delivery before the original redemption committed it
+    find_delivery = routes.find_delivery
+    lookups: list[str] = []
+
+    def find_committed_delivery(transaction_id: str) -> object:
+        lookups.append(transaction_id)
+        return None if len(lookups) == 1 else find_delivery(transaction_id)
+
+    monkeypatch.setattr(routes, "find_delivery", find_committed_delivery)
+    cooldown.cooldowns.clear()
+    second = redeem(cooldown_webhook_id, "transaction-1")
+
+    assert second.status_code == 202, second.data
+    assert second.json == first.json
+
+
+def test_cooldown_check(client: FlaskClient, redeem: Redeem, cooldown_webhook_id: int) -> None:
+    """The panel can check the cooldown before the viewer uses bits."""
+    resp = client.get(f"/webhook/{cooldown_webhook_id}/cooldown")
+    assert resp.status_code == 200
+    assert resp.json is not None and resp.json["retry_after"] == 0
+
+    redeem(cooldown_webhook_id, "transaction-1")
+    cooldown.cooldowns.clear()
+
+    resp = client.get(f"/webhook/{cooldown_webhook_id}/cooldown")
+    assert resp.json is not None and 0 < resp.json["retry_after"] <= COOLDOWN
@@ -0,0 +1,187 @@
+"""Tests for sending webhooks from the delivery outbox."""
+
+from datetime import datetime, timedelta
+from typing import Any, Callable, Optional
+
+import pytest
+import requests
+from flask import Flask
+from werkzeug.test import TestResponse
+
+from mulletwebhook import delivery, http_client, utils
+from mulletwebhook.database import db
+from mulletwebhook.models.delivery import Delivery
+from mulletwebhook.models.enums import DeliveryStatus
+
+# statuses returned by the webhook host for each attempt, or an exception to raise instead
+Responses = list[Any]
+
+
+@pytest.fixture
+def responses(monkeypatch: pytest.MonkeyPatch) -> Responses:
+    """Answer webhook requests with the responses added to the returned list, in order."""
+    monkeypatch.setattr(http_client, "_breakers", {})
+    queued: Responses = []
+
+    def timed_post(url: str, **kwargs: Any) -> requests.Response:
+        del url, kwargs
+        result = queued.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        resp = requests.Response()
+        resp.status_code = result
+        resp._content = b"response"  # pylint: disable=protected-access
+        return resp
+
+    monkeypatch.setattr(http_client, "timed_post", timed_post)
+    return queued
+
+
+@pytest.fixture
+def delivery_id(redeem: Callable[[int, str], TestResponse], webhook_id: int) -> int:
+    """Redeem the webhook, which adds a delivery to the outbox."""
+    resp = redeem(webhook_id, "transaction-1")
+    assert resp.status_code == 202, resp.data
+    assert resp.json is not None
+    return int(resp.json["delivery_id"])
+
+
+def get_delivery(app: Flask, delivery_id: int) -> Delivery:
+    """Load a delivery.
+
+    :param app: app the delivery was created in
+    :param delivery_id: id of the delivery
+    :return: the delivery
+    """
+    with app.app_context():
+        found: Delivery = db.session.get_one(Delivery, delivery_id)
+        db.session.expunge(found)
+        return found
+
+
+def send(app: Flask, delivery_id: int) -> None:
+    """Make a delivery due and send it.
+
+    :param app: app the delivery was created in
+    :param delivery_id: id of the delivery
+    """
+    with app.app_context():
+        db.session.get_one(Delivery, delivery_id).next_attempt = utils.utcnow()
+        db.session.commit()
+        delivery.send_delivery(delivery_id)
+
+
+def seconds_until(time: datetime) -> float:
+    """Get the number of seconds until a time.
+
+    :param time: naive time in UTC
+    :return: number of seconds
+    """
+    return (time - utils.utcnow()).total_seconds()
+
+
+def test_delivered(app: Flask, responses: Responses, delivery_id: int) -> None:
+    """Successful deliveries record the response of the webhook host."""
+    responses.append(200)
+    send(app, delivery_id)
+
+    sent = get_delivery(app, delivery_id)
+    assert sent.status == DeliveryStatus.delivered
+    assert sent.attempts == 1
+    assert sent.response_status == 200
+    assert sent.response_text == "response"
+
+
+def test_claim(app: Flask, delivery_id: int) -> None:
+    """Only one worker can claim a delivery until its claim expires."""
+    with app.app_context():
+        assert delivery.claim_delivery(delivery_id) is not None
+        assert delivery.claim_delivery(delivery_id) is None
+
+    claimed = get_delivery(app, delivery_id)
+    assert claimed.attempts == 1
+    assert seconds_until(claimed.next_attempt) == pytest.approx(
+        app.config["DELIVERY_CLAIM_TIMEOUT"], abs=5
+    )
+
+
+def test_retry_backoff(app: Flask, responses: Responses, delivery_id: int) -> None:
+    """Server errors are retried, waiting twice as long after each attempt."""
+    backoff = app.config["DELIVERY_RETRY_BACKOFF"]
+    for attempt in range(1, 3):
+        responses.append(500)
+        send(app, delivery_id)
+
+        failed = get_delivery(app, delivery_id)
+        assert failed.status == DeliveryStatus.pending
+        assert failed.attempts == attempt
+        assert seconds_until(failed.next_attempt) == pytest.approx(
+            backoff * 2 ** (attempt - 1), abs=1
+        )
+
+    responses.append(200)
+    send(app, delivery_id)
+    assert get_delivery(app, delivery_id).status == DeliveryStatus.delivered
+
+
+@pytest.mark.parametrize("result", [400, requests.ConnectionError("refused")])
+def test_failed(app: Flask, responses: Responses, delivery_id: int, result: Any) -> None:
+    """Client errors fail straight away, other errors once the attempts are used up."""
+    attempts = 1 if result == 400 else app.config["DELIVERY_MAX_ATTEMPTS"]
+    responses.extend([result] * attempts)
+    for _ in range(attempts):
+        send(app, delivery_id)
+
+    failed = get_delivery(app, delivery_id)
+    assert failed.status == DeliveryStatus.failed
+    assert failed.attempts == attempts
+    assert not responses
+
+
+def test_deferred(app: Flask, delivery_id: int, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Deliveries rejected by the circuit breaker don't use up an attempt."""
+
+    def post(url: str, **kwargs: Any) -> requests.Response:
+        del url, kwargs
+        raise http_client.CircuitOpenError("circuit breaker is open", 10.0)
+
+    monkeypatch.setattr(http_client, "post", post)
+    send(app, delivery_id)
+
+    deferred = get_delivery(app, delivery_id)
+    assert deferred.status == DeliveryStatus.pending
+    assert deferred.attempts == 0
+    assert seconds_until(deferred.next_attempt) == pytest.approx(10, abs=1)
+
+
+def test_due_deliveries(app: Flask, delivery_id: int) -> None:
+    """Only pending deliveries whose next attempt has passed are due."""
+    with app.app_context():
+        assert delivery.get_due_deliveries() == [delivery_id]
+
+        delivery.claim_delivery(delivery_id)
+        assert not delivery.get_due_deliveries()
+
+
+@pytest.mark.parametrize(
+    "status,age,pruned",
+    [
+        (DeliveryStatus.delivered, 2, True),
+        (DeliveryStatus.failed, 2, True),
+        (DeliveryStatus.delivered, 0, False),
+        (DeliveryStatus.pending, 2, False),
+    ],
+)
+def test_prune(
+    app: Flask, delivery_id: int, status: DeliveryStatus, age: int, pruned: bool
+) -> None:
+    """Finished deliveries are removed once they are older than the time to live."""
+    with app.app_context():
+        old = db.session.get_one(Delivery, delivery_id)
+        old.status = status
+        old.date_created = utils.utcnow() - timedelta(seconds=app.config["DELIVERY_TTL"] * age)
+        db.session.commit()
+
+        assert delivery.prune_deliveries() == int(pruned)
+        remaining: Optional[Delivery] = db.session.get(Delivery, delivery_id)
+        assert (remaining is None) == pruned
@@ -0,0 +1,107 @@
+"""Tests for the circuit breakers of the shared HTTP client."""
+
+from typing import Any
+
+import pytest
+import requests
+from flask import Flask
+
+from mulletwebhook import http_client
+from mulletwebhook.http_client import CircuitBreaker, CircuitOpenError
+
+URL = "https://hooks.example.com/hook"
+
+
+@pytest.fixture
+def breaker() -> CircuitBreaker:
+    """Create a breaker that opens after two failures and allows two requests in flight."""
+    return CircuitBreaker(
+        "hooks.example.com", failure_threshold=2, reset_timeout=30, max_in_flight=2
+    )
+
+
+def fail(breaker: CircuitBreaker) -> None:
+    """Send a request that fails.
+
+    :param breaker: breaker the request is sent through
+    """
+    breaker.acquire()
+    breaker.release(False)
+
+
+def test_open(breaker: CircuitBreaker) -> None:
+    """The breaker opens after consecutive failures and rejects requests until it resets."""
+    fail(breaker)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    fail(breaker)
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError) as exp:
+        breaker.acquire()
+    assert 0 < exp.value.retry_after <= 30
+
+
+def test_success_resets_failures(breaker: CircuitBreaker) -> None:
+    """Only consecutive failures open the breaker."""
+    fail(breaker)
+    breaker.acquire()
+    breaker.release(True)
+    fail(breaker)
+
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+@pytest.mark.parametrize("probe_succeeds,state", [(True, "closed"), (False, "open")])
+def test_half_open(breaker: CircuitBreaker, probe_succeeds: bool, state: str) -> None:
+    """Once the reset timeout has passed a single probe decides whether the breaker closes."""
+    fail(breaker)
+    fail(breaker)
+    # the reset timeout has passed
+    breaker.opened_at -= breaker.reset_timeout
+
+    breaker.acquire()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.acquire()
+
+    breaker.release(probe_succeeds)
+    assert breaker.state == state
+    assert breaker.in_flight == 0
+
+
+def test_max_in_flight(breaker: CircuitBreaker) -> None:
+    """Requests over the in-flight limit are rejected without counting as failures."""
+    breaker.acquire()
+    breaker.acquire()
+    with pytest.raises(CircuitOpenError) as exp:
+        breaker.acquire()
+    assert exp.value.retry_after == 0
+
+    breaker.release(True)
+    breaker.acquire()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.failures == 0
+
+
+def test_post(app: Flask, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Server errors open the breaker of the host, client errors don't."""
+    monkeypatch.setattr(http_client, "_breakers", {})
+    statuses: list[int] = []
+
+    def timed_post(url: str, **kwargs: Any) -> requests.Response:
+        del url, kwargs
+        resp = requests.Response()
+        resp.status_code = statuses.pop(0)
+        return resp
+
+    monkeypatch.setattr(http_client, "timed_post", timed_post)
+
+    with app.app_context():
+        threshold = app.config["BREAKER_FAILURE_THRESHOLD"]
+        statuses.extend([404] * threshold + [500] * threshold)
+        for status in statuses.copy():
+            assert http_client.post(URL).status_code == status
+
+        with pytest.raises(CircuitOpenError):
+            http_client.post(URL)
+        assert http_client.get_breaker("hooks.example.com").state == CircuitBreaker.OPEN
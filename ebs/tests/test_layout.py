@@ -0,0 +1,48 @@
+"""Tests for rendering layouts."""
+
+from typing import Callable
+
+import pytest
+from flask import Flask
+
+from mulletwebhook.database import db
+from mulletwebhook.main.routes import render_layout_html
+from mulletwebhook.models.layout import Layout
+
+ELEMENT_TYPES = ("text", "image", "webhook")
+
+
+def count_render_statements(app: Flask, statements: list[str], edit: bool) -> int:
+    """Count the SQL statements executed while rendering the layout.
+
+    :param app: app the layout was created in
+    :param statements: list the statements executed by the app are recorded in
+    :param edit: render the layout with editing controls
+    :return: number of statements executed
+    """
+    with app.test_request_context():
+        layout_obj = db.session.get(Layout, 1)
+        statements.clear()
+        html = render_layout_html(layout_obj, edit)
+        assert html
+        return len(statements)
+
+
+@pytest.mark.parametrize("edit", [False, True])
+def test_render_statements_do_not_grow_with_elements(
+    app: Flask, statements: list[str], add_element: Callable[[str], None], edit: bool
+) -> None:
+    """The statements needed to render a layout don't depend on the number of elements."""
+    for element_type in ELEMENT_TYPES:
+        add_element(element_type)
+    few = count_render_statements(app, statements, edit)
+
+    for _ in range(10):
+        for element_type in ELEMENT_TYPES:
+            add_element(element_type)
+    many = count_render_statements(app, statements, edit)
+
+    # one query for the elements along with their image, text or webhook, and one for the variants
+    # of all the images
+    assert few == 2
+    assert many == few
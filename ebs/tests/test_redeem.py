@@ -0,0 +1,76 @@
+"""Tests for redeeming webhooks more than once with the same transaction."""
+
+from typing import Callable
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+from werkzeug.test import TestResponse
+
+from mulletwebhook.database import db
+from mulletwebhook.main import routes
+from mulletwebhook.models.delivery import Delivery
+
+Redeem = Callable[[int, str], TestResponse]
+
+
+def count_deliveries(app: Flask) -> int:
+    """Count the deliveries that have been created.
+
+    :param app: app the webhooks were redeemed in
+    :return: number of deliveries
+    """
+    with app.app_context():
+        return int(db.session.query(Delivery).count())
+
+
+def test_redeem(app: Flask, redeem: Redeem, webhook_id: int) -> None:
+    """Redeeming a webhook creates a delivery for the webhook workers to send."""
+    resp = redeem(webhook_id, "transaction-1")
+
+    assert resp.status_code == 202, resp.data
+    assert resp.json == {"delivery_id": 1, "status": "pending"}
+    assert count_deliveries(app) == 1
+
+
+def test_duplicate_transaction(app: Flask, redeem: Redeem, webhook_id: int) -> None:
+    """A retried redemption returns the delivery of the original instead of creating another."""
+    first = redeem(webhook_id, "transaction-1")
+    second = redeem(webhook_id, "transaction-1")
+
+    assert second.status_code == 202, second.data
+    assert second.json == first.json
+    assert count_deliveries(app) == 1
+
+
+def test_concurrent_duplicate_transaction(
+    app: Flask, redeem: Redeem, webhook_id: int, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """A retry that misses the original delivery is rejected by the unique transaction id."""
+    first = redeem(webhook_id, "transaction-1")
+    # the retry looked for the delivery before the original redemption committed it
+    monkeypatch.setattr(routes, "find_delivery", lambda transaction_id: None)
+    second = redeem(webhook_id, "transaction-1")
+
+    assert second.status_code == 202, second.data
+    assert second.json == first.json
+    assert count_deliveries(app) == 1
+
+
+@pytest.mark.usefixtures("layout_id")
+def test_transaction_for_another_webhook(client: FlaskClient, redeem: Redeem) -> None:
+    """A transaction can't be reused to redeem a different webhook."""
+    for _ in range(2):
+        resp = client.post(
+            "/layout/1/webhook/create",
+            data={
+                "name": "webhook",
+                "url": "https://hooks.example.com/hook",
+                "bits_product": "reward_1bits",
+                "extra_data": "{}",
+            },
+        )
+        assert resp.status_code == 200, resp.data
+
+    assert redeem(1, "transaction-1").status_code == 202
+    assert redeem(2, "transaction-1").status_code == 409
@@ -0,0 +1,106 @@
+"""Tests for storing the data of identical images once."""
+
+import hashlib
+import os
+from pathlib import Path
+from typing import Callable
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+
+from mulletwebhook import migrate_images
+from mulletwebhook.database import db
+from mulletwebhook.models.element import ImageBlob
+from mulletwebhook.storage import FilesystemBackend, image_storage
+
+from conftest import PNG
+
+# the test image can't be decoded, so it is stored as uploaded without any variants
+DIGEST = hashlib.sha256(PNG).hexdigest()
+
+
+@pytest.fixture
+def filesystem(app: Flask, tmp_path: Path) -> FilesystemBackend:
+    """Store images in a directory instead of the database."""
+    app.config.update(IMAGE_STORAGE="filesystem", IMAGE_STORAGE_PATH=str(tmp_path / "images"))
+    image_storage.init_app(app)
+    assert isinstance(image_storage.backend, FilesystemBackend)
+    return image_storage.backend
+
+
+def get_refcounts(app: Flask) -> dict[str, int]:
+    """Get the number of references to each blob.
+
+    :param app: app the images were stored in
+    :return: number of references for each digest
+    """
+    with app.app_context():
+        return {blob.digest: blob.refcount for blob in ImageBlob.query.all()}
+
+
+def test_refcount(app: Flask, client: FlaskClient, add_element: Callable[[str], None]) -> None:
+    """Identical images share a blob, which is deleted once neither image uses it."""
+    add_element("image")
+    add_element("image")
+    assert get_refcounts(app) == {DIGEST: 2}
+
+    assert client.delete("/element/1").status_code == 200
+    assert get_refcounts(app) == {DIGEST: 1}
+
+    assert client.delete("/element/2").status_code == 200
+    assert not get_refcounts(app)
+
+
+def test_layout_delete(app: Flask, client: FlaskClient, add_element: Callable[[str], None]) -> None:
+    """Deleting a layout releases the images of its elements."""
+    add_element("image")
+    add_element("image")
+
+    assert client.delete("/layout/1").status_code == 200
+    assert not get_refcounts(app)
+
+
+def test_filesystem(
+    app: Flask,
+    client: FlaskClient,
+    add_element: Callable[[str], None],
+    filesystem: FilesystemBackend,
+) -> None:
+    """Image files are removed with their blob, and written again if the image is stored again."""
+    add_element("image")
+    assert os.path.exists(filesystem.path(DIGEST))
+    assert client.get("/element/image/1").data == PNG
+
+    assert client.delete("/element/1").status_code == 200
+    assert not os.path.exists(filesystem.path(DIGEST))
+
+    add_element("image")
+    assert os.path.exists(filesystem.path(DIGEST))
+    assert get_refcounts(app) == {DIGEST: 1}
+
+
+def test_remove_restored(
+    app: Flask, add_element: Callable[[str], None], filesystem: FilesystemBackend
+) -> None:
+    """The file of a deleted blob is kept if the image was stored again before it was removed."""
+    add_element("image")
+
+    with app.app_context():
+        filesystem.remove(DIGEST)
+
+    assert os.path.exists(filesystem.path(DIGEST))
+    assert get_refcounts(app) == {DIGEST: 1}
+
+
+def test_count_references(app: Flask, add_element: Callable[[str], None]) -> None:
+    """Recounting references fixes wrong counts and deletes blobs nothing references."""
+    add_element("image")
+    with app.app_context():
+        db.session.get_one(ImageBlob, DIGEST).refcount = 5
+        db.session.add(ImageBlob(digest="0" * 64, refcount=1, data=b"unused"))
+        db.session.commit()
+
+        migrate_images.count_references()
+
+    assert get_refcounts(app) == {DIGEST: 1}
@@ -0,0 +1,99 @@
+"""Tests for creating layout elements."""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask
+from flask.testing import FlaskClient
+
+from mulletwebhook import utils
+from mulletwebhook.models.element import Element
+
+CREATORS = 8
+ELEMENTS_PER_CREATOR = 5
+
+
+def get_positions(app: Flask, layout_id: int) -> list[int]:
+    """Get the positions of the elements of a layout in display order.
+
+    :param app: app the layout was created in
+    :param layout_id: id of the layout
+    :return: positions of the elements
+    """
+    with app.app_context():
+        return [
+            element.position
+            for element in Element.query.filter(Element.layout_id == layout_id)
+            .order_by(Element.position, Element.id)
+            .all()
+        ]
+
+
+def test_parallel_element_creation(app: Flask, layout_id: int) -> None:
+    """Elements created at the same time by several editors get unique, evenly spaced positions."""
+
+    def create_elements(creator: int) -> None:
+        client = app.test_client()
+        for index in range(ELEMENTS_PER_CREATOR):
+            resp = client.post(
+                f"/layout/{layout_id}/text/create", data={"text": f"{creator}-{index}"}
+            )
+            assert resp.status_code == 200, resp.data
+
+    with ThreadPoolExecutor(max_workers=CREATORS) as executor:
+        for result in executor.map(create_elements, range(CREATORS)):
+            assert result is None
+
+    count = CREATORS * ELEMENTS_PER_CREATOR
+    assert get_positions(app, layout_id) == [
+        utils.POSITION_STEP * (index + 1) for index in range(count)
+    ]
+
+
+def get_order(app: Flask, layout_id: int) -> list[int]:
+    """Get the ids of the elements of a layout in display order.
+
+    :param app: app the layout was created in
+    :param layout_id: id of the layout
+    :return: ids of the elements
+    """
+    with app.app_context():
+        return [
+            element.id
+            for element in Element.query.filter(Element.layout_id == layout_id)
+            .order_by(Element.position, Element.id)
+            .all()
+        ]
+
+
+def test_move_element(app: Flask, client: FlaskClient, layout_id: int) -> None:
+    """Moving an element only changes its own position while there is a gap to move it into."""
+    for index in range(3):
+        client.post(f"/layout/{layout_id}/text/create", data={"text": str(index)})
+
+    resp = client.post(f"/layout/{layout_id}/update-order", data={"moved": "3", "before": "2"})
+
+    assert resp.status_code == 200
+    assert get_order(app, layout_id) == [1, 3, 2]
+    assert get_positions(app, layout_id) == [
+        utils.POSITION_STEP,
+        utils.POSITION_STEP * 3 // 2,
+        utils.POSITION_STEP * 2,
+    ]
+
+
+def test_move_element_without_gap(app: Flask, client: FlaskClient, layout_id: int) -> None:
+    """The layout is rebalanced when there is no gap left to move an element into."""
+    for index in range(3):
+        client.post(f"/layout/{layout_id}/text/create", data={"text": str(index)})
+
+    # moving the elements back and forth halves the gap before element 2 each time
+    for _ in range(utils.POSITION_STEP.bit_length() + 1):
+        for moved in ("3", "1"):
+            resp = client.post(
+                f"/layout/{layout_id}/update-order", data={"moved": moved, "before": "2"}
+            )
+            assert resp.status_code == 200
+
+    assert get_order(app, layout_id) == [3, 1, 2]
+    positions = get_positions(app, layout_id)
+    assert len(set(positions)) == len(positions)
@@ -0,0 +1,78 @@
+"""Tests for checking that broadcasters own the objects they access."""
+
+from typing import Any, Callable
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+
+from mulletwebhook.database import db
+from mulletwebhook.models.broadcaster import Broadcaster
+from mulletwebhook.models.layout import Layout
+
+WEBHOOK_FORM = {
+    "name": "renamed",
+    "url": "https://hooks.example.com/renamed",
+    "bits_product": "reward_1bits",
+    "extra_data": "{}",
+    "cooldown": "0",
+}
+
+# number of statements each route needs: one joined SELECT per id in the url, plus any writes
+ROUTE_STATEMENTS = [
+    ("get", "/layout/1/edit", {}, 1),
+    ("get", "/layout/1/element/create", {}, 1),
+    ("get", "/element/1/text/1/edit", {}, 2),
+    ("put", "/element/1/text/1/edit", {"data": {"text": "changed"}}, 4),
+    ("get", "/element/2/image/1/edit", {}, 2),
+    ("get", "/element/3/webhook/1/edit", {}, 2),
+    ("put", "/element/3/webhook/1/edit", {"data": WEBHOOK_FORM}, 4),
+    ("get", "/element/1/confirm-delete", {}, 2),
+    ("get", "/webhook/1/cooldown", {}, 1),
+]
+
+
+@pytest.fixture
+def elements(add_element: Callable[[str], None]) -> None:
+    """Add a text, an image and a webhook element to the layout, in that order."""
+    for element_type in ("text", "image", "webhook"):
+        add_element(element_type)
+
+
+@pytest.mark.usefixtures("elements")
+@pytest.mark.parametrize("method,url,kwargs,expected", ROUTE_STATEMENTS)
+def test_route_statements(
+    client: FlaskClient,
+    statements: list[str],
+    method: str,
+    url: str,
+    kwargs: dict[str, Any],
+    expected: int,
+) -> None:
+    """Objects loaded by the ownership check are reused by the view instead of queried again."""
+    statements.clear()
+    resp = getattr(client, method)(url, **kwargs)
+
+    assert resp.status_code < 300, resp.data
+    assert len(statements) == expected, statements
+
+
+@pytest.mark.usefixtures("elements")
+def test_missing_object(client: FlaskClient) -> None:
+    """Ids of objects that don't exist are rejected."""
+    resp = client.get("/element/1/text/2/edit")
+
+    assert resp.status_code == 404
+
+
+@pytest.mark.usefixtures("layout_id")
+def test_object_owned_by_another_broadcaster(app: Flask, client: FlaskClient) -> None:
+    """Objects owned by another broadcaster are rejected."""
+    with app.app_context():
+        db.session.add(Broadcaster(id=87654321))
+        db.session.add(Layout(name="other", broadcaster_id=87654321))
+        db.session.commit()
+
+    resp = client.get("/layout/2/edit")
+
+    assert resp.status_code == 401
@@ -28,10 +28,22 @@ htmx.onLoad(function (content) {
     const sortableInstance = new Sortable(sortable, {
       animation: 150,
 
+      draggable: '.element',
       filter: '.add-new-button',
       // disable sorting on the `end` event
       onEnd: function (evt) {
         this.option('disabled', true)
+
+        // send the move as a single operation, the element is placed before the next element
+        // or at the end of the layout if there is no next element
+        let next = evt.item.nextElementSibling
+        while (next && !next.classList.contains('element')) {
+          next = next.nextElementSibling
+        }
+        const moved = (evt.oldIndex !== evt.newIndex) ? evt.item.dataset.elementId : ''
+        sortable.querySelector("input[name='moved']").value = moved
+        sortable.querySelector("input[name='before']").value = next ? next.dataset.elementId : ''
+        htmx.trigger(sortable, 'elementMoved')
       }
     })
 
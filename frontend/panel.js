@@ -4,6 +4,10 @@ import { twitch, extensionUri } from './globals.js'
 
 let authorization
 
+// how often and how many times to check if a webhook has been delivered
+const deliveryPollInterval = 1000
+const deliveryPollAttempts = 30
+
 twitch.onAuthorized(function (auth) {
   authorization = 'Bearer ' + auth.token
   // wait for user to be authorized before getting content for layout-loader
@@ -36,10 +40,12 @@ htmx.on('htmx:afterSwap', (e) => {
       const webhookID = webhookButton.getAttribute('data-id')
       // the bitsProduct is available in the data-product attribute of the button
       const webhookBitsProduct = webhookButton.getAttribute('data-product')
+      // the cooldown in seconds is available in the data-cooldown attribute of the button
+      const webhookCooldown = parseInt(webhookButton.getAttribute('data-cooldown') || '0')
       webhookButton.addEventListener(
         'click',
         async function () {
-          webhookRedeem(webhookID, webhookBitsProduct)
+          webhookRedeem(webhookButton, webhookID, webhookBitsProduct, webhookCooldown)
         },
         false
       )
@@ -48,8 +54,19 @@ htmx.on('htmx:afterSwap', (e) => {
 })
 
 // handle the bits transaction and trigger the webhook in the EBS if successful
-async function webhookRedeem (webhookID, webhookBitsProduct) {
+async function webhookRedeem (webhookButton, webhookID, webhookBitsProduct, webhookCooldown) {
   try {
+    // check the cooldown before the viewer uses bits, since the EBS rejects redemptions while the
+    // webhook is cooling down
+    if (webhookCooldown > 0) {
+      const retryAfter = await getRetryAfter(webhookID)
+      if (retryAfter > 0) {
+        console.error('webhook is cooling down, try again in ' + retryAfter + 's')
+        disableButton(webhookButton, retryAfter)
+        return false
+      }
+    }
+
     const bitsTransaction = new Promise((resolve, reject) => {
       twitch.bits.onTransactionComplete(resolve)
       twitch.bits.onTransactionCancelled(reject)
@@ -67,11 +84,21 @@ async function webhookRedeem (webhookID, webhookBitsProduct) {
         body: JSON.stringify({ transaction: tx })
       }
     )
+    if (response.status === 429) {
+      const cooldown = await response.json()
+      console.error('webhook is cooling down, try again in ' + cooldown.retry_after + 's')
+      disableButton(webhookButton, cooldown.retry_after)
+      return false
+    }
     if (!response.ok) {
       const errorMsg = 'webhook failed: ' + response.status
       console.error(errorMsg)
       return false
     }
+    disableButton(webhookButton, webhookCooldown)
+    // the webhook is sent in the background by the EBS, poll until it has been delivered
+    const delivery = await response.json()
+    return await waitForDelivery(delivery.delivery_id)
   } catch (error) {
     console.error('error sending webhook: ' + error)
   } finally {
@@ -79,3 +106,52 @@ async function webhookRedeem (webhookID, webhookBitsProduct) {
     twitch.bits.onTransactionCancelled(() => {})
   }
 }
+
+// get the number of seconds until a webhook can be redeemed again, 0 if it can be redeemed now
+async function getRetryAfter (webhookID) {
+  const response = await fetch(
+    extensionUri + '/webhook/' + webhookID + '/cooldown', {
+      headers: { Authorization: authorization }
+    }
+  )
+  if (!response.ok) {
+    throw new Error('could not get webhook cooldown: ' + response.status)
+  }
+  const cooldown = await response.json()
+  return cooldown.retry_after
+}
+
+// disable a webhook button while the webhook is cooling down
+function disableButton (webhookButton, seconds) {
+  if (seconds <= 0) {
+    return
+  }
+  webhookButton.disabled = true
+  setTimeout(() => { webhookButton.disabled = false }, seconds * 1000)
+}
+
+// poll the status of a webhook delivery until it has been delivered or has failed
+async function waitForDelivery (deliveryID) {
+  for (let i = 0; i < deliveryPollAttempts; i++) {
+    await new Promise(resolve => setTimeout(resolve, deliveryPollInterval))
+    const response = await fetch(
+      extensionUri + '/webhook/delivery/' + deliveryID, {
+        headers: { Authorization: authorization }
+      }
+    )
+    if (!response.ok) {
+      console.error('could not get webhook status: ' + response.status)
+      return false
+    }
+    const delivery = await response.json()
+    if (delivery.status === 'delivered') {
+      return true
+    }
+    if (delivery.status === 'failed') {
+      console.error('webhook failed: ' + delivery.response_status)
+      return false
+    }
+  }
+  console.error('webhook has not been delivered yet')
+  return false
+}
@@ -7,7 +7,7 @@ import requests
 from flask import current_app
 from typing import Any
 
-from mulletwebhook import create_app
+from mulletwebhook import create_app, http_client
 from mulletwebhook.models.enums import BitsProduct
 
 
@@ -20,7 +20,7 @@ def get_app_access_token() -> str:
     :return: valid access token
     """
     print(current_app.config["CLIENT_ID"], current_app.config["CLIENT_SECRET"])
-    req = requests.post(
+    req = http_client.get_session().post(
         "https://id.twitch.tv/oauth2/token",
         params={
             "client_id": current_app.config["CLIENT_ID"],
@@ -53,7 +53,7 @@ def get_bits_products(access_token: str) -> dict[str, Any]:
         "Client-ID": current_app.config["CLIENT_ID"],
     }
     print(headers)
-    resp = requests.get(
+    resp = http_client.get_session().get(
         "https://api.twitch.tv/helix/bits/extensions",
         timeout=current_app.config["REQUEST_TIMEOUT"],
         headers=headers,
@@ -86,7 +86,7 @@ def update_bits_product(access_token: str, product: BitsProduct) -> None:
         "is_broadcast": False,
     }
     print(f"updating product: {product_json}")
-    resp = requests.put(
+    resp = http_client.get_session().put(
         "https://api.twitch.tv/helix/bits/extensions",
         timeout=current_app.config["REQUEST_TIMEOUT"],
         json=product_json,
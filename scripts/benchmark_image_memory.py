@@ -0,0 +1,124 @@
+"""Benchmark of the peak memory used to render a layout containing large images.
+
+Each measurement runs in a fresh process so that the peak RSS of one run doesn't hide the other.
+The "eager" run loads Image.data along with the rest of the image, which is how images were loaded
+before the column was deferred.
+"""
+
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+from sqlalchemy import event
+from sqlalchemy.orm import ORMExecuteState, defaultload
+
+from mulletwebhook import create_app
+from mulletwebhook.config import Config
+from mulletwebhook.database import db
+from mulletwebhook.models.broadcaster import Broadcaster
+from mulletwebhook.models.element import Element, Image
+from mulletwebhook.models.enums import ElementType
+from mulletwebhook.models.layout import Layout
+
+BROADCASTER_ID = 12345678
+IMAGE_COUNT = 10
+IMAGE_SIZE = 1024 * 1024
+
+
+# pylint: disable=too-few-public-methods
+class BenchmarkConfig(Config):
+    """Configuration that doesn't need a real database or Twitch credentials."""
+
+    TESTING = True
+    EBS_URL = "https://ebs.example.com"
+    DELIVERY_WORKERS = 0
+
+
+def create_layout(database_uri: str) -> None:
+    """Create a layout containing large images.
+
+    :param database_uri: uri of the database to create the layout in
+    """
+    BenchmarkConfig.SQLALCHEMY_DATABASE_URI = database_uri
+    with create_app(BenchmarkConfig).app_context():
+        db.create_all()
+        db.session.add(Broadcaster(id=BROADCASTER_ID, current_layout=1))
+        db.session.add(Layout(id=1, name="benchmark", broadcaster_id=BROADCASTER_ID))
+        for position in range(IMAGE_COUNT):
+            element = Element(element_type=ElementType.image, layout_id=1, position=position)
+            db.session.add(element)
+            db.session.flush()
+            image = Image(filename=f"{position}.png", element_id=element.id)
+            image.data = os.urandom(IMAGE_SIZE)
+            db.session.add(image)
+            db.session.commit()
+
+
+def load_image_data(orm_execute_state: ORMExecuteState) -> None:
+    """Load the image data along with elements, as if Image.data was not deferred.
+
+    :param orm_execute_state: state of the query being executed
+    """
+    statement = orm_execute_state.statement
+    if (
+        orm_execute_state.is_select
+        and statement.column_descriptions[0]["entity"] is Element  # type: ignore
+    ):
+        orm_execute_state.statement = statement.options(
+            defaultload(Element.image).undefer(Image.data)  # type: ignore
+        )
+
+
+def measure(database_uri: str, mode: str) -> None:
+    """Render the layout and print the peak RSS of the process as json.
+
+    :param database_uri: uri of the database containing the layout
+    :param mode: "eager" to load image data with the layout, or "deferred" to use the defaults
+    """
+    BenchmarkConfig.SQLALCHEMY_DATABASE_URI = database_uri
+    app = create_app(BenchmarkConfig)
+    if mode == "eager":
+        with app.app_context():
+            event.listen(db.session, "do_orm_execute", load_image_data)
+
+    client = app.test_client()
+    # warm up imports and the connection pool with a request that doesn't load any images
+    client.get("/layouts")
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    response = client.get("/layout")
+    assert response.status_code == 200
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    print(json.dumps({"mode": mode, "peak_rss_kib": after, "render_increase_kib": after - before}))
+
+
+def main() -> None:
+    """Print the peak RSS of a layout render with and without deferred image data."""
+    with tempfile.TemporaryDirectory() as directory:
+        database_uri = f"sqlite:///{os.path.join(directory, 'benchmark.sqlite')}"
+        create_layout(database_uri)
+
+        for mode in ("eager", "deferred"):
+            result = subprocess.run(
+                [sys.executable, __file__, mode, database_uri],
+                check=True,
+                capture_output=True,
+                text=True,
+            )
+            stats = json.loads(result.stdout.splitlines()[-1])
+            print(
+                f"{IMAGE_COUNT} x {IMAGE_SIZE // 1024} KiB images, {mode:<8} "
+                f"peak RSS {stats['peak_rss_kib'] / 1024:7.1f} MiB, "
+                f"render increase {stats['render_increase_kib'] / 1024:7.1f} MiB"
+            )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3:
+        measure(sys.argv[2], sys.argv[1])
+    else:
+        main()
@@ -0,0 +1,54 @@
+"""Micro-benchmark of the extension secret and pubsub JWT caches."""
+
+import base64
+import timeit
+from typing import Callable
+
+from flask import current_app
+
+from mulletwebhook import create_app, twitch, utils
+from mulletwebhook.config import Config
+
+BROADCASTER_ID = 12345678
+ITERATIONS = 20000
+
+
+class BenchmarkConfig(Config):
+    """Configuration that doesn't need a database or real Twitch credentials."""
+
+    SQLALCHEMY_DATABASE_URI = "sqlite://"
+    EXTENSION_SECRET = base64.b64encode(b"x" * 32).decode()
+    CLIENT_ID = "benchmark"
+
+
+def per_call_us(func: Callable[[], object]) -> float:
+    """Time a function.
+
+    :param func: function to time
+    :return: average time per call in microseconds
+    """
+    return timeit.timeit(func, number=ITERATIONS) / ITERATIONS * 1e6
+
+
+def main() -> None:
+    """Print the time per call with and without caching."""
+    with create_app(BenchmarkConfig).app_context():
+        results = {
+            "decode secret (every call)": per_call_us(
+                lambda: base64.b64decode(current_app.config["EXTENSION_SECRET"])
+            ),
+            "decode secret (cached)": per_call_us(utils.get_extension_secret),
+            "pubsub headers (sign every call)": per_call_us(
+                lambda: twitch.create_pubsub_jwt_headers(BROADCASTER_ID)
+            ),
+            "pubsub headers (cached)": per_call_us(
+                lambda: twitch.get_pubsub_jwt_headers(BROADCASTER_ID)
+            ),
+        }
+
+    for name, result in results.items():
+        print(f"{name:<36} {result:8.2f} us/call")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,535 @@
+"""Load test of the main routes against local stand-ins for the Twitch API and webhook receivers.
+
+A database is seeded with broadcasters that each have an active layout of text, image and webhook
+elements. The app is served by a threaded werkzeug server and a weighted mix of layout views, image
+downloads, redemptions and text edits is sent by concurrent clients, authenticated with extension
+JWTs signed with a generated secret. The Twitch API and the webhook receivers are replaced by local
+HTTP servers that respond after a configurable delay.
+
+The results are printed as json so that runs can be compared, e.g.
+
+    python scripts/loadtest.py --requests 5000 --concurrency 32 > before.json
+"""
+
+import argparse
+import base64
+import itertools
+import json
+import logging
+import math
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Optional
+
+import jwt
+import requests
+from flask import has_request_context, request
+from sqlalchemy import event
+from werkzeug.serving import make_server
+
+from mulletwebhook import create_app
+from mulletwebhook.config import Config
+from mulletwebhook.database import db
+from mulletwebhook.models.broadcaster import Broadcaster
+from mulletwebhook.models.element import Image, Text, Webhook
+from mulletwebhook.models.enums import BitsProduct, ElementType
+from mulletwebhook.models.layout import Layout
+from mulletwebhook.storage import image_storage
+from mulletwebhook import utils
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+FIRST_BROADCASTER_ID = 10000000
+DEFAULT_MIX = "layout=70,image=20,redeem=5,edit=5"
+# number of seconds to wait for the delivery workers to send the redeemed webhooks
+DELIVERY_DRAIN_TIMEOUT = 30
+
+
+class StubServer(ThreadingHTTPServer):
+    """HTTP server that counts the requests it receives and responds after a delay."""
+
+    daemon_threads = True
+
+    def __init__(self, latency: float, status: int) -> None:
+        """Start listening on a free local port.
+
+        :param latency: number of seconds to wait before responding
+        :param status: status code to respond with
+        """
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.latency = latency
+        self.status = status
+        self.count = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        """Get the base url of the server.
+
+        :return: url of the server
+        """
+        host, port = self.server_address[:2]
+        return f"http://{host!s}:{port}"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Request handler for StubServer."""
+
+    server: StubServer
+
+    def do_POST(self) -> None:  # pylint: disable=invalid-name
+        """Read the request body and respond once the latency of the server has passed."""
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        time.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.count += 1
+
+        self.send_response(self.server.status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    # pylint: disable=redefined-builtin
+    def log_message(self, format: str, *args: Any) -> None:
+        """Don't log requests, so the output of the load test is only the results.
+
+        :param format: format string of the message
+        :param args: arguments for the format string
+        """
+
+
+@dataclass
+class Target:
+    """Ids of the objects seeded for a broadcaster."""
+
+    broadcaster_id: int
+    texts: list[tuple[int, int]] = field(default_factory=list)
+    image_ids: list[int] = field(default_factory=list)
+    webhook_ids: list[int] = field(default_factory=list)
+
+
+class QueryCounter:
+    """Counts the SQL statements executed for each endpoint."""
+
+    def __init__(self) -> None:
+        self.counts: dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def before_cursor_execute(self, *args: Any) -> None:
+        """Count a statement against the endpoint of the current request.
+
+        Statements executed outside of a request, e.g. by the delivery workers, are counted as
+        "background".
+
+        :param args: arguments of the event, which are not used
+        """
+        del args
+        endpoint = (request.endpoint or "unknown") if has_request_context() else "background"
+        with self.lock:
+            self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+
+    def reset(self) -> None:
+        """Forget the statements counted so far."""
+        with self.lock:
+            self.counts.clear()
+
+
+def create_config(database_uri: str, twitch_api_url: str, secret: str) -> type[Config]:
+    """Create the configuration of the app under test.
+
+    :param database_uri: uri of the database to use
+    :param twitch_api_url: url of the Twitch API stand-in
+    :param secret: base64 encoded extension secret used to sign the JWTs
+    :return: config class
+    """
+
+    # pylint: disable=too-few-public-methods
+    class LoadTestConfig(Config):
+        """Configuration that talks to the local stand-ins."""
+
+        SQLALCHEMY_DATABASE_URI = database_uri
+        TWITCH_API_URL = twitch_api_url
+        EXTENSION_SECRET = secret
+        CLIENT_ID = "loadtest"
+        EBS_URL = "http://127.0.0.1"
+        TESTING = False
+        LOG_LEVEL = "WARNING"
+
+    return LoadTestConfig
+
+
+def seed(broadcasters: int, elements: int, webhook_url: str) -> list[Target]:
+    """Create broadcasters with an active layout of text, image and webhook elements.
+
+    Any existing tables in the database are dropped first.
+
+    :param broadcasters: number of broadcasters to create
+    :param elements: number of elements of each type in each layout
+    :param webhook_url: url the webhooks are sent to
+    :return: ids of the objects created for each broadcaster
+    """
+    with open(f"{SCRIPT_DIR}/../images/mulletwebhook-logo-small.png", "rb") as image_file:
+        image_data = image_file.read()
+
+    db.drop_all()
+    db.create_all()
+
+    targets = []
+    for broadcaster_id in range(FIRST_BROADCASTER_ID, FIRST_BROADCASTER_ID + broadcasters):
+        target = Target(broadcaster_id)
+        broadcaster = Broadcaster(id=broadcaster_id)
+        db.session.add(broadcaster)
+        layout = Layout(name="loadtest", title="Load test", broadcaster_id=broadcaster_id)
+        db.session.add(layout)
+        db.session.flush()
+        broadcaster.current_layout = layout.id
+
+        for position in range(elements):
+            text = Text(
+                text=f"text {position}",
+                element_id=utils.create_element(layout.id, ElementType.text).id,
+            )
+            image = Image(
+                filename=f"{position}.png",
+                element_id=utils.create_element(layout.id, ElementType.image).id,
+            )
+            image_storage.save(image, image_data)
+            webhook = Webhook(
+                name=f"webhook {position}",
+                url=webhook_url,
+                bits_product=BitsProduct.reward_1bits,
+                data={"position": position},
+                element_id=utils.create_element(layout.id, ElementType.webhook).id,
+            )
+            db.session.add_all((text, image, webhook))
+            db.session.flush()
+            target.texts.append((text.element_id, text.id))
+            target.image_ids.append(image.id)
+            target.webhook_ids.append(webhook.id)
+
+        db.session.commit()
+        targets.append(target)
+
+    return targets
+
+
+def create_token(secret: bytes, broadcaster_id: int, role: str) -> str:
+    """Create an extension JWT, as sent by the panel.
+
+    :param secret: extension secret
+    :param broadcaster_id: id of the channel the panel is shown on
+    :param role: role of the user viewing the panel
+    :return: signed JWT
+    """
+    payload = {
+        "exp": int(time.time() + 3600),
+        "channel_id": str(broadcaster_id),
+        "role": role,
+        "opaque_user_id": f"U{broadcaster_id}",
+    }
+    return jwt.encode(payload, secret, algorithm="HS256")
+
+
+def create_receipt(secret: bytes) -> str:
+    """Create a bits transaction receipt with a unique transaction id.
+
+    :param secret: extension secret
+    :return: signed transaction receipt
+    """
+    payload = {
+        "topic": "bits_transaction_receipt",
+        "exp": int(time.time() + 3600),
+        "data": {
+            "transactionId": str(uuid.uuid4()),
+            "time": utils.utcnow().isoformat(),
+        },
+    }
+    return jwt.encode(payload, secret, algorithm="HS256")
+
+
+class LoadTest:  # pylint: disable=too-many-instance-attributes
+    """Sends a weighted mix of requests to the app from concurrent clients."""
+
+    def __init__(
+        self,
+        base_url: str,
+        secret: bytes,
+        targets: list[Target],
+        mix: dict[str, int],
+        seed_: int,
+    ) -> None:
+        """Create the load test.
+
+        :param base_url: url the app is served from
+        :param secret: extension secret
+        :param targets: ids of the seeded objects
+        :param mix: relative weight of each scenario
+        :param seed_: seed for the random choice of scenarios and targets
+        """
+        self.base_url = base_url
+        self.secret = secret
+        self.targets = targets
+        self.mix = mix
+        self.seed = seed_
+        self.scenarios: dict[str, Callable[[requests.Session, Target, random.Random], int]] = {
+            "layout": self.get_layout,
+            "image": self.get_image,
+            "redeem": self.redeem,
+            "edit": self.edit_text,
+        }
+        self.latencies: dict[str, list[float]] = {name: [] for name in mix}
+        self.errors: dict[str, int] = {name: 0 for name in mix}
+        self.lock = threading.Lock()
+        self.tokens = {
+            (target.broadcaster_id, role): create_token(secret, target.broadcaster_id, role)
+            for target in targets
+            for role in ("viewer", "broadcaster")
+        }
+
+    def headers(self, target: Target, role: str) -> dict[str, str]:
+        """Get the headers sent by the panel.
+
+        :param target: broadcaster the panel is shown for
+        :param role: role of the user viewing the panel
+        :return: authorization headers
+        """
+        return {"Authorization": f"Bearer {self.tokens[(target.broadcaster_id, role)]}"}
+
+    def get_layout(self, session: requests.Session, target: Target, rng: random.Random) -> int:
+        """View the active layout of a broadcaster.
+
+        :param session: session of the client
+        :param target: broadcaster to send the request for
+        :param rng: random number generator of the client
+        :return: response status
+        """
+        del rng
+        resp = session.get(f"{self.base_url}/layout", headers=self.headers(target, "viewer"))
+        return resp.status_code
+
+    def get_image(self, session: requests.Session, target: Target, rng: random.Random) -> int:
+        """Download an image of a layout.
+
+        :param session: session of the client
+        :param target: broadcaster to send the request for
+        :param rng: random number generator of the client
+        :return: response status
+        """
+        image_id = rng.choice(target.image_ids)
+        resp = session.get(f"{self.base_url}/element/image/{image_id}")
+        return resp.status_code
+
+    def redeem(self, session: requests.Session, target: Target, rng: random.Random) -> int:
+        """Redeem a webhook with a new transaction.
+
+        :param session: session of the client
+        :param target: broadcaster to send the request for
+        :param rng: random number generator of the client
+        :return: response status
+        """
+        webhook_id = rng.choice(target.webhook_ids)
+        resp = session.post(
+            f"{self.base_url}/webhook/{webhook_id}",
+            json={"transaction": {"transactionReceipt": create_receipt(self.secret)}},
+            headers=self.headers(target, "viewer"),
+        )
+        return resp.status_code
+
+    def edit_text(self, session: requests.Session, target: Target, rng: random.Random) -> int:
+        """Edit a text element, which invalidates the layout and sends a refresh message.
+
+        :param session: session of the client
+        :param target: broadcaster to send the request for
+        :param rng: random number generator of the client
+        :return: response status
+        """
+        element_id, text_id = rng.choice(target.texts)
+        resp = session.put(
+            f"{self.base_url}/element/{element_id}/text/{text_id}/edit",
+            data={"text": f"edited {rng.randrange(1000)}"},
+            headers=self.headers(target, "broadcaster"),
+        )
+        return resp.status_code
+
+    def run(self, total: int, concurrency: int) -> float:
+        """Send requests until the total has been sent.
+
+        :param total: number of requests to send
+        :param concurrency: number of clients sending requests at the same time
+        :return: number of seconds taken to send the requests
+        """
+        remaining = itertools.count()
+        names = list(self.mix)
+        weights = list(self.mix.values())
+
+        def client(client_id: int) -> None:
+            rng = random.Random(self.seed * 1000 + client_id)
+            with requests.Session() as session:
+                while next(remaining) < total:
+                    name = rng.choices(names, weights)[0]
+                    target = rng.choice(self.targets)
+                    start = time.perf_counter()
+                    try:
+                        status: Optional[int] = self.scenarios[name](session, target, rng)
+                    except requests.RequestException:
+                        status = None
+                    elapsed = time.perf_counter() - start
+                    with self.lock:
+                        self.latencies[name].append(elapsed)
+                        if status is None or status >= 400:
+                            self.errors[name] += 1
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            list(executor.map(client, range(concurrency)))
+
+        return time.perf_counter() - start
+
+    def reset(self) -> None:
+        """Forget the results so far, e.g. after warming up."""
+        for name in self.mix:
+            self.latencies[name] = []
+            self.errors[name] = 0
+
+
+def summarize(latencies: list[float]) -> dict[str, float]:
+    """Get the percentiles of a list of latencies.
+
+    :param latencies: latencies in seconds
+    :return: p50, p95, p99 and maximum latency in milliseconds
+    """
+    if not latencies:
+        return {}
+
+    ordered = sorted(latencies)
+
+    def percentile(pct: float) -> float:
+        return round(ordered[max(math.ceil(pct / 100 * len(ordered)) - 1, 0)] * 1000, 3)
+
+    return {
+        "p50": percentile(50),
+        "p95": percentile(95),
+        "p99": percentile(99),
+        "max": round(ordered[-1] * 1000, 3),
+    }
+
+
+def parse_mix(mix: str) -> dict[str, int]:
+    """Parse the weights of each scenario, e.g. "layout=70,image=20,redeem=5,edit=5".
+
+    :param mix: comma separated list of scenario=weight
+    :raises ValueError: if the mix contains an unknown scenario
+    :return: weight of each scenario
+    """
+    weights = {}
+    for item in mix.split(","):
+        name, weight = item.split("=")
+        if name not in ("layout", "image", "redeem", "edit"):
+            raise ValueError(f"unknown scenario {name}")
+        weights[name] = int(weight)
+
+    return weights
+
+
+def main() -> None:  # pylint: disable=too-many-locals
+    """Run the load test and print the results as json."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--database-uri",
+        help="database to run against, its tables are dropped (default: temporary sqlite file)",
+    )
+    parser.add_argument("--broadcasters", type=int, default=20)
+    parser.add_argument("--elements", type=int, default=3, help="elements of each type per layout")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--twitch-latency", type=float, default=0.05, help="seconds")
+    parser.add_argument("--webhook-latency", type=float, default=0.1, help="seconds")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    secret = os.urandom(32)
+    twitch_stub = StubServer(args.twitch_latency, 204)
+    webhook_stub = StubServer(args.webhook_latency, 200)
+    for stub in (twitch_stub, webhook_stub):
+        threading.Thread(target=stub.serve_forever, daemon=True).start()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_uri = args.database_uri or f"sqlite:///{directory}/loadtest.sqlite"
+        app = create_app(
+            create_config(database_uri, twitch_stub.url, base64.b64encode(secret).decode())
+        )
+        queries = QueryCounter()
+        with app.app_context():
+            targets = seed(args.broadcasters, args.elements, f"{webhook_stub.url}/hook")
+            event.listen(db.engine, "before_cursor_execute", queries.before_cursor_execute)
+
+        # keep the access log out of the results printed to stdout
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+        server = make_server("127.0.0.1", 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        loadtest = LoadTest(f"http://127.0.0.1:{server.port}", secret, targets, mix, args.seed)
+        loadtest.run(args.warmup, args.concurrency)
+        loadtest.reset()
+        queries.reset()
+        pubsub_before = twitch_stub.count
+        webhooks_before = webhook_stub.count
+        duration = loadtest.run(args.requests, args.concurrency)
+
+        # wait for the delivery workers so their queries and webhooks are counted
+        redeemed = len(loadtest.latencies.get("redeem", [])) - loadtest.errors.get("redeem", 0)
+        deadline = time.monotonic() + DELIVERY_DRAIN_TIMEOUT
+        while webhook_stub.count - webhooks_before < redeemed and time.monotonic() < deadline:
+            time.sleep(0.1)
+
+        server.shutdown()
+
+    endpoints = {
+        "layout": "main.layout",
+        "image": "main.image_get",
+        "redeem": "main.redeem",
+        "edit": "main.text_edit",
+    }
+    all_latencies = list(itertools.chain.from_iterable(loadtest.latencies.values()))
+    results = {
+        "config": {
+            **vars(args),
+            "database_uri": database_uri.split("://")[0],
+            "mix": mix,
+        },
+        "duration_s": round(duration, 3),
+        "requests": len(all_latencies),
+        "errors": sum(loadtest.errors.values()),
+        "rps": round(len(all_latencies) / duration, 1),
+        "latency_ms": summarize(all_latencies),
+        "scenarios": {
+            name: {
+                "requests": len(latencies),
+                "errors": loadtest.errors[name],
+                "rps": round(len(latencies) / duration, 1),
+                "latency_ms": summarize(latencies),
+                "queries_per_request": round(
+                    queries.counts.get(endpoints[name], 0) / max(len(latencies), 1), 2
+                ),
+            }
+            for name, latencies in loadtest.latencies.items()
+        },
+        "queries": dict(sorted(queries.counts.items())),
+        "stubs": {
+            "pubsub_requests": twitch_stub.count - pubsub_before,
+            "webhook_requests": webhook_stub.count - webhooks_before,
+        },
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()